@@ -0,0 +1,219 @@
+import csv
+import datetime
+import imp
+import json
+import random
+import sqlite3
+import sys
+
+
+class FakeFact(object):
+    """
+    Looks like the facts returned by hamster.client.Storage.
+    """
+
+    def __init__(self, id, activity, start_time, end_time=None, category=None, description=None, tags=None):
+        self.id = id
+        self.activity = activity
+        self.original_activity = activity
+        self.category = category
+        self.description = description
+        self.tags = list(tags or [])
+        self.start_time = start_time
+        self.end_time = end_time
+        self.date = start_time.date()
+
+    @property
+    def delta(self):
+        return (self.end_time or datetime.datetime.now()) - self.start_time
+
+
+class FakeWorld(object):
+    """
+    Simulates the facts of a hamster user: a day full of already finished facts and a running one. Each call of
+    churn() stops the running fact and starts a new one with the given probability and edits some finished ones.
+    """
+
+    activities = [
+        'PROJ-%d fixing things',
+        'OPS-%d deployment',
+        '%d review',
+        'meeting about PROJ-%d',
+    ]
+
+    def __init__(self, facts_per_day=50, churn=0.1, edits=0.0, seed=42):
+        """
+        :param facts_per_day: number of facts of the simulated day
+        :param churn: probability that churn() stops the running fact and starts a new one
+        :param edits: probability that churn() edits one of the finished facts
+        :param seed: seed of the random generator, the same seed always simulates the same day
+        """
+        self.random = random.Random(seed)
+        self.churn_rate = churn
+        self.edit_rate = edits
+        self.next_id = 1
+        self.facts = []
+        now = datetime.datetime.now().replace(microsecond=0)
+        start = datetime.datetime.combine(now.date(), datetime.time(0, 0))
+        step = (now - start) // max(facts_per_day, 1)
+        for i in range(facts_per_day):
+            fact = self._new_fact(start + step * i)
+            if i < facts_per_day - 1:
+                fact.end_time = fact.start_time + step
+            self.facts.append(fact)
+
+    def _new_fact(self, start_time):
+        fact = FakeFact(
+            id=self.next_id,
+            activity=self.random.choice(self.activities) % self.random.randint(1, 500),
+            start_time=start_time,
+            category='work',
+            description='fact %d' % self.next_id,
+            tags=self.random.sample(['Development', 'Design', 'Deployment', 'PROJ-7', 'misc'], 2),
+        )
+        self.next_id += 1
+        return fact
+
+    @property
+    def running(self):
+        if self.facts and self.facts[-1].end_time is None:
+            return self.facts[-1]
+        return None
+
+    def churn(self):
+        """
+        Advances the simulation by one step.
+
+        :returns: number of facts changed
+        """
+        changed = 0
+        now = datetime.datetime.now().replace(microsecond=0)
+        if self.random.random() < self.churn_rate:
+            if self.running is not None:
+                self.running.end_time = now
+            self.facts.append(self._new_fact(now))
+            changed += 1
+        if self.facts and self.random.random() < self.edit_rate:
+            fact = self.random.choice(self.facts)
+            fact.description = 'edited %d' % self.random.randint(0, 1000)
+            changed += 1
+        return changed
+
+    def todays_facts(self):
+        return list(self.facts)
+
+    def facts_between(self, start_date, end_date):
+        return [fact for fact in self.facts if start_date <= fact.start_time.date() <= end_date]
+
+
+class FakeStorage(object):
+    """
+    Stands in for hamster.client.Storage, serving the facts of FakeStorage.world.
+    """
+
+    world = FakeWorld(facts_per_day=0)
+
+    def __init__(self):
+        pass
+
+    def get_todays_facts(self):
+        return self.world.todays_facts()
+
+    def get_facts(self, date, end_date=None, search_terms=''):
+        return self.world.facts_between(date, end_date or date)
+
+
+HAMSTER_SCHEMA = [
+    'CREATE TABLE categories (id INTEGER PRIMARY KEY, name VARCHAR2(500), search_name VARCHAR2(500))',
+    'CREATE TABLE activities (id INTEGER PRIMARY KEY, name VARCHAR2(500), search_name VARCHAR2(500), '
+    'category_id INTEGER, deleted INTEGER)',
+    'CREATE TABLE facts (id INTEGER PRIMARY KEY, activity_id INTEGER, start_time TIMESTAMP, end_time TIMESTAMP, '
+    'description VARCHAR2(500))',
+    'CREATE TABLE tags (id INTEGER PRIMARY KEY, name TEXT NOT NULL, autocomplete BOOL DEFAULT true)',
+    'CREATE TABLE fact_tags (fact_id INTEGER, tag_id INTEGER)',
+]
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _time(value):
+    return value.strftime(TIME_FORMAT) if value is not None else None
+
+
+def write_hamster_db(facts, path):
+    """
+    Writes the facts into a database with the tables of hamster, to be read by the sqlite fact source.
+    """
+    db = sqlite3.connect(path)
+    with db:
+        for statement in HAMSTER_SCHEMA:
+            db.execute(statement)
+        ids = {}
+
+        def id_of(table, name, **columns):
+            key = (table, name)
+            if key not in ids:
+                names = ['name'] + sorted(columns)
+                cursor = db.execute('INSERT INTO %s (%s) VALUES (%s)' % (
+                    table, ', '.join(names), ', '.join('?' * len(names))), [name] + [columns[c] for c in names[1:]])
+                ids[key] = cursor.lastrowid
+            return ids[key]
+
+        for fact in facts:
+            category_id = id_of('categories', fact.category) if fact.category else None
+            activity_id = id_of('activities', fact.activity, category_id=category_id)
+            db.execute(
+                'INSERT INTO facts (id, activity_id, start_time, end_time, description) VALUES (?, ?, ?, ?, ?)',
+                (fact.id, activity_id, _time(fact.start_time), _time(fact.end_time), fact.description),
+            )
+            db.executemany('INSERT INTO fact_tags (fact_id, tag_id) VALUES (?, ?)',
+                           [(fact.id, id_of('tags', tag)) for tag in fact.tags])
+    db.close()
+
+
+def _record(fact):
+    return {
+        'id': fact.id,
+        'activity': fact.activity,
+        'category': fact.category,
+        'description': fact.description,
+        'tags': list(fact.tags),
+        'start_time': _time(fact.start_time),
+        'end_time': _time(fact.end_time),
+    }
+
+
+def write_json(facts, path):
+    """
+    Writes the facts as JSON lines, to be read by the json fact source.
+    """
+    with open(path, 'wb') as feed:
+        for fact in facts:
+            feed.write(json.dumps(_record(fact)) + '\n')
+
+
+def write_csv(facts, path):
+    """
+    Writes the facts as CSV, to be read by the csv fact source.
+    """
+    fields = ['id', 'activity', 'category', 'description', 'tags', 'start_time', 'end_time']
+    with open(path, 'wb') as feed:
+        writer = csv.DictWriter(feed, fields)
+        writer.writeheader()
+        for fact in facts:
+            record = _record(fact)
+            record['tags'] = ','.join(record['tags'])
+            writer.writerow(dict((key, value.encode('utf-8') if isinstance(value, unicode) else value)
+                                 for key, value in record.items()))
+
+
+def install():
+    """
+    Installs the fake as hamster.client module, must be called before importing hamster_bridge.
+    """
+    hamster = imp.new_module('hamster')
+    client = imp.new_module('hamster.client')
+    client.Storage = FakeStorage
+    hamster.client = client
+    sys.modules.setdefault('hamster', hamster)
+    sys.modules.setdefault('hamster.client', client)
@@ -0,0 +1,363 @@
+import BaseHTTPServer
+import SocketServer
+import json
+import math
+import random
+import re
+import threading
+import time
+import urlparse
+from collections import Counter
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class MockTracker(object):
+    """
+    A local stand-in for a bugtracker's REST API, serving from a background thread. Each request is delayed by the
+    latency and fails with a 503 with the probability error_rate. With a rate_limit the requests above that many per
+    second are answered with 429 and a Retry-After header. The requests are counted by method and route.
+    """
+
+    # (method, regex of the path, name of the handler method), set by the subclasses
+    routes = []
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=42, rate_limit=0):
+        """
+        :param latency: seconds each request is delayed
+        :param error_rate: probability of a request failing with 503
+        :param seed: seed of the random generator deciding about errors
+        :param rate_limit: requests per second to accept, 0 for all
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.throttled = 0
+        self._tokens = float(rate_limit)
+        self._tokens_updated = time.time()
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def start(self):
+        tracker = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def handle_any(self):
+                tracker.handle(self)
+
+            do_GET = do_POST = do_PUT = do_DELETE = handle_any
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = _Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _take_token(self):
+        # called with the lock held, returns the seconds until a token is available or 0 if one was taken
+        if not self.rate_limit:
+            return 0
+        now = time.time()
+        self._tokens = min(self.rate_limit, self._tokens + (now - self._tokens_updated) * self.rate_limit)
+        self._tokens_updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate_limit
+
+    def handle(self, request):
+        parsed = urlparse.urlparse(request.path)
+        length = int(request.headers.get('Content-Length') or 0)
+        body = request.rfile.read(length) if length else ''
+        with self.lock:
+            wait = self._take_token()
+            if wait:
+                self.throttled += 1
+        if wait:
+            payload = json.dumps({'errorMessages': ['Rate limit exceeded']})
+            request.send_response(429)
+            request.send_header('Retry-After', str(int(math.ceil(wait))))
+            request.send_header('X-RateLimit-Remaining', '0')
+            request.send_header('Content-Type', 'application/json')
+            request.send_header('Content-Length', str(len(payload)))
+            request.end_headers()
+            request.wfile.write(payload)
+            return
+        for method, pattern, handler in self.routes:
+            match = re.match(pattern + '$', parsed.path)
+            if method == request.command and match:
+                with self.lock:
+                    self.calls[(method, handler)] += 1
+                    fail = self.random.random() < self.error_rate
+                if self.latency:
+                    time.sleep(self.latency)
+                if fail:
+                    status, data = 503, {'errorMessages': ['Injected error']}
+                else:
+                    query = dict((key, values[-1]) for key, values in urlparse.parse_qs(parsed.query).items())
+                    status, data = getattr(self, handler)(
+                        query, json.loads(body) if body else None, *match.groups()
+                    )
+                break
+        else:
+            with self.lock:
+                self.calls[(request.command, 'unknown')] += 1
+            status, data = 404, {'errorMessages': ['Unknown route %s %s' % (request.command, parsed.path)]}
+        payload = json.dumps(data) if data is not None else ''
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(payload)))
+        request.end_headers()
+        request.wfile.write(payload)
+
+
+class MockJira(MockTracker):
+    """
+    The parts of the JIRA REST API used by the JiraHamsterListener. Issues of the projects exist up to number
+    issues_per_project, every tenth of them is "Done" and has to be reopened before it can be started, the others are
+    "Open" with a "Start Progress" transition to "In Progress".
+    """
+
+    # id, name and category of the statuses
+    statuses = {
+        '1': ('Open', 'new'),
+        '3': ('In Progress', 'indeterminate'),
+        '6': ('Done', 'done'),
+    }
+
+    # the transitions (id, name, id of the target status) by id of the status they are available in
+    workflow = {
+        '1': [('4', 'Start Progress', '3'), ('5', 'Resolve Issue', '6')],
+        '3': [('301', 'Stop Progress', '1'), ('5', 'Resolve Issue', '6')],
+        '6': [('3', 'Reopen Issue', '1')],
+    }
+
+    routes = [
+        ('GET', r'/rest/api/2/serverInfo', 'server_info'),
+        ('GET', r'/rest/api/2/field', 'fields'),
+        ('GET', r'/rest/api/2/project', 'projects'),
+        ('GET', r'/rest/api/2/search', 'search'),
+        ('GET', r'/rest/api/2/issue/([A-Z0-9]+-[0-9]+)', 'issue'),
+        ('GET', r'/rest/api/2/issue/([A-Z0-9]+-[0-9]+)/transitions', 'transitions'),
+        ('POST', r'/rest/api/2/issue/([A-Z0-9]+-[0-9]+)/transitions', 'transition_issue'),
+        ('GET', r'/rest/api/2/issue/([A-Z0-9]+-[0-9]+)/worklog', 'worklogs'),
+        ('POST', r'/rest/api/2/issue/([A-Z0-9]+-[0-9]+)/worklog', 'add_worklog'),
+        ('PUT', r'/rest/api/2/issue/([A-Z0-9]+-[0-9]+)/worklog/([0-9]+)', 'update_worklog'),
+        ('DELETE', r'/rest/api/2/issue/([A-Z0-9]+-[0-9]+)/worklog/([0-9]+)', 'delete_worklog'),
+    ]
+
+    def __init__(self, projects=('PROJ', 'OPS'), issues_per_project=300, **kwargs):
+        super(MockJira, self).__init__(**kwargs)
+        self.projects_keys = projects
+        self.issues_per_project = issues_per_project
+        self.worklogs_by_issue = {}
+        self.status_by_issue = {}
+
+    def _exists(self, key):
+        project, number = key.rsplit('-', 1)
+        return project in self.projects_keys and 0 < int(number) <= self.issues_per_project
+
+    def _status_by_id(self, status):
+        name, category = self.statuses[status]
+        return {'id': status, 'name': name, 'statusCategory': {'key': category}}
+
+    def _status(self, key):
+        if key not in self.status_by_issue:
+            self.status_by_issue[key] = '6' if int(key.rsplit('-', 1)[1]) % 10 == 0 else '1'
+        return self._status_by_id(self.status_by_issue[key])
+
+    def _issue(self, key):
+        project = key.rsplit('-', 1)[0]
+        return {
+            'id': str(abs(hash(key)) % 100000),
+            'key': key,
+            'self': '%s/rest/api/2/issue/%s' % (self.url, key),
+            'fields': {
+                'summary': 'Issue %s' % key,
+                'status': self._status(key),
+                'issuetype': {'id': '1', 'name': 'Task'},
+                'project': {'id': '1', 'key': project},
+            },
+        }
+
+    def server_info(self, query, body):
+        return 200, {'version': '7.0.0', 'versionNumbers': [7, 0, 0], 'baseUrl': self.url}
+
+    def fields(self, query, body):
+        return 200, []
+
+    def projects(self, query, body):
+        return 200, [{'id': str(i), 'key': key, 'name': key} for i, key in enumerate(self.projects_keys)]
+
+    def search(self, query, body):
+        keys = re.findall(r'[A-Z][A-Z0-9]+-[0-9]+', query.get('jql', ''))
+        issues = [self._issue(key) for key in keys if self._exists(key)]
+        return 200, {'startAt': 0, 'maxResults': 50, 'total': len(issues), 'issues': issues}
+
+    def issue(self, query, body, key):
+        if not self._exists(key):
+            return 404, {'errorMessages': ['Issue Does Not Exist'], 'errors': {}}
+        return 200, self._issue(key)
+
+    def transitions(self, query, body, key):
+        with self.lock:
+            status = self._status(key)['id']
+            transitions = [
+                {'id': transition_id, 'name': name, 'to': self._status_by_id(target)}
+                for transition_id, name, target in self.workflow[status]
+            ]
+        return 200, {'transitions': transitions}
+
+    def transition_issue(self, query, body, key):
+        transition_id = str(body['transition']['id'])
+        with self.lock:
+            for available, name, target in self.workflow[self._status(key)['id']]:
+                if available == transition_id:
+                    self.status_by_issue[key] = target
+                    return 204, None
+        return 400, {'errorMessages': ["Transition id '%s' is not valid for this issue." % transition_id]}
+
+    def worklogs(self, query, body, key):
+        worklogs = self.worklogs_by_issue.get(key, [])
+        return 200, {'startAt': 0, 'maxResults': len(worklogs), 'total': len(worklogs), 'worklogs': worklogs}
+
+    def add_worklog(self, query, body, key):
+        with self.lock:
+            worklogs = self.worklogs_by_issue.setdefault(key, [])
+            worklog = dict(body, id=str(len(worklogs) + 1), self='%s/rest/api/2/issue/%s/worklog/%d' % (
+                self.url, key, len(worklogs) + 1))
+            worklogs.append(worklog)
+        return 201, worklog
+
+    def _find_worklog(self, key, worklog_id):
+        for worklog in self.worklogs_by_issue.get(key, []):
+            if worklog['id'] == worklog_id:
+                return worklog
+        return None
+
+    def update_worklog(self, query, body, key, worklog_id):
+        with self.lock:
+            worklog = self._find_worklog(key, worklog_id)
+            if worklog is None:
+                return 404, {'errorMessages': ['Cannot find worklog with id: %s' % worklog_id], 'errors': {}}
+            worklog.update(body)
+        return 200, worklog
+
+    def delete_worklog(self, query, body, key, worklog_id):
+        with self.lock:
+            worklog = self._find_worklog(key, worklog_id)
+            if worklog is None:
+                return 404, {'errorMessages': ['Cannot find worklog with id: %s' % worklog_id], 'errors': {}}
+            self.worklogs_by_issue[key].remove(worklog)
+        return 204, None
+
+
+class MockRedmine(MockTracker):
+    """
+    The parts of the Redmine REST API used by the RedmineHamsterListener. Issues exist up to number issues, all of
+    them in the default status "New".
+    """
+
+    routes = [
+        ('GET', r'/enumerations/time_entry_activities\.json', 'activities'),
+        ('GET', r'/issue_statuses\.json', 'issue_statuses'),
+        ('GET', r'/issues/([0-9]+)\.json', 'issue'),
+        ('PUT', r'/issues/([0-9]+)\.json', 'save_issue'),
+        ('GET', r'/time_entries\.json', 'time_entries'),
+        ('POST', r'/time_entries\.json', 'create_time_entry'),
+        ('PUT', r'/time_entries/([0-9]+)\.json', 'update_time_entry'),
+        ('DELETE', r'/time_entries/([0-9]+)\.json', 'delete_time_entry'),
+    ]
+
+    def __init__(self, issues=500, **kwargs):
+        super(MockRedmine, self).__init__(**kwargs)
+        self.issues = issues
+        self.time_entries_list = []
+
+    def activities(self, query, body):
+        return 200, {'time_entry_activities': [
+            {'id': 9, 'name': 'Development', 'is_default': True},
+            {'id': 8, 'name': 'Design'},
+            {'id': 10, 'name': 'Deployment'},
+        ]}
+
+    def issue_statuses(self, query, body):
+        return 200, {'issue_statuses': [
+            {'id': 1, 'name': 'New', 'is_default': True},
+            {'id': 2, 'name': 'In Work'},
+            {'id': 5, 'name': 'Closed', 'is_closed': True},
+        ]}
+
+    def issue(self, query, body, issue_id):
+        if not 0 < int(issue_id) <= self.issues:
+            return 404, None
+        return 200, {'issue': {
+            'id': int(issue_id),
+            'subject': 'Issue %s' % issue_id,
+            'project': {'id': 1, 'name': 'Project'},
+            'status': {'id': 1, 'name': 'New'},
+        }}
+
+    def save_issue(self, query, body, issue_id):
+        return 200, None
+
+    def time_entries(self, query, body):
+        entries = [
+            entry for entry in self.time_entries_list
+            if str(entry['issue']['id']) == query.get('issue_id', str(entry['issue']['id']))
+        ]
+        return 200, {'time_entries': entries, 'total_count': len(entries), 'offset': 0, 'limit': 100}
+
+    def create_time_entry(self, query, body):
+        with self.lock:
+            entry = dict(body['time_entry'], id=len(self.time_entries_list) + 1)
+            entry['issue'] = {'id': int(entry.pop('issue_id'))}
+            self.time_entries_list.append(entry)
+        return 201, {'time_entry': entry}
+
+    def _find_time_entry(self, entry_id):
+        for entry in self.time_entries_list:
+            if entry['id'] == int(entry_id):
+                return entry
+        return None
+
+    def update_time_entry(self, query, body, entry_id):
+        with self.lock:
+            entry = self._find_time_entry(entry_id)
+            if entry is None:
+                return 404, None
+            fields = dict(body['time_entry'])
+            if 'issue_id' in fields:
+                entry['issue'] = {'id': int(fields.pop('issue_id'))}
+            entry.update(fields)
+        return 200, None
+
+    def delete_time_entry(self, query, body, entry_id):
+        with self.lock:
+            entry = self._find_time_entry(entry_id)
+            if entry is None:
+                return 404, None
+            self.time_entries_list.remove(entry)
+        return 200, None
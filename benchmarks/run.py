@@ -0,0 +1,312 @@
+"""
+Benchmarks of the hamster-bridge against a simulated hamster and local stand-ins of JIRA and Redmine, runs offline.
+
+    python -m benchmarks.run [--facts 500] [--latency 0.02] [--json]
+"""
+import argparse
+import ConfigParser
+import gc
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks import fake_hamster
+
+fake_hamster.install()
+
+from hamster_bridge.bridge import HamsterBridge  # noqa: E402
+from hamster_bridge.listeners import HamsterListener  # noqa: E402
+from hamster_bridge.snapshot import BridgeFact  # noqa: E402
+from benchmarks.mock_servers import MockJira, MockRedmine  # noqa: E402
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def _rss():
+    """
+    :returns: resident set size of this process in bytes (Linux only)
+    """
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class SleepyListener(HamsterListener):
+    """
+    Pretends to talk to a bugtracker that takes the given seconds per call.
+    """
+
+    short_name = 'sleepy'
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def on_fact_started(self, fact):
+        time.sleep(self.delay)
+        with self.lock:
+            self.calls += 1
+
+    on_fact_stopped = on_fact_started
+
+
+def bench_tick(args):
+    """
+    Latency of a single check of the bridge with a day of args.facts facts that change with args.churn.
+    """
+    fake_hamster.FakeStorage.world = fake_hamster.FakeWorld(facts_per_day=args.facts, churn=args.churn, edits=0.05)
+    bridge = HamsterBridge(workers=0, use_outbox=False, name='bench')
+    bridge.start()
+    durations = []
+    for _ in range(args.ticks):
+        fake_hamster.FakeStorage.world.churn()
+        started = time.time()
+        bridge.check()
+        durations.append(time.time() - started)
+    bridge.stop()
+    return {
+        'facts_per_tick': len(fake_hamster.FakeStorage.world.facts),
+        'tick_mean_ms': 1000 * sum(durations) / len(durations),
+        'tick_p95_ms': 1000 * _percentile(durations, 95),
+        'tick_max_ms': 1000 * max(durations),
+    }
+
+
+def bench_dispatch(args):
+    """
+    Throughput of the listener dispatch with a bugtracker taking args.latency seconds per call.
+    """
+    listener = SleepyListener(args.latency)
+    bridge = HamsterBridge(workers=args.workers, queue_size=args.events, use_outbox=False, name='bench')
+    bridge.add_listener(listener)
+    fake_hamster.FakeStorage.world = fake_hamster.FakeWorld(facts_per_day=0)
+    bridge.start()
+    fact = BridgeFact.from_hamster(fake_hamster.FakeWorld(facts_per_day=1).facts[0])
+    started = time.time()
+    for _ in range(args.events):
+        bridge._notify('on_fact_started', fact)
+    submitted = time.time() - started
+    bridge.stop(timeout=None)
+    elapsed = time.time() - started
+    return {
+        'events': listener.calls,
+        'submit_ms_per_event': 1000 * submitted / args.events,
+        'events_per_second': listener.calls / elapsed,
+    }
+
+
+def _configure(listener, values):
+    config = ConfigParser.RawConfigParser()
+    config.add_section(listener.short_name)
+    for key, value in values.items():
+        config.set(listener.short_name, key, value)
+    listener.configure(config, ConfigParser.RawConfigParser())
+    listener.prepare()
+    return listener
+
+
+def _bench_tracker(args, tracker, listener_factory):
+    world = fake_hamster.FakeWorld(facts_per_day=args.tracker_facts)
+    tracker.start()
+    try:
+        listener = listener_factory(tracker)
+        tracker.calls.clear()
+        tracker.throttled = 0
+        started = time.time()
+        for fact in [BridgeFact.from_hamster(fact) for fact in world.facts]:
+            listener.on_fact_started(fact)
+            if fact.end_time is not None:
+                listener.on_fact_stopped(fact)
+        elapsed = time.time() - started
+        return {
+            'facts': len(world.facts),
+            'http_calls_per_fact': float(tracker.total_calls) / len(world.facts),
+            'ms_per_fact': 1000 * elapsed / len(world.facts),
+            'calls': dict(('%s %s' % key, count) for key, count in sorted(tracker.calls.items())),
+            'throttled': tracker.throttled,
+        }
+    finally:
+        tracker.stop()
+
+
+def bench_jira(args):
+    """
+    HTTP calls and time per fact of the JIRA listener against the stand-in server.
+    """
+    try:
+        from hamster_bridge.listeners.jira import JiraHamsterListener
+    except ImportError as e:
+        return {'skipped': str(e)}
+
+    def factory(tracker):
+        return _configure(JiraHamsterListener(), {
+            'server_url': tracker.url,
+            'username': 'bench',
+            'password': 'bench',
+            'auto_start': 'y',
+            'verify_ssl': 'n',
+        })
+
+    tracker = MockJira(latency=args.latency, error_rate=args.error_rate, rate_limit=args.rate_limit)
+    return _bench_tracker(args, tracker, factory)
+
+
+def bench_redmine(args):
+    """
+    HTTP calls and time per fact of the Redmine listener against the stand-in server.
+    """
+    try:
+        from hamster_bridge.listeners.redmine import RedmineHamsterListener
+        import redmine  # noqa: F401
+    except ImportError as e:
+        return {'skipped': str(e)}
+
+    def factory(tracker):
+        return _configure(RedmineHamsterListener(), {
+            'server_url': tracker.url,
+            'api_key': 'bench',
+            'version': '2.5.1',
+            'auto_start': 'y',
+            'verify_ssl': 'n',
+            # python-redmine before 2.0 has no session, so the limit can't be learned from the responses
+            'rate_limit': str(args.rate_limit),
+        })
+
+    tracker = MockRedmine(latency=args.latency, error_rate=args.error_rate, rate_limit=args.rate_limit)
+    return _bench_tracker(args, tracker, factory)
+
+
+def bench_memory(args):
+    """
+    Memory held by the bridge for a day of args.facts * 10 facts.
+    """
+    gc.collect()
+    before = _rss()
+    fake_hamster.FakeStorage.world = fake_hamster.FakeWorld(facts_per_day=args.facts * 10)
+    world_size = _rss() - before
+    bridge = HamsterBridge(workers=0, use_outbox=False, name='bench')
+    bridge.start()
+    gc.collect()
+    bridge_size = _rss() - before - world_size
+    bridge.stop()
+    return {
+        'facts': args.facts * 10,
+        'hamster_bytes_per_fact': float(world_size) / (args.facts * 10),
+        'bridge_bytes_per_fact': float(bridge_size) / (args.facts * 10),
+    }
+
+
+def bench_sources(args):
+    """
+    Time per fact to read a day of args.facts * 10 facts from each fact source, the file based ones from fixtures.
+    """
+    from hamster_bridge.sources import create_source
+
+    world = fake_hamster.FakeWorld(facts_per_day=args.facts * 10)
+    fake_hamster.FakeStorage.world = world
+    directory = tempfile.mkdtemp(prefix='hamster-bridge-bench-')
+    try:
+        fake_hamster.write_hamster_db(world.facts, os.path.join(directory, 'hamster.db'))
+        fake_hamster.write_json(world.facts, os.path.join(directory, 'facts.json'))
+        fake_hamster.write_csv(world.facts, os.path.join(directory, 'facts.csv'))
+        results = {'facts': len(world.facts)}
+        for name, spec in [
+            ('dbus', 'dbus'),
+            ('sqlite', 'sqlite:%s' % os.path.join(directory, 'hamster.db')),
+            ('json', 'json:%s' % os.path.join(directory, 'facts.json')),
+            ('csv', 'csv:%s' % os.path.join(directory, 'facts.csv')),
+        ]:
+            source = create_source(spec)
+            started = time.time()
+            count = sum(1 for _ in source.todays_facts())
+            results['%s_us_per_fact' % name] = 1e6 * (time.time() - started) / max(count, 1)
+            source.close()
+            if count != len(world.facts):
+                results['%s_missing' % name] = len(world.facts) - count
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_routing(args):
+    """
+    Time per fact to pick the listeners of args.facts facts with routing rules for three bugtrackers, the first time
+    and again with the remembered results.
+    """
+    from hamster_bridge.routing import FactRouter
+
+    router = FactRouter({
+        'product': [('category', 'product'), ('tag', 'PROJ-.*')],
+        'ops': [('tag', 'Deployment'), ('activity', 'ops .*')],
+        'design': [('tag', 'Design|misc')],
+    })
+    listeners = []
+    for name in ('product', 'ops', 'design', 'everything'):
+        listener = SleepyListener(0)
+        listener.short_name = name
+        listeners.append(listener)
+    facts = [BridgeFact.from_hamster(fact) for fact in fake_hamster.FakeWorld(facts_per_day=args.facts).facts]
+    results = {'facts': len(facts)}
+    for run in ('first', 'again'):
+        started = time.time()
+        routed = sum(len(router.route(fact, listeners)) for fact in facts)
+        results['%s_us_per_fact' % run] = 1e6 * (time.time() - started) / len(facts)
+    results['listeners_per_fact'] = float(routed) / len(facts)
+    return results
+
+
+SCENARIOS = [
+    ('tick', bench_tick),
+    ('dispatch', bench_dispatch),
+    ('jira', bench_jira),
+    ('redmine', bench_redmine),
+    ('memory', bench_memory),
+    ('sources', bench_sources),
+    ('routing', bench_routing),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the hamster-bridge against simulated servers.')
+    parser.add_argument('scenarios', nargs='*', choices=[[]] + [name for name, _ in SCENARIOS],
+                        help='scenarios to run, defaults to all')
+    parser.add_argument('--facts', default=500, type=int, help='facts per simulated day')
+    parser.add_argument('--ticks', default=200, type=int, help='checks to run in the tick scenario')
+    parser.add_argument('--churn', default=0.2, type=float, help='probability of a fact change per tick')
+    parser.add_argument('--events', default=200, type=int, help='events to dispatch in the dispatch scenario')
+    parser.add_argument('--workers', default=4, type=int, help='worker threads in the dispatch scenario')
+    parser.add_argument('--tracker-facts', default=50, type=int, help='facts to send to the stand-in trackers')
+    parser.add_argument('--latency', default=0.01, type=float, help='seconds each tracker request takes')
+    parser.add_argument('--error-rate', default=0.0, type=float, help='probability of a tracker request failing')
+    parser.add_argument('--rate-limit', default=0, type=float,
+                        help='requests per second the trackers accept before answering 429, 0 for no limit')
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    parser.add_argument('-d', '--debug', action='store_true', help='enable debug logging')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.CRITICAL)
+
+    results = {}
+    for name, scenario in SCENARIOS:
+        if args.scenarios and name not in args.scenarios:
+            continue
+        results[name] = scenario(args)
+        if not args.json:
+            print('%s:' % name)
+            for key, value in sorted(results[name].items()):
+                print('  %-24s %s' % (key, '%.3f' % value if isinstance(value, float) else value))
+    if args.json:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print('')
+
+
+if __name__ == '__main__':
+    main()
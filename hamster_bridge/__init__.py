@@ -1,7 +1,7 @@
 import argparse
+import datetime
 import logging
-
-from hamster_bridge.bridge import HamsterBridge
+import sys
 
 
 CONFIG_PATH = '~/.hamster-bridge.cfg'
@@ -15,42 +15,318 @@ def import_listener(name):
     return mod
 
 
-LISTENERS = [
-    'hamster_bridge.listeners.jira.JiraHamsterListener',
-    'hamster_bridge.listeners.redmine.RedmineHamsterListener',
+LISTENERS = {
+    'jira': 'hamster_bridge.listeners.jira.JiraHamsterListener',
+    'redmine': 'hamster_bridge.listeners.redmine.RedmineHamsterListener',
     # your backend missing? contributions welcome!
-]
+}
 
+# entry point group of third-party listeners, the name of the entry point is the short name of the listener
+PLUGIN_GROUP = 'hamster_bridge.listeners'
 
-def main():
-    listener_choices = dict(
-        (lc.short_name, lc) for lc in [import_listener(l) for l in LISTENERS]
+
+class ListenerRegistry(object):
+    """
+    The listener classes by short name. Listeners are imported only when they are selected, so the dependencies of the
+    other bugtrackers are never loaded. Third-party listeners are found via their entry points, which are only looked
+    up if the name is none of the built-in ones.
+    """
+
+    def __init__(self, listeners=None, group=PLUGIN_GROUP):
+        """
+        :param listeners: dotted paths of the built-in listener classes by short name, defaults to LISTENERS
+        :type  listeners: dict
+        :param group: entry point group of third-party listeners
+        :type  group: str
+        """
+        self.listeners = dict(LISTENERS if listeners is None else listeners)
+        self.group = group
+        self._plugins = None
+        self._loaded = {}
+
+    def plugins(self):
+        """
+        :returns: the entry points of the installed third-party listeners by short name
+        :rtype: dict
+        """
+        if self._plugins is None:
+            try:
+                import pkg_resources
+            except ImportError:
+                self._plugins = {}
+            else:
+                self._plugins = dict(
+                    (entry_point.name, entry_point) for entry_point in pkg_resources.iter_entry_points(self.group)
+                )
+        return self._plugins
+
+    def names(self):
+        """
+        :returns: the short names of all available listeners
+        :rtype: list
+        """
+        return sorted(set(self.listeners) | set(self.plugins()))
+
+    def __contains__(self, name):
+        return name in self.listeners or name in self.plugins()
+
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            if name in self.listeners:
+                self._loaded[name] = import_listener(self.listeners[name])
+            elif name in self.plugins():
+                self._loaded[name] = self.plugins()[name].load()
+            else:
+                raise KeyError(name)
+        return self._loaded[name]
+
+    def argument(self, name):
+        """
+        Checks a bugtracker given on the command line, to be used as argparse type.
+        """
+        if name not in self:
+            raise argparse.ArgumentTypeError(
+                'invalid choice: %r (choose from %s)' % (name, ', '.join(repr(n) for n in self.names()))
+            )
+        return name
+
+    def add_argument(self, parser, multiple=False):
+        """
+        :param multiple: accept several bugtrackers, the facts are routed to them by the [routing] section of the config
+        :type  multiple: bool
+        """
+        help = '%s or the name of an installed listener plugin' % ', '.join(sorted(self.listeners))
+        if multiple:
+            parser.add_argument('bugtracker', type=self.argument, nargs='+',
+                                help=help + ', several ones get the facts picked by the [routing] section')
+        else:
+            parser.add_argument('bugtracker', type=self.argument, help=help)
+
+
+def _setup_logging(debug):
+    logging.basicConfig(
+        level=logging.DEBUG if debug else logging.INFO,
+        format='%(asctime)-15s %(levelname)+7s{}: %(message)s'.format(' [%(name)s]' if debug else '')
     )
 
-    parser = argparse.ArgumentParser(description='Let your hamster log your work to your favorite bugtracker.')
-    parser.add_argument('bugtracker', choices=sorted(listener_choices.keys()))
+
+def _add_metrics_arguments(parser):
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve prometheus metrics on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--metrics-textfile', type=str,
+                        help='write prometheus metrics to this file every 15 seconds, f.e. for the node exporter')
+
+
+def _start_metrics(args):
+    if args.metrics_port is None and args.metrics_textfile is None:
+        return
+    from hamster_bridge import metrics
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port)
+    if args.metrics_textfile is not None:
+        metrics.start_textfile_writer(args.metrics_textfile)
+
+
+def _add_profile_arguments(parser):
+    parser.add_argument('--profile', action='store_true',
+                        help='time the checks and listener calls, write a JSON trace of the slow ones and a cProfile '
+                             'snapshot on SIGUSR1')
+    parser.add_argument('--profile-threshold', default='1', type=float,
+                        help='with --profile write the trace of checks and listener calls taking this amount of '
+                             'seconds or more')
+    parser.add_argument('--profile-dir', type=str,
+                        help='with --profile write the traces and snapshots to this directory, defaults to the '
+                             'temporary directory')
+
+
+def _start_profiler(args):
+    if not args.profile:
+        return
+    from hamster_bridge.profiling import PROFILER
+    PROFILER.enable(args.profile_threshold, args.profile_dir)
+    PROFILER.install_signal_handler()
+
+
+def _add_source_argument(parser):
+    parser.add_argument('--source', default='dbus', type=str,
+                        help='where to get the facts from: dbus (the running hamster, default), sqlite[:PATH] '
+                             '(hamster\'s database, read only), json:PATH or csv:PATH')
+
+
+def _create_source(parser, args):
+    from hamster_bridge.sources import create_source
+    try:
+        return create_source(args.source)
+    except (ValueError, IOError) as e:
+        parser.error(str(e))
+
+
+def _date(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError('not a date in the format YYYY-MM-DD: %r' % value)
+
+
+def sync(argv=None):
+    """
+    Uploads the facts of a date range that are missing on the bugtracker, f.e. the ones tracked while the bridge was
+    not running.
+    """
+    listener_choices = ListenerRegistry()
+
+    parser = argparse.ArgumentParser(
+        prog='hamster-bridge sync',
+        description='Upload the work of a date range that is missing on your favorite bugtracker.',
+    )
+    listener_choices.add_argument(parser)
+    parser.add_argument('--from', dest='from_date', required=True, type=_date, help='first day, f.e. 2015-03-01')
+    parser.add_argument('--to', dest='to_date', default=datetime.date.today(), type=_date,
+                        help='last day (inclusive), defaults to today')
+    parser.add_argument('-d', '--debug', action='store_true', help='enable debug logging')
+    parser.add_argument('-w', '--workers', default='4', type=int, help='number of facts to upload concurrently')
+    parser.add_argument('--chunk-days', default='7', type=int, help='number of days to fetch from hamster at once')
+    parser.add_argument('--config-path', default=CONFIG_PATH, type=str,
+                        help='path to config file, defaults to {}'.format(CONFIG_PATH))
+    parser.add_argument('--save-passwords', action='store_true',
+                        help='store passwords and other sensitive data in the config file, defaults to False.')
+    parser.add_argument('--no-outbox', action='store_true',
+                        help='do not journal the uploads next to the config file')
+    _add_source_argument(parser)
+    args = parser.parse_args(argv)
+
+    _setup_logging(args.debug)
+    logger = logging.getLogger(__name__)
+
+    from hamster_bridge.bridge import HamsterBridge
+    from hamster_bridge.sync import Backfill
+
+    bridge = HamsterBridge(
+        save_passwords=args.save_passwords,
+        use_outbox=not args.no_outbox,
+        source=_create_source(parser, args),
+    )
+    listener = listener_choices[args.bugtracker]()
+    bridge.add_listener(listener)
+    bridge.configure(args.config_path)
+    listener.prepare()
+    logger.info('Syncing %s to %s with %s', args.from_date, args.to_date, args.bugtracker)
+    counts = Backfill(
+        bridge.source, listener, workers=args.workers, chunk_days=args.chunk_days, router=bridge.router,
+    ).run(
+        args.from_date,
+        args.to_date,
+    )
+    logger.info(
+        'Uploaded %(uploaded)d facts, skipped %(skipped)d, %(pending)d pending in the outbox, %(failed)d failed', counts
+    )
+
+
+def daemon(argv=None):
+    """
+    Runs the bridges of many users or profiles in a single process.
+    """
+    listener_choices = ListenerRegistry()
+
+    parser = argparse.ArgumentParser(
+        prog='hamster-bridge daemon',
+        description='Let the hamsters of many users log their work to their favorite bugtrackers.',
+    )
+    parser.add_argument('profiles', help='directory containing a config file (*.cfg) per user or profile')
+    parser.add_argument('-d', '--debug', action='store_true', help='enable debug logging')
+    parser.add_argument('-c', '--check-interval', default='10', type=int,
+                        help='check each profile every this amount of seconds for updates')
+    parser.add_argument('-w', '--workers', default='1', type=int,
+                        help='number of worker threads per profile and bugtracker')
+    parser.add_argument('--queue-size', default='100', type=int,
+                        help='maximum number of events waiting for a bugtracker')
+    parser.add_argument('--no-outbox', action='store_true',
+                        help='do not journal changes for the bugtracker next to the profiles to retry them on errors')
+    _add_metrics_arguments(parser)
+    _add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    _setup_logging(args.debug)
+    _start_metrics(args)
+    _start_profiler(args)
+
+    from hamster_bridge.daemon import BridgeDaemon
+
+    bridge_daemon = BridgeDaemon(interval=args.check_interval)
+    bridge_daemon.load_profiles(
+        args.profiles,
+        listener_choices,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        use_outbox=not args.no_outbox,
+    )
+    bridge_daemon.run()
+
+
+def main():
+    if sys.argv[1:2] == ['sync']:
+        return sync(sys.argv[2:])
+    if sys.argv[1:2] == ['daemon']:
+        return daemon(sys.argv[2:])
+
+    listener_choices = ListenerRegistry()
+
+    parser = argparse.ArgumentParser(
+        description='Let your hamster log your work to your favorite bugtracker.',
+        epilog='Run "%(prog)s sync --help" to upload the work of a past date range and "%(prog)s daemon --help" to '
+               'serve many users from one process.',
+    )
+    listener_choices.add_argument(parser, multiple=True)
     parser.add_argument('-d', '--debug', action='store_true', help='enable debug logging')
     parser.add_argument('-c', '--check-interval', default='2', type=int,
-                        help='check every this amount of seconds for updates')
+                        help='check every this amount of seconds for updates right after a change')
+    parser.add_argument('--max-interval', default='60', type=int,
+                        help='check at least every this amount of seconds while nothing changes, the same as '
+                             '--check-interval checks at a fixed interval')
+    parser.add_argument('-e', '--event-driven', action='store_true',
+                        help='check for updates only when hamster signals a change, polling is kept as safety net')
+    parser.add_argument('--safety-interval', default='60', type=int,
+                        help='in event driven mode check every this amount of seconds regardless of signals')
+    parser.add_argument('-w', '--workers', default='1', type=int,
+                        help='number of worker threads per bugtracker, 0 calls it directly in the check loop')
+    parser.add_argument('--queue-size', default='100', type=int,
+                        help='maximum number of events waiting for a bugtracker')
     parser.add_argument('--config-path', default=CONFIG_PATH, type=str, 
                         help='path to config file, defaults to {}'.format(CONFIG_PATH))
     parser.add_argument('--save-passwords', action='store_true',
                         help='store passwords and other sensitive data in the config file, defaults to False.')
+    parser.add_argument('--no-outbox', action='store_true',
+                        help='do not journal bugtracker changes next to the config file to retry them on errors')
+    _add_source_argument(parser)
+    _add_metrics_arguments(parser)
+    _add_profile_arguments(parser)
     args = parser.parse_args()
 
-    logging.basicConfig(
-        level=logging.DEBUG if args.debug else logging.INFO,
-        format='%(asctime)-15s %(levelname)+7s{}: %(message)s'.format(' [%(name)s]' if args.debug else '')
-    )
+    _setup_logging(args.debug)
+    _start_metrics(args)
+    _start_profiler(args)
     logger = logging.getLogger(__name__)
 
+    from hamster_bridge.bridge import HamsterBridge
+
     logger.info('Starting hamster bridge')
-    bridge = HamsterBridge(save_passwords=args.save_passwords)
-    logger.debug('Activating listener: %s', args.bugtracker)
-    bridge.add_listener(listener_choices[args.bugtracker]())
+    bridge = HamsterBridge(
+        save_passwords=args.save_passwords,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        use_outbox=not args.no_outbox,
+        source=_create_source(parser, args),
+    )
+    for bugtracker in sorted(set(args.bugtracker), key=args.bugtracker.index):
+        logger.debug('Activating listener: %s', bugtracker)
+        bridge.add_listener(listener_choices[bugtracker]())
     bridge.configure(args.config_path)
-    logger.debug('Run with check interval of %ds', args.check_interval)
-    bridge.run(args.check_interval)
+    if args.event_driven:
+        logger.debug('Run event driven with safety interval of %ds', args.safety_interval)
+        bridge.run_event_driven(args.safety_interval)
+    else:
+        logger.debug('Run with check interval of %ds to %ds', args.check_interval, args.max_interval)
+        bridge.run(args.check_interval, args.max_interval)
 
 if __name__ == "__main__":
     main()
@@ -1,17 +1,22 @@
 import ConfigParser
 import datetime
-import time
 import logging
 import os
 import stat
+from cStringIO import StringIO
 
-logger = logging.getLogger(__name__)
-
+from hamster_bridge import metrics
+from hamster_bridge.dispatch import ListenerDispatcher, call_listener
+from hamster_bridge.listeners import TIME_FORMAT
+from hamster_bridge.outbox import Outbox
+from hamster_bridge.profiling import PROFILER
+from hamster_bridge.routing import FactRouter
+from hamster_bridge.scheduler import AdaptivePoller
+from hamster_bridge.snapshot import BridgeFact, FactIndex
+from hamster_bridge.state import SyncState
+from hamster_bridge.watcher import WATCHER
 
-try:
-    import hamster.client
-except ImportError:
-    raise ImportError('Can not find hamster')
+logger = logging.getLogger(__name__)
 
 
 def _combine_configs(*configs):
@@ -36,15 +41,67 @@ def _combine_configs(*configs):
     return result
 
 
-class HamsterBridge(hamster.client.Storage):
+def _recorded_fact(state):
     """
-    Connects to the running hamster instance via dbus. But as the notification does not work reliable there is a
-    polling-based loop in the run()-method that will trigger all registered listeners.
+    Stands in for a fact that is gone from hamster, with the id and times recorded in the state. The listeners only
+    need those to find what they sent for it.
+
+    :param state: the state of the fact
+    :type  state: hamster_bridge.state.FactState
+    :rtype: BridgeFact
     """
-    def __init__(self, save_passwords=False):
-        super(HamsterBridge, self).__init__()
+    start_time = datetime.datetime.strptime(state.start_time, TIME_FORMAT)
+    return BridgeFact(state.fact_id, u'', None, None, (), start_time, start_time if state.stopped else None,
+                      datetime.timedelta(0))
+
+
+class HamsterBridge(object):
+    """
+    Gets the facts from a fact source, by default the running hamster instance via dbus. As the notification does not
+    work reliable in every hamster version there is a polling-based loop in the run()-method that will trigger all
+    registered listeners. Where the signals do work, run_event_driven() only checks after hamster announced a change
+    and keeps polling as safety net. With several listeners each fact goes to the ones the FactRouter picks, all of
+    them are fed from the same checks.
+    """
+
+    # days to look back for facts missed while the bridge was not running, use the sync command for longer breaks
+    resume_days = 7
+
+    def __init__(self, save_passwords=False, workers=1, queue_size=100, use_outbox=True, bus_address=None,
+                 name='default', source=None):
+        """
+        :param save_passwords: store sensitive config values in the config file, too
+        :type  save_passwords: bool
+        :param workers: number of worker threads per listener, 0 calls the listeners directly in the loop
+        :type  workers: int
+        :param queue_size: maximum number of pending events per listener
+        :type  queue_size: int
+        :param use_outbox: journal the changes for the bugtrackers in an outbox next to the config file and retry them
+        :type  use_outbox: bool
+        :param bus_address: address of the dbus the hamster instance is reachable on, defaults to the session bus
+        :type  bus_address: str
+        :param name: name of the bridge in logs and metrics
+        :type  name: str
+        :param source: where to get the facts from, defaults to hamster via the dbus at bus_address
+        :type  source: hamster_bridge.sources.FactSource
+        """
+        if source is None:
+            from hamster_bridge.sources.dbus import DBusSource
+            source = DBusSource(bus_address)
+        self.source = source
         self._listeners = []
+        self._dispatchers = {}
+        self._index = FactIndex(day_start=source.day_start)
+        self.router = FactRouter()
         self.save_passwords = save_passwords
+        self.workers = workers
+        self.queue_size = queue_size
+        self.use_outbox = use_outbox
+        self.outbox = None
+        self.state = None
+        self.name = name
+        self.config_path = None
+        self._sensitive_config = None
 
     def add_listener(self, listener):
         """
@@ -55,6 +112,12 @@ class HamsterBridge(hamster.client.Storage):
         """
         if listener not in self._listeners:
             self._listeners.append(listener)
+            if self.workers > 0:
+                self._dispatchers[listener] = ListenerDispatcher(
+                    listener,
+                    workers=self.workers,
+                    queue_size=self.queue_size,
+                )
 
     def configure(self, config_path):
         """
@@ -69,47 +132,384 @@ class HamsterBridge(hamster.client.Storage):
         if os.path.exists(path):
             logger.debug('Reading config file from %s', path)
             config.read(path)
+        self.router = self._create_router(config)
         # let listeners extend
         for listener in self._listeners:
             logger.debug('Configuring listener %s', listener)
             listener.configure(config, sensitive_config)
-        # save to file
-        with open(path, 'wb') as configfile:
-            logger.debug('Writing back configuration to %s', path)
-            if self.save_passwords:
-                all_configs = _combine_configs(config, sensitive_config)
-                all_configs.write(configfile)
-            else:
-                config.write(configfile)
+        # save to file, only if something changed so the file is not touched on every start
+        content = StringIO()
+        if self.save_passwords:
+            _combine_configs(config, sensitive_config).write(content)
+        else:
+            config.write(content)
+        content = content.getvalue()
+        current = None
+        if os.path.exists(path):
+            with open(path, 'rb') as configfile:
+                current = configfile.read()
+        if content != current:
+            with open(path, 'wb') as configfile:
+                logger.debug('Writing back configuration to %s', path)
+                configfile.write(content)
         # as we store passwords in clear text, let's at least set correct file permissions
-        logger.debug('Setting owner only file permissions to %s', path)
-        os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+        if stat.S_IMODE(os.stat(path).st_mode) != stat.S_IRUSR | stat.S_IWUSR:
+            logger.debug('Setting owner only file permissions to %s', path)
+            os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+        self.config_path = path
+        self._sensitive_config = sensitive_config
+        if self.use_outbox:
+            outbox_path = os.path.splitext(path)[0] + '.outbox.sqlite'
+            logger.debug('Journaling changes in %s', outbox_path)
+            self.outbox = Outbox(outbox_path)
+            os.chmod(outbox_path, stat.S_IRUSR | stat.S_IWUSR)
+            for listener in self._listeners:
+                self.outbox.register(listener)
+        state_path = os.path.splitext(path)[0] + '.state.sqlite'
+        logger.debug('Keeping the sync state in %s', state_path)
+        self.state = SyncState(state_path)
+        os.chmod(state_path, stat.S_IRUSR | stat.S_IWUSR)
+        for listener in self._listeners:
+            self.state.register(listener)
+
+    def _create_router(self, config):
+        """
+        :raises ValueError: if a routing rule is invalid
+        """
+        router = FactRouter.from_config(config)
+        names = set(listener.short_name for listener in self._listeners)
+        for name in sorted(set(router.rules) - names):
+            logger.warning('Ignoring the routing rule of %s, it is not one of the bugtrackers', name)
+        return router
+
+    def reload_config(self):
+        """
+        Reads the config file again and hands it to the listeners, which apply it if their section changed. Called by
+        the watcher of the config file while the bridge runs, so the config can be changed without a restart.
+        """
+        config = ConfigParser.RawConfigParser()
+        try:
+            config.read(self.config_path)
+        except ConfigParser.Error:
+            logger.exception('Keeping the previous config, can not read %s', self.config_path)
+            return
+        try:
+            router = self._create_router(config)
+        except ValueError as e:
+            logger.error('Keeping the previous routing rules: %s', e)
+        else:
+            if router != self.router:
+                self.router = router
+                logger.info('Reloaded the routing rules from %s', self.config_path)
+        for listener in self._listeners:
+            if listener.reload(config, self._sensitive_config):
+                logger.info('Reloaded the config of listener %s from %s', listener.short_name, self.config_path)
+
+    def _notify(self, method, fact, *args):
+        for listener in self.router.route(fact, self._listeners):
+            self._notify_listener(listener, method, fact, *args)
+
+    def _notify_created(self, listener, fact):
+        if fact.end_time is None:
+            self._notify_listener(listener, 'on_fact_started', fact)
+        else:
+            # created after it was already done, f.e. added afterwards or started and stopped between two checks
+            self._notify_listener(listener, 'on_fact_stopped', fact)
+
+    def _notify_edited(self, fact, previous):
+        """
+        Notifies the listeners about an edit. If the edit routes the fact to other listeners, the ones that no longer
+        get it see it deleted and the ones that get it now see it created.
+        """
+        before = self.router.route(previous, self._listeners)
+        after = self.router.route(fact, self._listeners)
+        for listener in self._listeners:
+            if listener in before and listener in after:
+                self._notify_listener(listener, 'on_fact_updated', fact, previous)
+            elif listener in before:
+                self._notify_listener(listener, 'on_fact_deleted', previous)
+            elif listener in after:
+                self._notify_created(listener, fact)
+
+    def _notify_listener(self, listener, method, *args):
+        dispatcher = self._dispatchers.get(listener)
+        if dispatcher is None:
+            # without workers a failing listener must neither stop the check nor keep the others from their events
+            try:
+                call_listener(listener, method, *args)
+            except Exception:
+                logger.exception('Listener %s failed in %s', listener.short_name, method)
+        else:
+            dispatcher.submit(method, *args)
+
+    def check(self):
+        """
+        Fetches today's facts from hamster, compares them with the facts seen on the last check and notifies the
+        listeners about the facts that were started, stopped, edited or deleted since then.
+
+        :returns: whether any fact changed
+        :rtype: bool
+        """
+        with metrics.CHECK_DURATION.time(bridge=self.name), PROFILER.span('check', bridge=self.name):
+            return self._check()
+
+    def _fetch_todays_facts(self):
+        """
+        :returns: today's facts
+        :rtype: list of BridgeFact
+        """
+        return list(self.source.todays_facts())
 
-    def run(self, polling_intervall=1):
+    def _check(self):
+        with metrics.FETCH_DURATION.time(bridge=self.name):
+            facts = self._fetch_todays_facts()
+        metrics.FACTS_SCANNED.set(len(facts), bridge=self.name)
+        diff = self._index.update(facts)
+        for fact in self._confirm_deleted(diff.deleted):
+            logger.debug('Found a deleted task: %r', fact)
+            self._notify('on_fact_deleted', fact)
+        for previous, fact in diff.edited:
+            logger.debug('Found an edited task: %r', fact)
+            self._notify_edited(fact, previous)
+        for fact in diff.created:
+            logger.debug('Found a %s task: %r', 'started' if fact.end_time is None else 'stopped', fact)
+            for listener in self.router.route(fact, self._listeners):
+                self._notify_created(listener, fact)
+        for fact in diff.stopped:
+            logger.debug('Found a stopped task: %r', fact)
+            self._notify('on_fact_stopped', fact)
+        if self.state is not None:
+            self.state.set_last_check(datetime.date.today())
+        return bool(diff.created or diff.stopped or diff.edited or diff.deleted)
+
+    def _confirm_deleted(self, facts):
+        """
+        A fact missing from today's facts is not necessarily deleted, f.e. it may have rolled out of today at another
+        time than expected. As deleting means deleting its work log, each one is looked up on the day it started.
+
+        :param facts: the facts missing from today's facts
+        :type  facts: list of BridgeFact
+        :returns: those of the facts that are really gone
+        :rtype: list of BridgeFact
         """
-        Starts the polling loop that will run until receive common exit signals.
+        deleted = []
+        for fact in facts:
+            # the day of the fact may end after midnight, look on both days
+            first_day = fact.start_time.date() - datetime.timedelta(days=1)
+            try:
+                found = any(other.id == fact.id for other in self.source.facts(first_day, fact.start_time.date()))
+            except Exception:
+                logger.exception('Can not look up whether task %s was deleted, keeping its work log', fact.id)
+                continue
+            if found:
+                logger.debug('Task %s is gone from today, but not deleted', fact.id)
+            else:
+                deleted.append(fact)
+        return deleted
+
+    def start(self):
+        """
+        Prepares the listeners and starts their workers. Called by the run-methods, call it yourself only if you drive
+        check() on your own.
+        """
+        for listener in self._listeners:
+            logger.debug('Preparing listener %s', listener)
+            listener.prepare()
+        for dispatcher in self._dispatchers.values():
+            dispatcher.start()
+        metrics.REGISTRY.add_collector(self.collect_metrics)
+        if self.outbox is not None:
+            pending = self.outbox.pending()
+            if pending:
+                logger.info('Found %d journaled changes not sent yet', pending)
+            self.outbox.start_flusher()
+        facts = self._fetch_todays_facts()
+        if self.state is not None:
+            if self.state.last_check() is None:
+                # first start, only changes from now on are of interest
+                for listener in self._listeners:
+                    self.state.seed(listener, facts)
+            else:
+                self._resume(self.state.last_check(), facts)
+            self.state.set_last_check(datetime.date.today())
+        self._index.update(facts)
+        if self.config_path is not None:
+            WATCHER.watch(self.config_path, self.reload_config)
+
+    def _resume(self, since, todays_facts):
+        """
+        Notifies each listener about the facts started, stopped or edited since the day of the last check that it did
+        not get yet according to the state, f.e. because the bridge was not running.
+
+        :param since: the day of the last check
+        :type  since: datetime.date
+        :param todays_facts: today's facts
+        :type  todays_facts: list of BridgeFact
+        """
+        today = datetime.date.today()
+        oldest = today - datetime.timedelta(days=self.resume_days)
+        if since < oldest:
+            logger.warning('Last check was on %s, use the sync command for the facts before %s', since, oldest)
+            since = oldest
+        facts = []
+        if since < today:
+            facts = list(self.source.facts(since, today - datetime.timedelta(days=1)))
+        facts.extend(todays_facts)
+        for listener in self._listeners:
+            routed = [fact for fact in facts if self.router.accepts(listener, fact)]
+            known = self.state.get_many(listener, [fact.id for fact in routed])
+            # hamster gives an edited fact a new id, so a recorded fact that is gone and one not recorded yet with the
+            # same start are an edit, like in FactIndex.update()
+            routed_ids = set(fact.id for fact in routed)
+            gone_by_start = dict(
+                (state.start_time, state)
+                for state in self.state.states_since(listener, datetime.datetime.combine(since, self.source.day_start))
+                if state.fact_id not in routed_ids
+            )
+            missed = 0
+            for fact in routed:
+                state = known.get(fact.id)
+                previous = None
+                if state is None:
+                    previous = gone_by_start.pop(fact.start_time.strftime(TIME_FORMAT), None)
+                if previous is not None:
+                    if fact.end_time is None:
+                        if not previous.started:
+                            missed += 1
+                            self._notify_listener(listener, 'on_fact_started', fact)
+                    elif previous.stopped:
+                        missed += 1
+                        self._notify_listener(listener, 'on_fact_updated', fact, _recorded_fact(previous))
+                    else:
+                        missed += 1
+                        self._notify_listener(listener, 'on_fact_stopped', fact)
+                elif fact.end_time is None:
+                    if state is None or not state.started:
+                        missed += 1
+                        self._notify_listener(listener, 'on_fact_started', fact)
+                elif state is None or not state.stopped:
+                    missed += 1
+                    self._notify_listener(listener, 'on_fact_stopped', fact)
+                elif state.hash is not None and state.hash != fact.hash:
+                    missed += 1
+                    self._notify_listener(listener, 'on_fact_updated', fact, fact)
+            for state in gone_by_start.values():
+                # a running fact was not logged yet, so there is nothing to remove
+                if state.stopped:
+                    missed += 1
+                    self._notify_listener(listener, 'on_fact_deleted', _recorded_fact(state))
+            if missed:
+                logger.info('Resuming %d facts missed by listener %s since %s', missed, listener.short_name, since)
+
+    def stop(self, timeout=10):
+        """
+        Lets the listeners' workers finish their pending events and stops them.
+
+        :param timeout: seconds to wait for each worker
+        :type  timeout: float
+        """
+        if self.config_path is not None:
+            WATCHER.unwatch(self.config_path)
+        for listener, dispatcher in self._dispatchers.items():
+            logger.debug('Waiting for pending events of listener %s: %r', listener, dispatcher.stats())
+            dispatcher.stop(timeout)
+        for listener in self._listeners:
+            if listener.cache is not None:
+                logger.debug('Cache of listener %s: %r', listener, listener.cache.stats())
+        if self.outbox is not None:
+            self.outbox.stop()
+        if self.state is not None:
+            self.state.close()
+        self.source.close()
+        metrics.REGISTRY.remove_collector(self.collect_metrics)
+
+    def collect_metrics(self):
+        """
+        Returns the current queue, cache and outbox gauges of this bridge as (name, documentation, labels, value)
+        tuples, see hamster_bridge.metrics.Registry.
+        """
+        for listener, dispatcher in self._dispatchers.items():
+            labels = {'bridge': self.name, 'listener': listener.short_name}
+            for key, value in dispatcher.stats().items():
+                yield 'hamster_bridge_queue_%s' % key, 'Queue statistic "%s" of a listener.' % key, labels, value
+        for listener in self._listeners:
+            if listener.cache is not None:
+                labels = {'bridge': self.name, 'listener': listener.short_name}
+                for key, value in listener.cache.stats().items():
+                    yield 'hamster_bridge_cache_%s' % key, 'Cache statistic "%s" of a listener.' % key, labels, value
+        if self.outbox is not None:
+            yield 'hamster_bridge_outbox_pending', 'Journaled changes not delivered yet.', {'bridge': self.name}, \
+                self.outbox.pending()
+
+    def run(self, polling_intervall=1, max_intervall=None):
+        """
+        Starts the polling loop that will run until receive common exit signals. With a max_intervall the loop polls
+        every polling_intervall seconds only right after changes and backs off up to max_intervall seconds while
+        nothing changes, see AdaptivePoller.
 
         :param polling_intervall: how often the connector polls data from haster in seconds (default: 1)
         :type  polling_intervall: int
+        :param max_intervall: maximum seconds between two polls (default: polling_intervall)
+        :type  max_intervall: int
         """
+        poller = AdaptivePoller(polling_intervall, max_intervall or polling_intervall)
         try:
-            for listener in self._listeners:
-                logger.debug('Preparing listener %s', listener)
-                listener.prepare()
+            self.start()
             logger.info('Start listening for hamster activity...')
-            now = datetime.datetime.now().replace(microsecond=0)
             while True:
-                last = now
-                now = datetime.datetime.now().replace(microsecond=0)
-                for fact in self.get_todays_facts():
-                    if fact.start_time is not None and last <= fact.start_time < now:
-                        logger.debug('Found a started task: %r', vars(fact))
-                        for listener in self._listeners:
-                            listener.on_fact_started(fact)
-                    if fact.end_time is not None and last <= fact.end_time < now:
-                        logger.debug('Found a stopped task: %r', vars(fact))
-                        for listener in self._listeners:
-                            listener.on_fact_stopped(fact)
-                time.sleep(polling_intervall)
+                changed = self.check()
+                poller.sleep(poller.next_delay(changed))
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            self.stop()
+
+    def run_event_driven(self, safety_intervall=60):
+        """
+        Starts a glib main loop that checks hamster only after it announced a change of facts or activities via its
+        FactsChanged/ActivitiesChanged dbus signals. As these signals are not delivered reliable in every hamster
+        version, a slow polling check is kept as safety net. Runs until receive common exit signals.
+
+        :param safety_intervall: how often the connector polls data from hamster regardless of signals in seconds
+                                 (default: 60)
+        :type  safety_intervall: int
+        """
+        import gobject
+
+        state = {'pending': False}
+
+        def check():
+            state['pending'] = False
+            # an exception would end up in the main loop, which drops a timeout whose callback raised
+            try:
+                self.check()
+            except Exception:
+                logger.exception('Checking hamster failed')
+            return False
+
+        def on_changed(signal_name):
+            try:
+                logger.debug('Received %s signal from hamster', signal_name)
+                # coalesce bursts of signals into a single check
+                if not state['pending']:
+                    state['pending'] = True
+                    gobject.idle_add(check)
+            except Exception:
+                logger.exception('Handling the %s signal failed', signal_name)
+
+        def on_safety_timeout():
+            logger.debug('Safety net check without signal')
+            check()
+            return True
+
+        try:
+            self.start()
+            if not self.source.connect_changed(on_changed):
+                logger.warning('The fact source does not signal changes, checking every %ds only', safety_intervall)
+            gobject.timeout_add_seconds(safety_intervall, on_safety_timeout)
+            logger.info('Start listening for hamster signals...')
+            gobject.MainLoop().run()
         except (KeyboardInterrupt, SystemExit):
             pass
+        finally:
+            self.stop()
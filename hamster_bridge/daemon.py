@@ -0,0 +1,127 @@
+import ConfigParser
+import glob
+import heapq
+import logging
+import os
+import time
+
+from hamster_bridge.bridge import HamsterBridge
+from hamster_bridge.sources import create_source
+
+logger = logging.getLogger(__name__)
+
+
+class BridgeDaemon(object):
+    """
+    Runs many bridges, one per user or profile, in a single process. A single scheduler thread calls the bridges'
+    check() one after another, the first checks are spread evenly over the interval so the bridges do not all poll at
+    the same moment. Listeners of the same bugtracker share their clients, connection pools and caches (see
+    hamster_bridge.listeners.shared).
+    """
+
+    def __init__(self, interval=10):
+        """
+        :param interval: seconds between two checks of the same bridge
+        :type  interval: float
+        """
+        self.interval = interval
+        self._bridges = []
+
+    def add_bridge(self, name, bridge):
+        """
+        :param name: name of the profile, used in logs
+        :type  name: str
+        :param bridge: the configured bridge
+        :type  bridge: HamsterBridge
+        """
+        self._bridges.append((name, bridge))
+
+    def load_profiles(self, directory, listener_choices, **bridge_kwargs):
+        """
+        Adds a bridge for each config file (*.cfg) in the directory. Besides the usual sections each of them names its
+        bugtracker (or several ones separated by commas, routed by a [routing] section, see hamster_bridge.routing) in
+        a [bridge] section and can set the dbus address of its hamster instance or another fact source (see
+        hamster_bridge.sources.create_source) there::
+
+            [bridge]
+            bugtracker = jira
+            dbus_address = unix:path=/run/user/1000/bus
+            # or f.e.
+            source = sqlite:/home/user/.local/share/hamster-applet/hamster.db
+
+        All values, including passwords, must be in the file as nobody can be asked for them.
+
+        :param directory: directory containing the profiles
+        :type  directory: str
+        :param listener_choices: listener classes by short name
+        :type  listener_choices: hamster_bridge.ListenerRegistry
+        """
+        for path in sorted(glob.glob(os.path.join(os.path.expanduser(directory), '*.cfg'))):
+            name = os.path.splitext(os.path.basename(path))[0]
+            config = ConfigParser.RawConfigParser()
+            config.read(path)
+            try:
+                bugtrackers = [name.strip() for name in config.get('bridge', 'bugtracker').split(',') if name.strip()]
+                bus_address = None
+                if config.has_option('bridge', 'dbus_address'):
+                    bus_address = config.get('bridge', 'dbus_address')
+                source = 'dbus'
+                if config.has_option('bridge', 'source'):
+                    source = config.get('bridge', 'source')
+                bridge = HamsterBridge(
+                    save_passwords=True,
+                    name=name,
+                    source=create_source(source, bus_address=bus_address),
+                    **bridge_kwargs
+                )
+                for bugtracker in bugtrackers:
+                    bridge.add_listener(listener_choices[bugtracker]())
+                bridge.configure(path)
+            except (ConfigParser.Error, KeyError, EOFError, ValueError, IOError):
+                logger.exception('Skipping profile %s, its config is incomplete', path)
+                continue
+            logger.info('Loaded profile %s for %s', name, ', '.join(bugtrackers))
+            self.add_bridge(name, bridge)
+
+    def run(self):
+        """
+        Starts all bridges and checks them until receive common exit signals.
+        """
+        started = []
+        try:
+            for name, bridge in self._bridges:
+                try:
+                    bridge.start()
+                except Exception:
+                    logger.exception('Can not start profile %s', name)
+                    continue
+                started.append((name, bridge))
+            if not started:
+                logger.error('No profile to run')
+                return
+
+            now = time.time()
+            queue = [
+                (now + self.interval * float(i) / len(started), i)
+                for i in range(len(started))
+            ]
+            heapq.heapify(queue)
+            logger.info('Checking %d profiles every %ds', len(started), self.interval)
+            while True:
+                due, i = heapq.heappop(queue)
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                name, bridge = started[i]
+                try:
+                    bridge.check()
+                except Exception:
+                    logger.exception('Checking profile %s failed', name)
+                # schedule relative to the planned time to keep the spread, but never in the past
+                heapq.heappush(queue, (max(due + self.interval, time.time()), i))
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            for name, bridge in started:
+                logger.debug('Stopping profile %s', name)
+                bridge.stop()
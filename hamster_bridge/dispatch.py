@@ -0,0 +1,156 @@
+import Queue
+import logging
+import threading
+import time
+
+from hamster_bridge.metrics import LISTENER_DURATION, LISTENER_ERRORS
+from hamster_bridge.profiling import PROFILER
+
+logger = logging.getLogger(__name__)
+
+
+# put into the queue once per worker to let it finish
+_STOP = object()
+
+
+def call_listener(listener, method, *args):
+    """
+    Calls the event method of the listener and records its duration and errors in the metrics, and as span if
+    profiling.
+
+    :param listener: the listener to call
+    :type  listener: HamsterListener
+    :param method: name of the listener method, f.e. 'on_fact_started'
+    :type  method: str
+    """
+    labels = {'listener': listener.short_name, 'method': method}
+    try:
+        with LISTENER_DURATION.time(**labels), PROFILER.span(method, listener=listener.short_name,
+                                                             fact=getattr(args[0], 'id', None) if args else None):
+            with listener.config_lock.using():
+                getattr(listener, method)(*args)
+    except Exception:
+        LISTENER_ERRORS.inc(**labels)
+        raise
+
+
+class ListenerDispatcher(object):
+    """
+    Calls the event methods of a single listener from its own worker threads, fed by a bounded queue. This way a slow
+    bugtracker can neither stall the bridge's loop nor the other listeners.
+
+    If the queue is full, submit() blocks until there is a free slot (backpressure), so no event gets lost. A warning
+    is logged every put_timeout seconds of waiting, how often that happens is counted and available via stats().
+    """
+
+    def __init__(self, listener, workers=1, queue_size=100, put_timeout=5):
+        """
+        :param listener: the listener to call
+        :type  listener: HamsterListener
+        :param workers: number of worker threads, more than one does not keep the order of the events (default: 1)
+        :type  workers: int
+        :param queue_size: maximum number of pending events (default: 100)
+        :type  queue_size: int
+        :param put_timeout: seconds to wait for a free slot in a full queue before warning again (default: 5)
+        :type  put_timeout: float
+        """
+        self.listener = listener
+        self.workers = workers
+        self.put_timeout = put_timeout
+        self._queue = Queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._abandoned = threading.Event()
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.full_waits = 0
+        self.max_depth = 0
+        self.blocked_seconds = 0.0
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work,
+                name='%s-worker-%d' % (self.listener.short_name, i),
+            )
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """
+        Lets the workers finish the pending events and waits for them. If the queue stays full, f.e. because the
+        bugtracker hangs, the workers stop after their current event and the pending ones are left.
+
+        :param timeout: seconds to wait for each worker, None waits forever
+        :type  timeout: float
+        """
+        for _ in self._threads:
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except Queue.Full:
+                logger.warning('Queue of listener %s is still full, stopping without handling %d pending events',
+                               self.listener.short_name, self._queue.qsize())
+                self._abandoned.set()
+                break
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, method, *args):
+        """
+        Queues the call of the given listener method, waiting as long as the queue is full.
+
+        :param method: name of the listener method, f.e. 'on_fact_started'
+        :type  method: str
+        """
+        started = time.time()
+        while True:
+            try:
+                self._queue.put((method, args), timeout=self.put_timeout)
+                break
+            except Queue.Full:
+                with self._lock:
+                    self.full_waits += 1
+                logger.warning('Queue of listener %s is full for %.0fs, still waiting to queue %s',
+                               self.listener.short_name, time.time() - started, method)
+        waited = time.time() - started
+        with self._lock:
+            self.submitted += 1
+            self.blocked_seconds += waited
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+        if waited > 1:
+            logger.warning('Waited %.1fs for a free slot in the queue of listener %s', waited, self.listener.short_name)
+
+    def stats(self):
+        """
+        :returns: the backpressure metrics of this dispatcher
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'depth': self._queue.qsize(),
+                'max_depth': self.max_depth,
+                'submitted': self.submitted,
+                'processed': self.processed,
+                'failed': self.failed,
+                'full_waits': self.full_waits,
+                'blocked_seconds': self.blocked_seconds,
+            }
+
+    def _work(self):
+        while not self._abandoned.is_set():
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            method, args = item
+            try:
+                call_listener(self.listener, method, *args)
+            except Exception:
+                logger.exception('Listener %s failed in %s', self.listener.short_name, method)
+                with self._lock:
+                    self.failed += 1
+            finally:
+                with self._lock:
+                    self.processed += 1
@@ -1,31 +1,207 @@
+import datetime
+import logging
+import os
+import threading
 from collections import namedtuple
-from ConfigParser import NoOptionError
+from ConfigParser import NoOptionError, NoSectionError
+from contextlib import contextmanager
+
+from hamster_bridge.listeners.cache import TTLCache
+from hamster_bridge.listeners.resolver import IssueResolver
+
+logger = logging.getLogger(__name__)
 
 
 ConfigValue = namedtuple('ConfigValue', ['key', 'setup_func', 'sensitive'])
 
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# returned by HamsterListener.worklog_to_update() if nothing was logged for the fact before
+NEW_WORKLOG = object()
+
+
+def fact_payload(fact):
+    """
+    Converts a fact into the plain, json serializable dict that is journaled in the outbox and handed to
+    HamsterListener.deliver().
+
+    :param fact: the fact
+    :type  fact: hamster_bridge.snapshot.BridgeFact
+    :rtype: dict
+    """
+    return {
+        'id': fact.id,
+        'activity': fact.activity,
+        'tags': list(fact.tags),
+        'description': fact.description,
+        'start_time': fact.start_time.strftime(TIME_FORMAT),
+        'seconds': int(fact.delta.total_seconds()),
+        'hash': fact.hash,
+    }
+
+
+def payload_start_time(payload):
+    """
+    :returns: the start time of the fact a payload was created from
+    :rtype: datetime.datetime
+    """
+    return datetime.datetime.strptime(payload['start_time'], TIME_FORMAT)
+
+
+def parse_bool(key, value):
+    """
+    Parses a yes/no config value.
+
+    :param key: the key of the config value, for the error message
+    :type  key: str
+    :param value: the config value, f.e. 'y', 'n', 'true' or 'false'
+    :type  value: str
+    :rtype: bool
+    :raises ValueError: if the value is none of them
+    """
+    normalized = str(value).strip().lower()
+    if normalized in ('y', 'yes', 'true', '1'):
+        return True
+    if normalized in ('n', 'no', 'false', '0'):
+        return False
+    raise ValueError('%s = %r is neither y nor n' % (key, value))
+
+
+def parse_verify_ssl(value):
+    """
+    Parses the config value 'verify_ssl' into the verify option of requests.
+
+    :param value: 'y', 'n' or the path of a CA certificate bundle
+    :type  value: str
+    :returns: True, False or the path of the CA certificate bundle
+    """
+    if value.lower() in ('y', 'true'):
+        logger.info("Enabling SSL/TLS certificate verification (default CA path)")
+        return True
+    elif value.lower() in ('n', 'false'):
+        logger.warn("Disabling SSL/TLS certificate verification")
+        return False
+    elif os.path.isfile(value):
+        logger.info("Enabling SSL/TLS certificate verification (custom CA "
+            "path) '%s'", value)
+        return value
+    logger.error("verify_ssl = '%s' is not a valid CA cert path nor a "
+        "valid option. Falling back to enabling SSL/TLS verification "
+        "with default CA path", value)
+    return True
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared(key, factory):
+    """
+    Returns the object registered for the key, created by calling the factory on first use. This way listeners of
+    several bridges in one process (see hamster_bridge.daemon) share their clients and caches.
+
+    :param key: hashable key, should start with the short name of the listener
+    :param factory: function without arguments creating the object
+    """
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = factory()
+        return _shared[key]
+
+
+class ConfigLock(object):
+    """
+    Lets the event handlers and deliveries of a listener run at the same time, but not while its config is reloaded,
+    so none of them sees the settings of one config and the client of the other. As a delivery may run within an event
+    handler, a reload waits until none of them runs instead of holding back new ones meanwhile.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._users = 0
+
+    @contextmanager
+    def using(self):
+        """
+        Held while an event handler or a delivery runs.
+        """
+        with self._condition:
+            self._users += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._users -= 1
+                if not self._users:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def changing(self):
+        """
+        Held while the config is changed, waits for the running event handlers and deliveries first.
+        """
+        with self._condition:
+            while self._users:
+                self._condition.wait()
+            yield
+
+
+def payload_key(action, payload):
+    """
+    :returns: the idempotency key for the given action on the fact a payload was created from
+    :rtype: str
+    """
+    return '%s:%s:%s' % (action, payload['id'], payload['start_time'])
+
 
 class HamsterListener(object):
 
     short_name = None
     config_values = []
 
-    def get_from_config(self, key):
+    # the Outbox changes are journaled in, set by the bridge
+    outbox = None
+
+    # the SyncState recording what was sent for each fact, set by the bridge
+    state = None
+
+    # the TTLCache for lookups on the bugtracker, see create_cache()
+    cache = None
+
+    # the IssueResolver finding the issue of a fact, see create_resolver()
+    resolver = None
+
+    # seconds to hold back work logs to merge them, see merge_payloads()
+    batch_window = 0
+
+    # the immutable settings parsed from the config, see parse_settings()
+    settings = None
+
+    @property
+    def config_lock(self):
+        """
+        :returns: the lock keeping reload() from changing the config while the listener is used
+        :rtype: ConfigLock
+        """
+        # listeners have no common constructor, setdefault creates the lock only once even if called concurrently
+        return self.__dict__.setdefault('_config_lock', ConfigLock())
+
+    def get_from_config(self, key, default=None):
         """
         Tries to get the value for the specified key. First in the regular
-        config, then in the sensitive_config. If it not found in either None is
-        returned.
+        config, then in the sensitive_config. If it not found in either the
+        default (None if not given) is returned.
         """
         try:
             # Get from regular config
             value = self.config.get(self.short_name, key)
-        except NoOptionError:
+        except (NoOptionError, NoSectionError):
             try:
                 # ... if not found get from sensitive config
                 value = self.sensitive_config.get(self.short_name, key)
-            except NoOptionError:
-                # ... if again not found return None
-                value = None
+            except (NoOptionError, NoSectionError):
+                # ... if again not found return the default
+                value = default
         return value
 
 
@@ -57,6 +233,81 @@ class HamsterListener(object):
                             cv.key,
                             cv.setup_func(),
                         )
+        self.batch_window = int(self.get_from_config('batch_window', 0))
+        self.settings = self.parse_settings()
+
+    def parse_settings(self):
+        """
+        Parses the config values of the listener once into an immutable settings object, f.e. a namedtuple, with the
+        derived values already computed. The event handlers use self.settings instead of reading the config.
+
+        :raises ValueError: if a config value is invalid
+        """
+        return None
+
+    def _config_items(self, config, sensitive_config):
+        items = {}
+        for source in (sensitive_config, config):
+            if source.has_section(self.short_name):
+                items.update(source.items(self.short_name))
+        return items
+
+    def reload(self, config, sensitive_config):
+        """
+        Applies a changed config file. If the section of the listener changed, its settings are parsed again and it is
+        prepared again, otherwise nothing happens. An invalid config is logged and the current one kept. The running
+        event handlers and deliveries are waited for and new ones wait for the reload, see ConfigLock.
+
+        :returns: whether the config of the listener changed
+        :rtype: bool
+        """
+        if self._config_items(config, sensitive_config) == self._config_items(self.config, self.sensitive_config):
+            return False
+        with self.config_lock.changing():
+            previous = self.config, self.sensitive_config, self.batch_window, self.settings
+            self.config = config
+            self.sensitive_config = sensitive_config
+            try:
+                missing = [cv.key for cv in self.config_values if self.get_from_config(cv.key) is None]
+                if missing:
+                    raise ValueError('missing %s' % ', '.join(missing))
+                self.batch_window = int(self.get_from_config('batch_window', 0))
+                self.settings = self.parse_settings()
+            except ValueError, e:
+                logger.error('Keeping the previous config of listener %s, the changed one is invalid: %s',
+                             self.short_name, e)
+                self.config, self.sensitive_config, self.batch_window, self.settings = previous
+                return False
+            self.prepare()
+        return True
+
+    def create_cache(self, shared_key=None):
+        """
+        Creates the cache for lookups on the bugtracker, sized by the optional
+        config values 'cache_size' (entries, default 256) and 'cache_ttl'
+        (seconds, default 300). All listeners of this type with the same
+        shared_key (f.e. the server url) get the same cache.
+        """
+        def factory():
+            return TTLCache(
+                maxsize=int(self.get_from_config('cache_size', 256)),
+                ttl=float(self.get_from_config('cache_ttl', 300)),
+            )
+
+        if shared_key is None:
+            self.cache = factory()
+        else:
+            self.cache = shared(('cache', self.short_name, shared_key), factory)
+        return self.cache
+
+    def create_resolver(self, patterns, fields, project_of=None):
+        """
+        Creates the resolver finding the issue of a fact. The given regexes of the issue keys and fields of the fact to
+        search in are the defaults for the optional config values 'issue_patterns' (separated by whitespace) and
+        'issue_fields' (comma separated).
+        """
+        self.resolver = IssueResolver.from_config(self, patterns, fields, project_of=project_of)
+        return self.resolver
 
     def prepare(self):
         pass
@@ -66,3 +317,165 @@ class HamsterListener(object):
 
     def on_fact_stopped(self, fact):
         pass
+
+    def on_fact_updated(self, fact, previous):
+        """
+        Called if a fact changed after it was seen, f.e. its duration or description was corrected.
+
+        :param fact: the fact as it is now
+        :type  fact: hamster_bridge.snapshot.BridgeFact
+        :param previous: the fact as it was before, hamster gives an edited fact a new id so the ids may differ
+        :type  previous: hamster_bridge.snapshot.BridgeFact
+        """
+        pass
+
+    def on_fact_deleted(self, fact):
+        """
+        Called if a fact was deleted in hamster.
+
+        :param fact: the fact as it was before
+        :type  fact: hamster_bridge.snapshot.BridgeFact
+        """
+        pass
+
+    def submit(self, action, key, payload):
+        """
+        Sends a change to the bugtracker. If there is an outbox the change is journaled first and retried later on
+        failure, otherwise it is delivered right away. With a batch window work logs are journaled only and sent by
+        the outbox's flusher after that window. Once journaled or delivered, the change is recorded in the state.
+
+        :param action: what to do, passed on to deliver()
+        :type  action: str
+        :param key: idempotency key, the same change must always get the same key
+        :type  key: str
+        :param payload: json serializable data needed for the change, see fact_payload()
+        :type  payload: dict
+        """
+        if self.outbox is None:
+            self.deliver(action, payload)
+        elif action == 'worklog' and self.batch_window:
+            self.outbox.add(self, key, action, payload, delay=self.batch_window)
+        else:
+            self.outbox.send(self, key, action, payload)
+        if self.state is not None:
+            self.state.mark(self, action, payload)
+
+    def deliver(self, action, payload, retry=False):
+        """
+        Actually sends a change submitted via submit() to the bugtracker. Raises an exception if it should be
+        retried later.
+
+        :param retry: whether there was an attempt already, which might have reached the server despite failing
+        :type  retry: bool
+        :returns: whether the bugtracker was changed
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    def record_worklog(self, payload, issue, worklog_id):
+        """
+        Remembers the work log created on the bugtracker for the fact(s) of the payload, to be called by deliver().
+
+        :param payload: the payload of the work log, possibly merged from several facts
+        :type  payload: dict
+        :param issue: the issue the work was logged to
+        :param worklog_id: the id of the created work log
+        """
+        if self.state is not None:
+            self.state.record_worklog(self, payload.get('merged', [payload['id']]), issue, worklog_id)
+
+    def recorded_worklog(self, fact_id):
+        """
+        :returns: what was recorded for the fact if a work log was, and only it, see record_worklog()
+        :rtype: hamster_bridge.state.FactState
+        """
+        if self.state is None:
+            return None
+        known = self.state.get(self, fact_id)
+        if known is None or known.worklog_id is None:
+            return None
+        if len(self.state.facts_of_worklog(self, known.issue, known.worklog_id)) > 1:
+            logger.warning(
+                'Work log %s of %s contains several facts, please correct it by hand', known.worklog_id, known.issue
+            )
+            return None
+        return known
+
+    def replace_pending_worklog(self, fact_id, payload):
+        """
+        Replaces the work log of the fact that is still waiting in the outbox (for the batch window or its next
+        attempt) with the given payload, or cancels it if the payload is None. See Outbox.replace_pending().
+
+        :returns: whether there was such a work log, in which case there is nothing else to do
+        :rtype: bool
+        :raises RuntimeError: if that work log is being delivered right now, so the change is retried after it was
+        """
+        if self.outbox is None:
+            return False
+        return self.outbox.replace_pending(self, fact_id, payload)
+
+    def worklog_to_update(self, payload):
+        """
+        Finds the work log to change for the payload of an edited fact, to be called by deliver(). If the work log of
+        the fact before the edit is still pending, it is sent with the edited fact instead.
+
+        :param payload: the payload of the edited fact with the id of the fact before the edit as previous_id
+        :type  payload: dict
+        :returns: what was recorded for the work log of the fact before the edit, NEW_WORKLOG if no work log was
+                  created or is pending for it so the work is to be logged now, or None if there is nothing to do
+        :rtype: hamster_bridge.state.FactState
+        :raises RuntimeError: if the pending work log is being delivered right now
+        """
+        previous_id = payload['previous_id']
+        if self.replace_pending_worklog(previous_id, payload):
+            if previous_id != payload['id']:
+                self.forget_worklog(previous_id)
+            return None
+        if self.state is None:
+            return NEW_WORKLOG
+        known = self.state.get(self, previous_id)
+        if known is None or known.worklog_id is None:
+            return NEW_WORKLOG
+        if len(self.state.facts_of_worklog(self, known.issue, known.worklog_id)) > 1:
+            logger.warning(
+                'Work log %s of %s contains several facts, please correct it by hand', known.worklog_id, known.issue
+            )
+            return None
+        return known
+
+    def forget_worklog(self, fact_id):
+        """
+        Forgets the work log recorded for the fact, f.e. after it was deleted.
+        """
+        if self.state is not None:
+            self.state.forget(self, fact_id)
+
+    def batch_key(self, payload):
+        """
+        Pending work logs with the same batch key are merged by merge_payloads() into a single one as soon as the first
+        of them is due. Returns None if the work log can't be merged, which is the default.
+
+        :param payload: the payload of the work log
+        :type  payload: dict
+        """
+        return None
+
+    def merge_payloads(self, payloads):
+        """
+        Merges the payloads of several work logs into one starting with the earliest of them and spending the sum of
+        their time. The distinct descriptions are kept as lines of the merged description.
+
+        :param payloads: the payloads to merge
+        :type  payloads: list
+        :rtype: dict
+        """
+        payloads = sorted(payloads, key=lambda payload: payload['start_time'])
+        descriptions = []
+        for payload in payloads:
+            if payload['description'] and payload['description'] not in descriptions:
+                descriptions.append(payload['description'])
+        merged = dict(payloads[0])
+        merged['seconds'] = sum(payload['seconds'] for payload in payloads)
+        merged['description'] = u'\n'.join(descriptions) or None
+        merged['merged'] = [payload['id'] for payload in payloads]
+        return merged
@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class TTLCache(object):
+    """
+    A thread safe, size bounded cache. Entries expire after a time to live and the least recently used entry is evicted
+    when the cache is full. Any value can be cached, including None, so negative lookups (f.e. "issue does not exist")
+    save the request, too.
+
+    Counts hits, misses and evictions, see stats().
+    """
+
+    def __init__(self, maxsize=256, ttl=300, timer=time.time):
+        """
+        :param maxsize: maximum number of entries
+        :type  maxsize: int
+        :param ttl: seconds an entry is valid
+        :type  ttl: float
+        :param timer: function returning the current time in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        """
+        :returns: the cached value or the default if there is none or it expired
+        """
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires < self._timer():
+                self.misses += 1
+                return default
+            # re-insert to mark it as most recently used
+            self._data[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Caches the value, evicting the least recently used entry if the cache is full.
+
+        :param ttl: seconds the entry is valid, defaults to the cache's ttl
+        :type  ttl: float
+        """
+        with self._lock:
+            self._data.pop(key, None)
+            while len(self._data) >= self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            self._data[key] = (self._timer() + (self.ttl if ttl is None else ttl), value)
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value or calls the loader and caches its result. Exceptions of the loader are not cached.
+
+        :param loader: function without arguments returning the value
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        :returns: size, hits, misses and evictions of this cache
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -1,23 +1,41 @@
 from __future__ import absolute_import
-import os
+import inspect
+import json
 # MAX patch
 import sys
+from collections import namedtuple
 
 from jira import JIRA, JIRAError
 
+from hamster_bridge import transport
+from hamster_bridge.listeners.cache import TTLCache
+from hamster_bridge.listeners.resolver import KnownProjects
+from hamster_bridge.listeners.workflow import TransitionGraph
 from hamster_bridge.listeners import (
     HamsterListener,
     ConfigValue,
+    NEW_WORKLOG,
+    fact_payload,
+    parse_verify_ssl,
+    payload_key,
+    payload_start_time,
+    shared,
 )
 
 import logging
 import re
 import datetime
-from dateutil.tz import *
 from getpass import getpass
 
 logger = logging.getLogger(__name__)
 
+# marks issues not in the cache
+_UNKNOWN = object()
+
+
+# transition_name is None if auto start is disabled, verify is the verify option of requests
+JiraSettings = namedtuple('JiraSettings', ['server_url', 'username', 'password', 'verify', 'transition_name'])
+
 
 class JiraHamsterListener(HamsterListener):
 
@@ -56,104 +74,424 @@ class JiraHamsterListener(HamsterListener):
 
     issue_from_title = re.compile('([A-Z][A-Z0-9]+-[0-9]+)')
 
+    # statuses an issue is moved to at most to learn their transitions while no path to the start status is known
+    max_explored = 3
+
+    @staticmethod
+    def project_of(issue_name):
+        """
+        :returns: the key of the project the issue belongs to
+        :rtype: str
+        """
+        return issue_name.rsplit('-', 1)[0]
+
+    def parse_settings(self):
+        auto_start = self.get_from_config('auto_start')
+        if auto_start.lower() in ('n', 'false'):
+            transition_name = None
+        elif auto_start.lower() in ('y', 'true'):
+            transition_name = u'Start Progress'
+        else:
+            transition_name = unicode(auto_start, 'utf-8')
+        return JiraSettings(
+            server_url=self.get_from_config('server_url'),
+            username=self.get_from_config('username'),
+            password=self.get_from_config('password'),
+            verify=parse_verify_ssl(self.get_from_config('verify_ssl')),
+            transition_name=transition_name,
+        )
+
     # noinspection PyBroadException
     def prepare(self):
-        server_url = self.get_from_config('server_url')
-        username = self.get_from_config('username')
-        password = self.get_from_config('password')
-        verify_ssl = self.get_from_config('verify_ssl')
-
-        options = {}
-        if verify_ssl.lower() in ('y', 'true'):
-            logger.info("Enabling SSL/TLS certificate verification (default CA path)")
-            options['verify'] = True
-        elif verify_ssl.lower() in ('n', 'false'):
-            logger.warn("Disabling SSL/TLS certificate verification")
-            options['verify'] = False
-        elif os.path.isfile(verify_ssl):
-            logger.info("Enabling SSL/TLS certificate verification (custom CA "
-                "path) '%s'", verify_ssl)
-            options['verify'] = verify_ssl
-        else:
-            logger.error("verify_ssl = '%s' is not a valid CA cert path nor a "
-                "valid option. Falling back to enabling SSL/TLS verification "
-                "with default CA path", verify_ssl)
-            options['verify'] = True
-
-        logger.info('Connecting as "%s" to "%s"', username, server_url)
-        self.jira = JIRA(
-            server_url,
-            options=options,
-            basic_auth=(username, password)
+        server_url, username, password = self.settings.server_url, self.settings.username, self.settings.password
+        options = {'verify': self.settings.verify}
+
+        self.create_cache(shared_key=server_url)
+        # the transitions of the workflows change rarely, they are kept for the config value 'workflow_ttl' (seconds)
+        self.workflows = shared(
+            ('jira-workflows', server_url),
+            lambda: TTLCache(maxsize=256, ttl=float(self.get_from_config('workflow_ttl', 86400))),
+        )
+        self.create_resolver([self.issue_from_title.pattern], ['activity', 'tags'], project_of=self.project_of)
+
+        transport_settings = transport.settings_from_config(self)
+
+        def connect():
+            logger.info('Connecting as "%s" to "%s"', username, server_url)
+            kwargs = {}
+            # the constructor already asks for the server info, so it needs the timeouts, too (older versions of the
+            # jira package do not take them)
+            if 'timeout' in inspect.getargspec(JIRA.__init__).args:
+                kwargs['timeout'] = (transport_settings.connect_timeout, transport_settings.read_timeout)
+            # the adapter mounted below already retries 5xx and throttled responses, the retries of the jira session on
+            # top of those would multiply the requests sent for a single call
+            if 'max_retries' in inspect.getargspec(JIRA.__init__).args:
+                kwargs['max_retries'] = 0
+            jira = JIRA(
+                server_url,
+                options=options,
+                basic_auth=(username, password),
+                **kwargs
+            )
+            if hasattr(jira._session, 'max_retries'):
+                jira._session.max_retries = 0
+            transport.mount(jira._session, transport_settings)
+            return jira
+
+        def load_projects():
+            try:
+                return [project.key for project in self.jira.projects()]
+            except:
+                logger.exception('Can not connect to JIRA, please check ~/.hamster-bridge.cfg')
+                return None
+
+        def known_projects():
+            projects = KnownProjects(load_projects, ttl=float(self.get_from_config('projects_ttl', 3600)))
+            projects.reload()
+            return projects
+
+        # listeners of other bridges in this process with the same login share the client, changed transport settings
+        # get a new one
+        self.jira = shared(('jira', server_url, username, password, repr(options), transport_settings), connect)
+        # the projects visible to the user, keys of other projects are rejected without asking JIRA, they are reloaded
+        # after the config value 'projects_ttl' (seconds) or when a key of a project that is not known yet shows up
+        self.resolver.set_known_projects(
+            shared(('jira-projects', server_url, username, password, repr(options)), known_projects)
         )
 
+    @staticmethod
+    def __is_temporary(error):
+        """
+        Whether it makes sense to retry after the given error, f.e. server errors or rate limiting.
+        """
+        return error.status_code is None or error.status_code >= 500 or error.status_code == 429
+
+    def __fetch_issue(self, issue_name):
+        """
+        Loads the issue, returns None if it does not exist.
+        """
+        logger.debug('Lookup issue for activity "%s"', issue_name)
+        try:
+            return self.jira.issue(issue_name, fields='summary,status,issuetype,project')
+        except JIRAError, e:
+            if e.text == 'Issue Does Not Exist':
+                logger.warning('Tried issue "%s", but does not exist. ', issue_name)
+                return None
+            raise
+
+    def __issue_exists(self, issue_name):
+        """
+        Whether the issue exists, looked up in the cache first.
+        """
+        try:
+            issue = self.cache.get_or_load(('issue', issue_name), lambda: self.__fetch_issue(issue_name))
+        except JIRAError, e:
+            if self.__is_temporary(e):
+                raise
+            logger.exception('Error communicating with Jira')
+            return False
+        return issue is not None
+
+    def __existing_issues(self, issue_names):
+        """
+        Which of the issues exist. The ones not in the cache are looked up together with a single search, unless an
+        earlier one in the given order is known to exist.
+
+        :param issue_names: the issue names in the order of precedence
+        :type  issue_names: list
+        :returns: the names of the existing issues
+        :rtype: set
+        """
+        existing = set()
+        unknown = []
+        for issue_name in issue_names:
+            issue = self.cache.get(('issue', issue_name), _UNKNOWN)
+            if issue is _UNKNOWN:
+                unknown.append(issue_name)
+            elif issue is not None:
+                existing.add(issue_name)
+                if not unknown:
+                    # it takes precedence over all the others
+                    return existing
+        if len(unknown) == 1:
+            if self.__issue_exists(unknown[0]):
+                existing.add(unknown[0])
+            return existing
+        logger.debug('Lookup issues %s', ', '.join(unknown))
         try:
-            self.jira.projects()
-        except:
-            logger.exception('Can not connect to JIRA, please check ~/.hamster-bridge.cfg')
+            # invalid keys are only warnings without validation, the search returns the existing ones
+            issues = self.jira.search_issues(
+                'key in (%s)' % ', '.join('"%s"' % issue_name.replace('"', '\\"') for issue_name in unknown),
+                maxResults=len(unknown),
+                validate_query=False,
+                fields='summary,status,issuetype,project',
+            )
+        except JIRAError, e:
+            if self.__is_temporary(e):
+                raise
+            logger.exception('Error communicating with Jira')
+            return existing | set(issue_name for issue_name in unknown if self.__issue_exists(issue_name))
+        found = dict((issue.key, issue) for issue in issues)
+        for issue_name in unknown:
+            issue = found.get(issue_name)
+            if issue is None:
+                logger.warning('Tried issue "%s", but does not exist. ', issue_name)
+            else:
+                existing.add(issue_name)
+            self.cache.set(('issue', issue_name), issue)
+        return existing
 
     def __issue_from_fact(self, fact):
         """
         Get the issue name from a fact
-        :param fact: the fact to search the issue in
-        """
-        fields = [fact.activity] + fact.tags
-        logger.debug('Searching ticket in: %r', fields)
-        for field in fields:
-            for possible_issue in self.issue_from_title.findall(field):
-                logger.debug('Lookup issue for activity "%s"', possible_issue)
-                try:
-                    self.jira.issue(possible_issue)
-                    logger.debug('Found existing issue "%s" in "%s"', possible_issue, field)
-                    return possible_issue
-                except JIRAError, e:
-                    if e.text == 'Issue Does Not Exist':
-                        logger.warning('Tried issue "%s", but does not exist. ', possible_issue)
-                    else:
-                        logger.exception('Error communicating with Jira')
+        :param fact: the payload of the fact to search the issue in
+        """
+        return self.resolver.resolve(fact, self.__issue_exists, self.__existing_issues)
 
     def on_fact_started(self, fact):
-        auto_start = self.get_from_config('auto_start')
-        if auto_start.lower() in ('n', 'false'):
+        if self.settings.transition_name is None:
             return
-        elif auto_start.lower() in ('y', 'true'):
-            transition_name = u'Start Progress'
-        else:
-            transition_name = unicode(auto_start, 'utf-8')
+        payload = fact_payload(fact)
+        self.submit('start', payload_key('start', payload), payload)
+
+    def on_fact_stopped(self, fact):
+        payload = fact_payload(fact)
+        self.submit('worklog', payload_key('worklog', payload), payload)
+
+    def on_fact_updated(self, fact, previous):
+        if fact.end_time is None:
+            # still running, the work is logged when it stops
+            return
+        payload = fact_payload(fact)
+        payload['previous_id'] = previous.id
+        self.submit('update', '%s:%s' % (payload_key('update', payload), payload['hash']), payload)
+
+    def on_fact_deleted(self, fact):
+        if fact.end_time is None:
+            return
+        payload = fact_payload(fact)
+        self.submit('delete', payload_key('delete', payload), payload)
+
+    def batch_key(self, payload):
+        # work logs are merged if they are for the same issue and activity
+        issue_name = self.__issue_from_fact(payload)
+        if issue_name is None:
+            return None
+        return issue_name, payload['activity']
+
+    def deliver(self, action, payload, retry=False):
         try:
-            issue_name = self.__issue_from_fact(fact)
-            if issue_name is None:
-                return
-
-            transition_found = False
-            transitions = self.jira.transitions(issue_name)
-            for transition in transitions:
-                if transition['name'] == transition_name:
-                    transition_found = True
-                    self.jira.transition_issue(issue_name, transition['id'])
-                    logger.info('Marked issue "%s" as "%s"', issue_name, transition_name)
-            if not transition_found:
-                logger.warn(
-                    "Could not find transition '%s' in '%s'",
-                    transition_name,
-                    [t['name'] for t in transitions]
-                )
-        except JIRAError:
+            if action == 'start':
+                return self.__start_issue(payload)
+            elif action == 'worklog':
+                return self.__log_work(payload, retry)
+            elif action == 'update':
+                return self.__update_work(payload)
+            elif action == 'delete':
+                return self.__delete_work(payload)
+            else:
+                logger.error('Unknown action "%s"', action)
+        except JIRAError as e:
+            if self.__is_temporary(e):
+                raise
             logger.exception('Error communicating with Jira')
+        return False
 
-    def on_fact_stopped(self, fact):
-        time_spent = '%dm' % (fact.delta.total_seconds() / 60)
+    def __issue(self, issue_name):
+        """
+        :returns: the issue with its status, type and project, looked up in the cache first
+        """
+        return self.cache.get_or_load(('issue', issue_name), lambda: self.__fetch_issue(issue_name))
+
+    def __workflow(self, issue):
+        """
+        :returns: the transitions seen for the issues of the same type in the same project
+        :rtype: TransitionGraph
+        """
+        return self.workflows.get_or_load(
+            (issue.fields.project.key, issue.fields.issuetype.id, self.settings.transition_name),
+            lambda: TransitionGraph(self.settings.transition_name),
+        )
+
+    def __learn_transitions(self, graph, issue_name, status):
+        logger.debug('Lookup transitions of issue "%s"', issue_name)
+        transitions = self.jira.transitions(issue_name)
+        graph.learn(status, transitions)
+        return transitions
+
+    def __transition_issue(self, issue_name, transition):
+        """
+        :returns: the status the issue was moved to
+        """
+        self.jira.transition_issue(issue_name, transition.id)
+        self.cache.set(('status', issue_name), transition.target)
+        logger.info('Marked issue "%s" as "%s"', issue_name, transition.name)
+        return transition.target
+
+    def __start_issue(self, fact, fresh=False):
+        """
+        Moves the issue of the fact along the shortest known path of transitions to the status to start issues in. If
+        there is none, the issue is moved to statuses not seen yet first, learning their transitions on the way.
+
+        :param fresh: whether to look up the status and transitions of the issue instead of trusting the cache
+        """
+        transition_name = self.settings.transition_name
+        issue_name = self.__issue_from_fact(fact)
+        if issue_name is None:
+            return False
+        issue = self.__issue(issue_name)
+        if issue is None:
+            return False
+        graph = self.__workflow(issue)
+        # the status the issue was moved to by the last start, the cached issue may be older
+        status = self.cache.get(('status', issue_name)) or str(issue.fields.status.id)
+
+        transitions = None
+        if fresh or graph.path(status) is None:
+            transitions = self.__learn_transitions(graph, issue_name, status)
+        try:
+            path = graph.path(status)
+            explored = 0
+            while path is None:
+                # no path over the statuses seen so far, move on to the nearest status not seen yet and learn its
+                # transitions
+                steps = graph.explore(status) if explored < self.max_explored else None
+                if steps is None:
+                    logger.warn(
+                        "Could not find transition '%s' in '%s'",
+                        transition_name,
+                        [t['name'] for t in transitions or ()]
+                    )
+                    return False
+                for transition in steps:
+                    status = self.__transition_issue(issue_name, transition)
+                transitions = self.__learn_transitions(graph, issue_name, status)
+                explored += 1
+                path = graph.path(status)
+            for transition in path:
+                status = self.__transition_issue(issue_name, transition)
+        except JIRAError, e:
+            if self.__is_temporary(e) or fresh:
+                raise
+            # the issue changed meanwhile or the transition is not available for it, start over with fresh data
+            logger.info('Transition "%s" of issue "%s" failed, looking up its status again', transition.name,
+                        issue_name)
+            graph.forget(status)
+            self.cache.invalidate(('issue', issue_name))
+            self.cache.invalidate(('status', issue_name))
+            return self.__start_issue(fact, fresh=True)
+        if not path:
+            logger.debug('Issue "%s" is started already', issue_name)
+        return True
+
+    def __find_worklog(self, issue_name, started, seconds):
+        """
+        Finds the worklog of the issue started at the given time with the given duration.
+
+        :returns: the worklog or None if there is none
+        """
+        import dateutil.parser
+
+        worklogs = self.cache.get_or_load(('worklogs', issue_name), lambda: self.jira.worklogs(issue_name))
+        for worklog in worklogs:
+            if dateutil.parser.parse(worklog.started) == started and worklog.timeSpentSeconds == seconds:
+                return worklog
+        return None
+
+    def __log_work(self, fact, retry):
+        from dateutil.tz import tzlocal
+
+        minutes = fact['seconds'] // 60
+        time_spent = '%dm' % minutes
         issue_name = self.__issue_from_fact(fact)
-        tstart = fact.start_time
+        tstart = payload_start_time(fact)
         if issue_name:
-            try:
-                logger.info('Log work: %s - %s to %s', tstart, time_spent, issue_name)
-                if tstart.tzinfo is None:
-                    logger.info("Start time without timezone. Use local timzone info!")
-                    tstart = tstart.replace(tzinfo=tzlocal())
-                worklog = self.jira.add_worklog(issue_name, time_spent, started=tstart, comment=fact.description)
-                logger.info('Logged work: %s - %s to %s (created %r)', fact.start_time, time_spent, issue_name, worklog)
-            except JIRAError:
-                logger.exception('Error communicating with Jira')
+            logger.info('Log work: %s - %s to %s', tstart, time_spent, issue_name)
+            if tstart.tzinfo is None:
+                logger.info("Start time without timezone. Use local timzone info!")
+                tstart = tstart.replace(tzinfo=tzlocal())
+            if retry:
+                worklog = self.__find_worklog(issue_name, tstart, minutes * 60)
+                if worklog is not None:
+                    logger.info('Work %s - %s was already logged to %s', tstart, time_spent, issue_name)
+                    self.record_worklog(fact, issue_name, worklog.id)
+                    return False
+            worklog = self.jira.add_worklog(issue_name, time_spent, started=tstart, comment=fact['description'])
+            self.cache.invalidate(('worklogs', issue_name))
+            self.record_worklog(fact, issue_name, worklog.id)
+            logger.info('Logged work: %s - %s to %s (created %r)', tstart, time_spent, issue_name, worklog)
+            return True
         else:
             logger.debug('No jira issue found')
+            return False
+
+    def __worklog_url(self, known):
+        return self.jira._get_url('issue/%s/worklog/%s' % (known.issue, known.worklog_id))
+
+    def __delete_worklog(self, known):
+        """
+        Deletes the recorded worklog, a worklog that is already gone is fine, too.
+        """
+        try:
+            self.jira._session.delete(self.__worklog_url(known))
+        except JIRAError as e:
+            if e.status_code != 404:
+                raise
+        self.cache.invalidate(('worklogs', known.issue))
+        logger.info('Deleted worklog %s of %s', known.worklog_id, known.issue)
+
+    def __update_work(self, fact):
+        """
+        Changes the worklog of an edited fact in place. If the fact is logged to another issue now, the old worklog is
+        deleted and a new one is added. A worklog still pending in the outbox is sent with the edited fact instead, a
+        fact without worklog (f.e. without issue before) is logged now.
+        """
+        from dateutil.tz import tzlocal
+
+        known = self.worklog_to_update(fact)
+        if known is None:
+            return False
+        if known is NEW_WORKLOG:
+            return self.__log_work(fact, retry=True)
+        issue_name = self.__issue_from_fact(fact)
+        if issue_name != known.issue:
+            self.__delete_worklog(known)
+            self.forget_worklog(fact['previous_id'])
+            return self.__log_work(fact, retry=True) if issue_name else True
+
+        minutes = fact['seconds'] // 60
+        tstart = payload_start_time(fact)
+        if tstart.tzinfo is None:
+            tstart = tstart.replace(tzinfo=tzlocal())
+        data = {
+            'timeSpent': '%dm' % minutes,
+            'started': tstart.strftime('%Y-%m-%dT%H:%M:%S.000%z'),
+            'comment': fact['description'] or '',
+        }
+        try:
+            self.jira._session.put(self.__worklog_url(known), data=json.dumps(data))
+        except JIRAError as e:
+            if e.status_code != 404:
+                raise
+            logger.info('Worklog %s of %s was deleted meanwhile', known.worklog_id, issue_name)
+            self.forget_worklog(fact['previous_id'])
+            return self.__log_work(fact, retry=True)
+        self.cache.invalidate(('worklogs', issue_name))
+        if fact['previous_id'] != fact['id']:
+            self.forget_worklog(fact['previous_id'])
+        self.record_worklog(fact, issue_name, known.worklog_id)
+        logger.info('Updated worklog %s of %s: %s - %dm', known.worklog_id, issue_name, tstart, minutes)
+        return True
+
+    def __delete_work(self, fact):
+        """
+        Deletes the worklog of a deleted fact, or cancels it if it is still pending in the outbox.
+        """
+        if self.replace_pending_worklog(fact['id'], None):
+            return False
+        known = self.recorded_worklog(fact['id'])
+        if known is None:
+            return False
+        self.__delete_worklog(known)
+        self.forget_worklog(fact['id'])
+        return True
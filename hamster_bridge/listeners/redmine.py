@@ -1,18 +1,33 @@
 from __future__ import absolute_import
-import os
-
 import logging
 import re
+import time
+from collections import namedtuple
 
+from hamster_bridge import transport
 from hamster_bridge.listeners import (
     HamsterListener,
     ConfigValue,
+    NEW_WORKLOG,
+    TIME_FORMAT,
+    fact_payload,
+    parse_bool,
+    parse_verify_ssl,
+    payload_key,
+    payload_start_time,
+    shared,
 )
 
 
 logger = logging.getLogger(__name__)
 
 
+# status_default is None to use the default status of redmine, verify is the verify option of requests
+RedmineSettings = namedtuple('RedmineSettings', [
+    'server_url', 'api_key', 'version', 'verify', 'auto_start', 'lookup_refresh', 'status_default', 'status_in_work',
+])
+
+
 class RedmineHamsterListener(HamsterListener):
     """
     Redmine listener for hamster tasks,
@@ -23,6 +38,7 @@ class RedmineHamsterListener(HamsterListener):
     INFO: Unfortunately the Redmine API returns issue statuses in the currently set language.
           There is only the id and the name of the status.
           f.e. "New" has usually ID 1, but its name would be "Neu" in a German installation.
+          Set the config value 'status_in_work' to the name(s) of your "In Work" status in other languages.
     """
     short_name = 'redmine'
 
@@ -58,84 +74,146 @@ class RedmineHamsterListener(HamsterListener):
     # Redmine issue key is just a number
     issue_from_title = re.compile('([0-9]+)\ ')
 
+    # default names of the "In Work" status, separated by commas
+    status_in_work = u'In Bearbeitung, In Work'
+
     def __init__(self):
         """
         Sets up the class be defining some internal variables.
         """
-        # issue status dict for the default issue status
-        self.__issue_status_default = None
+        # id of the default issue status
+        self.__issue_status_default_id = None
 
-        # issue status dict for the "in Work" status
-        self.__issue_status_in_work = None
+        # id of the "in Work" status
+        self.__issue_status_in_work_id = None
 
         # the redmine instance
         self.redmine = None
 
-        # will store the activities
-        self.__activities = {}
+        # the issue statuses by id and by normalized name
+        self.__statuses_by_id = {}
+        self.__statuses_by_name = {}
+
+        # the ids of the activities by normalized name and the one of the first activity
+        self.__activities_by_name = {}
+        self.__first_activity_id = None
+
+        # when the activities and statuses are due to be reloaded next
+        self.__lookups_due = 0
 
     def __get_issue_from_fact(self, fact):
         """
         Tries to find an issue matching the given fact.
 
-        :param fact: the currently stopped fact
-        :type fact: hamster.lib.stuff.Fact
+        :param fact: the payload of the currently stopped fact
+        :type fact: dict
         :returns: the issue or None if not found
         :rtype:
         """
         from redmine.exceptions import ResourceNotFoundError
         
-        # iterate the possible issues, normally this should match exactly one...
-        for possible_issue in self.issue_from_title.findall(fact.activity):
+        def fetch(issue_id):
             try:
-                return self.redmine.issue.get(possible_issue)
+                return self.redmine.issue.get(issue_id)
             except ResourceNotFoundError:
                 return None
 
-        return None
+        def load(issue_id):
+            return self.cache.get_or_load(('issue', issue_id), lambda: fetch(issue_id))
+
+        issue_id = self.resolver.resolve(fact, lambda possible_issue: load(possible_issue) is not None)
+        if issue_id is None:
+            return None
+        return load(issue_id)
 
-    def __filter_issue_statuses(self):
+    @staticmethod
+    def __normalize(name):
         """
-        Filters the issue statuses for the relevant ones: the default and the status "In Work".
+        :returns: the name as compared to tags and the configured status names
+        :rtype: unicode
         """
+        if not isinstance(name, unicode):
+            name = unicode(name, 'utf-8')
+        return u' '.join(name.split()).lower()
 
-        def find_default(element):
-            """
-            Filter function to find the default issue status.
-            """
-            return hasattr(element, 'is_default') and getattr(element, 'is_default', False)
-
-        def find_in_work(element):
-            """
-            Filter function to find the in work status.
-            """
-            return element.name in [u'In Bearbeitung', u'In Work']
-
-        # get the issue statuses
-        issue_statuses = self.redmine.issue_status.all()
-
-        # if none are found, raise
+    def __load_activities(self):
+        """
+        Loads the activities for time entries and indexes them by their normalized name.
+        """
+        activities_by_name = {}
+        first_activity_id = None
+        logger.info('### Available Redmine activities for using as tag value:')
+        for tea in self.redmine.enumeration.filter(resource='time_entry_activities'):
+            activities_by_name.setdefault(self.__normalize(tea.name), tea.id)
+            if first_activity_id is None:
+                first_activity_id = tea.id
+            logger.info('### ' + tea.name)
+        self.__activities_by_name = activities_by_name
+        self.__first_activity_id = first_activity_id
+
+    def __load_issue_statuses(self):
+        """
+        Loads the issue statuses, indexes them by id and by normalized name and finds the relevant ones: the default
+        (or the one named by the config value 'status_default') and the "In Work" status named by the config value
+        'status_in_work'.
+        """
+        issue_statuses = list(self.redmine.issue_status.all())
         if len(issue_statuses) == 0:
-            logger.exception('Unable to fetch issue statuses! Not possible to proceed!')
-
-        try:
-            self.__issue_status_default = [item for item in issue_statuses if find_default(item)][0]
-        except IndexError:
-            logger.exception('Unable to find a single default issue status!')
-
-        try:
-            self.__issue_status_in_work = [item for item in issue_statuses if find_in_work(item)][0]
-        except IndexError:
-            logger.exception('Unable to find a single "In Work" issue status!')
+            logger.error('Unable to fetch issue statuses! Not possible to proceed!')
+            return
 
-    def __get_first_activity_id(self):
+        statuses_by_id = {}
+        statuses_by_name = {}
+        default_id = None
+        for status in issue_statuses:
+            statuses_by_id[status.id] = status
+            statuses_by_name.setdefault(self.__normalize(status.name), status)
+            if default_id is None and getattr(status, 'is_default', False):
+                default_id = status.id
+        self.__statuses_by_id = statuses_by_id
+        self.__statuses_by_name = statuses_by_name
+
+        default_name = self.settings.status_default
+        if default_name:
+            default_id = self.__status_id(default_name)
+        if default_id is None:
+            logger.error('Unable to find a single default issue status!')
+        self.__issue_status_default_id = default_id
+
+        in_work_id = self.__status_id(self.settings.status_in_work)
+        if in_work_id is None:
+            logger.error('Unable to find a single "In Work" issue status!')
+        self.__issue_status_in_work_id = in_work_id
+
+    def __status_id(self, names):
         """
-        Returns the first activity that was retrieved.
-        The first activity was marked with a True value.
-        :return: the id of the first activity
+        :param names: names of the status to find, separated by commas
+        :type names: str
+        :returns: the id of the first status found or None
         :rtype: int
         """
-        return [key for key, value in self.__activities.items() if value[1]][0]
+        for name in names.split(','):
+            status = self.__statuses_by_name.get(self.__normalize(name))
+            if status is not None:
+                return status.id
+        return None
+
+    def __refresh_lookups(self, force=False):
+        """
+        Reloads the activities and issue statuses if the config value 'lookup_refresh' (seconds, default 3600) passed
+        since they were loaded, so the ones added on the server are picked up without a restart.
+        """
+        from redmine.exceptions import BaseRedmineError
+
+        now = time.time()
+        if not force and now < self.__lookups_due:
+            return
+        self.__lookups_due = now + self.settings.lookup_refresh
+        try:
+            self.__load_activities()
+            self.__load_issue_statuses()
+        except (BaseRedmineError, IOError):
+            logger.exception('Unable to communicate with redmine server. See error in the following output:')
 
     def __get_activity_id(self, tags):
         """
@@ -146,20 +224,25 @@ class RedmineHamsterListener(HamsterListener):
         :return: the activity id
         :rtype: int
         """
-        if len(tags) == 0:
-            # this grabs the first activity from the dict
-            return self.__get_first_activity_id()
-        else:
-            for activity_id, activity_value in self.__activities.viewitems():
-                try:
-                    next(tag for tag in tags if tag == activity_value[0])
-                    return activity_id
-                except StopIteration:
-                    # if not found
-                    continue
-
-            # fallback if no tag matches
-            return self.__get_first_activity_id()
+        for tag in tags:
+            activity_id = self.__activities_by_name.get(self.__normalize(tag))
+            if activity_id is not None:
+                return activity_id
+
+        # fallback if no tag matches
+        return self.__first_activity_id
+
+    def parse_settings(self):
+        return RedmineSettings(
+            server_url=self.get_from_config('server_url'),
+            api_key=self.get_from_config('api_key'),
+            version=self.get_from_config('version'),
+            verify=parse_verify_ssl(self.get_from_config('verify_ssl')),
+            auto_start=parse_bool('auto_start', self.get_from_config('auto_start')),
+            lookup_refresh=float(self.get_from_config('lookup_refresh', 3600)),
+            status_default=self.get_from_config('status_default') or None,
+            status_in_work=self.get_from_config('status_in_work', self.status_in_work),
+        )
 
     def prepare(self):
         """
@@ -167,49 +250,33 @@ class RedmineHamsterListener(HamsterListener):
         While doing so, grabs the issue statuses, too, used for on_fact_stopped.
         """
         from redmine import Redmine
-        from redmine.exceptions import BaseRedmineError
-        
-        verify_ssl = self.get_from_config('verify_ssl')
-        requests_dict = {}
-        if verify_ssl.lower() in ('y', 'true'):
-            logger.info("Enabling SSL/TLS certificate verification (default CA path)")
-            requests_dict['verify'] = True
-        elif verify_ssl.lower() in ('n', 'false'):
-            logger.warn("Disabling SSL/TLS certificate verification")
-            requests_dict['verify'] = False
-        elif os.path.isfile(verify_ssl):
-            logger.info("Enabling SSL/TLS certificate verification (custom CA "
-                "path) '%s'", verify_ssl)
-            requests_dict['verify'] = verify_ssl
-        else:
-            logger.error("verify_ssl = '%s' is not a valid CA cert path nor a "
-                "valid option. Falling back to enabling SSL/TLS verification "
-                "with default CA path", verify_ssl)
-            requests_dict['verify'] = True
-
-        # setup the redmine instance
-        self.redmine = Redmine(
-            self.get_from_config('server_url'),
-            key=self.get_from_config('api_key'),
-            version=self.get_from_config('version'),
-            requests=requests_dict,
-        )
-        # fetch the possible activities for time entries
-        time_entry_activities = self.redmine.enumeration.filter(resource='time_entry_activities')
-
-        # only now the real http request is made, use this as connectivity check
-        try:
-            logger.info('### Available Redmine activities for using as tag value:')
-            is_first = True
-            for tea in time_entry_activities:
-                self.__activities[tea.id] = (tea.name, is_first)
-                is_first = False
-                logger.info('### ' + tea.name)
-        except (BaseRedmineError, IOError):
-            logger.exception('Unable to communicate with redmine server. See error in the following output:')
 
-        # fetch all available issue statuses and filter the default and in work ones as they are the only relevant statuses here
-        self.__filter_issue_statuses()
+        server_url, api_key, version = self.settings.server_url, self.settings.api_key, self.settings.version
+        requests_dict = {'verify': self.settings.verify}
+        self.create_cache(shared_key=server_url)
+        self.create_resolver([self.issue_from_title.pattern], ['activity'])
+
+        transport_settings = transport.settings_from_config(self)
+        requests_dict['timeout'] = (transport_settings.connect_timeout, transport_settings.read_timeout)
+
+        def connect():
+            redmine = Redmine(server_url, key=api_key, version=version, requests=requests_dict)
+            # newer python-redmine versions use a session per instance, older ones only get the timeout and rate limit
+            # (Redmine resolves unknown attributes to resources, so look into the instance only)
+            engine = vars(redmine).get('engine')
+            if engine is not None and hasattr(engine, 'session'):
+                transport.mount(engine.session, transport_settings)
+            else:
+                transport.limit_client(redmine, server_url, transport_settings)
+            return redmine
+
+        # setup the redmine instance, shared with the listeners of other bridges in this process using the same key and
+        # transport settings
+        self.redmine = shared(('redmine', server_url, api_key, version, repr(requests_dict), transport_settings),
+                              connect)
+        # fetch the possible activities for time entries and all available issue statuses,
+        # as the real http requests are made only now use this as connectivity check
+        self.__refresh_lookups(force=True)
 
     def on_fact_started(self, fact):
         """
@@ -218,24 +285,12 @@ class RedmineHamsterListener(HamsterListener):
         Uses the first found issue.
 
         :param fact: the currently stopped fact
-        :type fact: hamster.lib.stuff.Fact
+        :type fact: hamster_bridge.snapshot.BridgeFact
         """
         # if issue shall be auto started...
-        auto_start = self.get_from_config('auto_start')
-        if auto_start == 'y':
-            # fetch the issue from the hamster fact
-            issue = self.__get_issue_from_fact(fact)
-
-            # abort if no issue was found
-            if not issue:
-                logger.error('Unable to query issue for starting of hamster fact %s', fact.original_activity)
-                return
-
-            # if the issue is in the default state (aka the initial state), put it into work state
-            if issue.status.id == self.__issue_status_default.id:
-                logger.info('setting status to "In Work" for issue %d', issue.id)
-                issue.status_id = self.__issue_status_in_work.id
-                issue.save()
+        if self.settings.auto_start:
+            payload = fact_payload(fact)
+            self.submit('start', payload_key('start', payload), payload)
 
     def on_fact_stopped(self, fact):
         """
@@ -244,22 +299,238 @@ class RedmineHamsterListener(HamsterListener):
         Uses the first found issue.
 
         :param fact: the currently stopped fact
-        :type fact: hamster.lib.stuff.Fact
+        :type fact: hamster_bridge.snapshot.BridgeFact
+        """
+        payload = fact_payload(fact)
+        self.submit('worklog', payload_key('worklog', payload), payload)
+
+    def on_fact_updated(self, fact, previous):
+        """
+        Called by HamsterBridge if a fact was edited.
+        Will correct the time entry of the fact if there is one.
+
+        :param fact: the edited fact
+        :type fact: hamster_bridge.snapshot.BridgeFact
+        :param previous: the fact before it was edited
+        :type previous: hamster_bridge.snapshot.BridgeFact
+        """
+        # a running fact is logged when it stops
+        if fact.end_time is not None:
+            payload = fact_payload(fact)
+            payload['previous_id'] = previous.id
+            # time entries are looked up by day, an edit may move the fact to another one
+            payload['previous_start_time'] = previous.start_time.strftime(TIME_FORMAT)
+            self.submit('update', '%s:%s' % (payload_key('update', payload), payload['hash']), payload)
+
+    def on_fact_deleted(self, fact):
         """
+        Called by HamsterBridge if a fact was deleted.
+        Will delete the time entry of the fact if there is one.
 
+        :param fact: the deleted fact
+        :type fact: hamster_bridge.snapshot.BridgeFact
+        """
+        if fact.end_time is not None:
+            payload = fact_payload(fact)
+            self.submit('delete', payload_key('delete', payload), payload)
+
+    def batch_key(self, payload):
+        """
+        Work logs are merged if they are for the same issue and activity.
+
+        :param payload: the payload of the stopped fact
+        :type payload: dict
+        :returns: the issue and activity id or None if there is no issue
+        :rtype: tuple
+        """
+        issue = self.__get_issue_from_fact(payload)
+        if not issue:
+            return None
+        return issue.id, self.__get_activity_id(payload['tags'])
+
+    def deliver(self, action, payload, retry=False):
+        """
+        Sends the change journaled by on_fact_started or on_fact_stopped to Redmine.
+        Errors that will not go away by retrying are logged only.
+
+        :param action: 'start', 'worklog', 'update' or 'delete'
+        :type action: str
+        :param payload: the payload of the fact
+        :type payload: dict
+        :param retry: whether the change was tried to send before
+        :type retry: bool
+        :returns: whether Redmine was changed
+        :rtype: bool
+        """
+        from redmine.exceptions import AuthError, ForbiddenError, ValidationError
+
+        self.__refresh_lookups()
+        try:
+            if action == 'start':
+                return self.__start_issue(payload)
+            elif action == 'worklog':
+                return self.__log_work(payload, retry)
+            elif action == 'update':
+                return self.__update_work(payload)
+            elif action == 'delete':
+                return self.__delete_work(payload)
+            else:
+                logger.error('Unknown action "%s"', action)
+        except (AuthError, ForbiddenError, ValidationError):
+            logger.exception('Redmine refused the change for hamster fact %s', payload['activity'])
+        return False
+
+    def __start_issue(self, fact):
+        """
+        Puts the issue of the fact into work state if it is in the default state (aka the initial state).
+
+        :param fact: the payload of the started fact
+        :type fact: dict
+        """
         # fetch the issue from the hamster fact
         issue = self.__get_issue_from_fact(fact)
 
         # abort if no issue was found
         if not issue:
-            logger.error('Unable to query issue for stopping of hamster fact %s', fact.original_activity)
-            return
+            logger.error('Unable to query issue for starting of hamster fact %s', fact['activity'])
+            return False
+
+        if self.__issue_status_in_work_id is None:
+            return False
+
+        # if the issue is in the default state (aka the initial state), put it into work state
+        if issue.status.id == self.__issue_status_default_id:
+            in_work = self.__statuses_by_id[self.__issue_status_in_work_id]
+            logger.info('setting status to "%s" for issue %d', in_work.name, issue.id)
+            issue.status_id = self.__issue_status_in_work_id
+            issue.save()
+            self.cache.invalidate(('issue', str(issue.id)))
+            return True
+        return False
+
+    def __find_time_entry(self, issue, spent_on, hours, comments):
+        """
+        Finds the time entry of the issue with the given values.
+
+        :returns: the time entry or None if there is none
+        """
+        time_entries = self.cache.get_or_load(
+            ('time_entries', issue.id, spent_on),
+            lambda: list(self.redmine.time_entry.filter(issue_id=issue.id, from_date=spent_on, to_date=spent_on))
+        )
+        for time_entry in time_entries:
+            if '%0.2f' % float(time_entry.hours) == hours and (getattr(time_entry, 'comments', '') or None) == comments:
+                return time_entry
+        return None
+
+    def __log_work(self, fact, retry):
+        """
+        Logs the time of the fact to its issue.
+
+        :param fact: the payload of the stopped fact
+        :type fact: dict
+        :param retry: whether to check for an already existing time entry first
+        :type retry: bool
+        """
+        # fetch the issue from the hamster fact
+        issue = self.__get_issue_from_fact(fact)
+
+        # abort if no issue was found
+        if not issue:
+            logger.error('Unable to query issue for stopping of hamster fact %s', fact['activity'])
+            return False
+
+        hours = '%0.2f' % (fact['seconds'] / 3600.0)
+        spent_on = payload_start_time(fact).date()
+        if retry:
+            time_entry = self.__find_time_entry(issue, spent_on, hours, fact['description'])
+            if time_entry is not None:
+                logger.info('Time entry of %s hours was already created for issue %d', hours, issue.id)
+                self.record_worklog(fact, issue.id, time_entry.id)
+                return False
 
         # create the time entry
-        self.redmine.time_entry.create(
+        time_entry = self.redmine.time_entry.create(
             issue_id=issue.id,
-            hours='%0.2f' % (fact.delta.total_seconds() / 3600.0),
-            # grep the tags, convert to string (the values are dbus.String) and find an activity
-            activity_id=self.__get_activity_id([str(tag) for tag in fact.tags]),
-            comments=fact.description,
+            spent_on=spent_on,
+            hours=hours,
+            # find an activity from the tags
+            activity_id=self.__get_activity_id(fact['tags']),
+            comments=fact['description'],
         )
+        self.cache.invalidate(('time_entries', issue.id, spent_on))
+        self.record_worklog(fact, issue.id, time_entry.id)
+        return True
+
+    def __update_work(self, fact):
+        """
+        Corrects the time entry of an edited fact, moving it to another issue if necessary.
+        A time entry still pending in the outbox is created for the edited fact instead,
+        a fact without time entry (f.e. without issue before) is logged now.
+
+        :param fact: the payload of the edited fact
+        :type fact: dict
+        """
+        from redmine.exceptions import ResourceNotFoundError
+
+        known = self.worklog_to_update(fact)
+        if known is None:
+            return False
+        if known is NEW_WORKLOG:
+            return self.__log_work(fact, retry=True)
+        # the fact before the edit, updates journaled before the start time was in the payload take the recorded one
+        previous = dict(
+            fact,
+            id=fact['previous_id'],
+            start_time=fact.get('previous_start_time') or known.start_time or fact['start_time'],
+        )
+        issue = self.__get_issue_from_fact(fact)
+        if not issue:
+            logger.info('Fact %s has no issue anymore, deleting its time entry', fact['activity'])
+            self.__delete_work(previous)
+            return True
+
+        spent_on = payload_start_time(fact).date()
+        try:
+            self.redmine.time_entry.update(
+                int(known.worklog_id),
+                issue_id=issue.id,
+                spent_on=spent_on,
+                hours='%0.2f' % (fact['seconds'] / 3600.0),
+                activity_id=self.__get_activity_id(fact['tags']),
+                comments=fact['description'] or '',
+            )
+        except ResourceNotFoundError:
+            logger.info('Time entry %s was deleted meanwhile', known.worklog_id)
+            self.forget_worklog(fact['previous_id'])
+            return self.__log_work(fact, retry=True)
+        self.cache.invalidate(('time_entries', int(known.issue), payload_start_time(previous).date()))
+        self.cache.invalidate(('time_entries', issue.id, spent_on))
+        if fact['previous_id'] != fact['id']:
+            self.forget_worklog(fact['previous_id'])
+        self.record_worklog(fact, issue.id, known.worklog_id)
+        logger.info('Updated time entry %s of issue %d', known.worklog_id, issue.id)
+        return True
+
+    def __delete_work(self, fact):
+        """
+        Deletes the time entry of a deleted fact, or cancels it if it is still pending in the outbox.
+
+        :param fact: the payload of the deleted fact
+        :type fact: dict
+        """
+        from redmine.exceptions import ResourceNotFoundError
+
+        if self.replace_pending_worklog(fact['id'], None):
+            return False
+        known = self.recorded_worklog(fact['id'])
+        if known is None:
+            return False
+        try:
+            self.redmine.time_entry.delete(int(known.worklog_id))
+        except ResourceNotFoundError:
+            pass
+        self.cache.invalidate(('time_entries', int(known.issue), payload_start_time(fact).date()))
+        self.forget_worklog(fact['id'])
+        logger.info('Deleted time entry %s of issue %s', known.worklog_id, known.issue)
+        return True
@@ -0,0 +1,182 @@
+import logging
+import re
+import threading
+import time
+
+from hamster_bridge.listeners.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+# marks facts whose issue is not remembered
+_UNRESOLVED = object()
+
+
+class KnownProjects(object):
+    """
+    The keys of the projects on the bugtracker, loaded on first use and again after a time to live. A key that is not
+    among them reloads them right away, at most once per min_reload seconds, so the issues of a project created
+    meanwhile are not skipped until the time to live is over. While the projects can't be loaded any key is accepted.
+    """
+
+    def __init__(self, load, ttl=3600, min_reload=60, timer=time.time):
+        """
+        :param load: function without arguments returning the project keys or None if they can't be loaded
+        :param ttl: seconds until the projects are reloaded
+        :type  ttl: float
+        :param min_reload: minimum seconds between two loads, f.e. if keys of unknown projects show up often
+        :type  min_reload: float
+        :param timer: function returning the current time in seconds
+        """
+        self._load = load
+        self.ttl = ttl
+        self.min_reload = min_reload
+        self._timer = timer
+        self._projects = None
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def reload(self):
+        with self._lock:
+            self._reload(self._timer())
+
+    def _reload(self, now):
+        self._loaded = now
+        projects = self._load()
+        self._projects = None if projects is None else frozenset(projects)
+        if self._projects is not None:
+            logger.debug('Known projects: %s', ', '.join(sorted(self._projects)))
+
+    def __contains__(self, project):
+        with self._lock:
+            now = self._timer()
+            if self._loaded is None or now - self._loaded >= self.ttl:
+                self._reload(now)
+            elif (self._projects is None or project not in self._projects) and now - self._loaded >= self.min_reload:
+                logger.info('Reloading the projects, "%s" is not known yet', project)
+                self._reload(now)
+            return self._projects is None or project in self._projects
+
+
+class IssueResolver(object):
+    """
+    Finds the issue a fact is about. All key patterns are compiled into a single regex that is run over the
+    configured fields of the fact (activity, tags, description) in this order. Keys of projects that are not known to
+    exist are rejected without asking the bugtracker, the remaining candidates are validated in order until one exists
+    or all at once if the bugtracker can.
+    The result is remembered per fact, so start and stop of a fact resolve its issue only once.
+    """
+
+    fields = ('activity', 'tags', 'description')
+
+    def __init__(self, patterns, fields=('activity', 'tags'), project_of=None, memo_size=1024, memo_ttl=3600):
+        """
+        :param patterns: regexes of the issue keys, if a pattern has groups the first matching one is the key
+        :type  patterns: list
+        :param fields: fields of the fact to search in order, see IssueResolver.fields
+        :type  fields: list
+        :param project_of: function returning the project of a key, needed to reject keys of unknown projects
+        :param memo_size: number of facts to remember the issue of
+        :type  memo_size: int
+        :param memo_ttl: seconds to remember the issue of a fact
+        :type  memo_ttl: float
+        """
+        unknown = set(fields) - set(self.fields)
+        if unknown:
+            raise ValueError('Unknown fields to search issues in: %s' % ', '.join(sorted(unknown)))
+        self.patterns = list(patterns)
+        self.regex = re.compile('|'.join('(?:%s)' % pattern for pattern in self.patterns))
+        self.search_fields = list(fields)
+        self.project_of = project_of
+        self.known_projects = None
+        self._memo = TTLCache(maxsize=memo_size, ttl=memo_ttl)
+
+    @classmethod
+    def from_config(cls, listener, patterns, fields, **kwargs):
+        """
+        Creates the resolver from the optional config values 'issue_patterns' (regexes separated by whitespace) and
+        'issue_fields' (comma separated) of the listener, the given values are the defaults.
+        """
+        configured_patterns = listener.get_from_config('issue_patterns')
+        if configured_patterns:
+            patterns = configured_patterns.split()
+        configured_fields = listener.get_from_config('issue_fields')
+        if configured_fields:
+            fields = [field.strip() for field in configured_fields.split(',') if field.strip()]
+        return cls(patterns, fields, **kwargs)
+
+    def set_known_projects(self, projects):
+        """
+        :param projects: the projects keys can belong to, a KnownProjects reloads them, None accepts any
+        :type  projects: iterable or KnownProjects
+        """
+        if projects is None or isinstance(projects, KnownProjects):
+            self.known_projects = projects
+        else:
+            self.known_projects = frozenset(projects)
+
+    def _texts(self, payload):
+        for field in self.search_fields:
+            if field == 'tags':
+                for tag in payload['tags']:
+                    yield tag
+            elif payload.get(field):
+                yield payload[field]
+
+    def candidates(self, payload):
+        """
+        :param payload: the payload of the fact
+        :type  payload: dict
+        :returns: the possible issue keys in the order they appear, without duplicates and keys of unknown projects
+        :rtype: list
+        """
+        return self._candidates(payload)[0]
+
+    def _candidates(self, payload):
+        """
+        :returns: the candidates and whether keys of unknown projects were left out
+        :rtype: tuple
+        """
+        result = []
+        rejected = False
+        for text in self._texts(payload):
+            for match in self.regex.finditer(text):
+                key = next((group for group in match.groups() if group is not None), match.group(0))
+                if key in result:
+                    continue
+                if self.known_projects is not None and self.project_of is not None \
+                        and self.project_of(key) not in self.known_projects:
+                    logger.debug('Ignoring "%s", there is no such project', key)
+                    rejected = True
+                    continue
+                result.append(key)
+        return result, rejected
+
+    def resolve(self, payload, validate, validate_many=None):
+        """
+        Returns the first candidate the validate function accepts. With a validate_many function several candidates
+        are validated at once, f.e. in a single request, the first existing one in the original order still wins.
+        Exceptions of the validate functions are passed on and nothing is remembered in that case, neither is the lack
+        of an issue if keys of unknown projects were left out, as the project may show up on the next reload.
+
+        :param payload: the payload of the fact
+        :type  payload: dict
+        :param validate: function returning whether the given key is an existing issue
+        :param validate_many: function returning the set of the given keys that are existing issues
+        :returns: the key or None if there is no issue
+        """
+        memo_key = (payload['id'], tuple(self._texts(payload)))
+
+        key = self._memo.get(memo_key, _UNRESOLVED)
+        if key is not _UNRESOLVED:
+            return key
+        candidates, rejected = self._candidates(payload)
+        logger.debug('Issue candidates of fact %s: %r', payload['id'], candidates)
+        if validate_many is not None and len(candidates) > 1:
+            existing = validate_many(candidates)
+            key = next((candidate for candidate in candidates if candidate in existing), None)
+        else:
+            key = next((candidate for candidate in candidates if validate(candidate)), None)
+        if key is not None or not rejected:
+            self._memo.set(memo_key, key)
+        return key
@@ -0,0 +1,135 @@
+import threading
+from collections import deque, namedtuple
+
+# a transition of a workflow, the statuses are given by id
+Transition = namedtuple('Transition', ['id', 'name', 'source', 'target'])
+
+
+class TransitionGraph(object):
+    """
+    The transitions of a workflow (f.e. of the issues of one type in a JIRA project) as far as they were seen: the
+    transitions available in a status are learned whenever they are fetched for an issue in that status. The status to
+    start issues in is learned from the transition named by the config, or else is the first status of the category
+    "in progress" seen. The shortest path from a status to it is found with a breadth first search, so issues that are
+    not in a status where the transition is available are started with several transitions. While no path is known,
+    explore() leads to the nearest status whose transitions were not seen yet, to learn them once the issue got there.
+    """
+
+    # the key of the status category of "in progress" statuses in JIRA
+    in_progress_category = 'indeterminate'
+
+    # the key of the status category of finished issues in JIRA, those statuses are not explored
+    done_category = 'done'
+
+    def __init__(self, transition_name=None):
+        """
+        :param transition_name: name of the transition leading to the status to start issues in
+        :type  transition_name: unicode
+        """
+        self.transition_name = transition_name
+        self.target = None
+        self._fallback_target = None
+        self._transitions = {}
+        self._categories = {}
+        self._lock = threading.Lock()
+
+    def learn(self, status, transitions):
+        """
+        Remembers the transitions available in the status.
+
+        :param status: the id of the status
+        :type  status: str
+        :param transitions: the transitions as returned by JIRA, dicts with id, name and to
+        :type  transitions: list
+        """
+        learned = []
+        categories = {}
+        for transition in transitions:
+            target = transition['to']
+            category = (target.get('statusCategory') or {}).get('key')
+            learned.append(Transition(str(transition['id']), transition['name'], status, str(target['id'])))
+            categories[str(target['id'])] = category
+            if self.target is None and transition['name'] == self.transition_name:
+                self.target = str(target['id'])
+            elif self._fallback_target is None and category == self.in_progress_category:
+                self._fallback_target = str(target['id'])
+        with self._lock:
+            self._transitions[status] = learned
+            self._categories.update(categories)
+
+    def knows(self, status):
+        """
+        :returns: whether the transitions available in the status were learned
+        :rtype: bool
+        """
+        with self._lock:
+            return status in self._transitions
+
+    def forget(self, status):
+        """
+        Forgets the transitions available in the status, f.e. because one of them failed.
+        """
+        with self._lock:
+            self._transitions.pop(status, None)
+
+    def start_status(self):
+        """
+        :returns: the id of the status to start issues in or None if it is not known yet
+        :rtype: str
+        """
+        return self.target or self._fallback_target
+
+    def path(self, status, target=None):
+        """
+        :param status: the id of the status to start from
+        :type  status: str
+        :param target: the id of the status to reach, defaults to start_status()
+        :type  target: str
+        :returns: the shortest list of transitions leading from the status to the target, empty if it is the target
+                  and None if no path is known
+        :rtype: list of Transition
+        """
+        target = target or self.start_status()
+        if target is None:
+            return None
+        if status == target:
+            return []
+        return self._search(status, lambda reached: reached == target)
+
+    def explore(self, status):
+        """
+        :param status: the id of the status to start from
+        :type  status: str
+        :returns: the shortest list of transitions leading from the status to one whose transitions were not learned
+                  yet, statuses of finished issues left out, or None if there is none
+        :rtype: list of Transition
+        """
+        with self._lock:
+            categories = dict(self._categories)
+            known = set(self._transitions)
+        return self._search(
+            status,
+            lambda reached: reached not in known,
+            lambda reached: categories.get(reached) != self.done_category,
+        )
+
+    def _search(self, status, found, allowed=lambda reached: True):
+        # breadth first search for the shortest path to a status found() is true for, via allowed() statuses only
+        with self._lock:
+            transitions = dict(self._transitions)
+        previous = {status: None}
+        queue = deque([status])
+        while queue:
+            current = queue.popleft()
+            for transition in transitions.get(current, ()):
+                if transition.target in previous or not allowed(transition.target):
+                    continue
+                previous[transition.target] = transition
+                if found(transition.target):
+                    path = []
+                    while transition is not None:
+                        path.append(transition)
+                        transition = previous[transition.source]
+                    return path[::-1]
+                queue.append(transition.target)
+        return None
@@ -0,0 +1,268 @@
+import BaseHTTPServer
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, unicode(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for key, value in sorted(labels.items())
+    )
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    """
+    Base of the metrics, holds a value per combination of label values.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def samples(self):
+        """
+        :returns: (name, labels, value) tuples of this metric
+        :rtype: list
+        """
+        with self._lock:
+            return [(self.name, dict(labels), value) for labels, value in self._values.items()]
+
+
+class Counter(Metric):
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+
+    type = 'histogram'
+
+    buckets = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts = [count + (value <= bound) for count, bound in zip(counts, self.buckets)]
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the duration of the with-block, also if it raises.
+        """
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                labels = dict(key)
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((self.name + '_bucket', dict(labels, le=_format_value(bound)), count))
+                samples.append((self.name + '_count', labels, counts[-1]))
+                samples.append((self.name + '_sum', labels, total))
+        return samples
+
+
+class Registry(object):
+    """
+    Keeps the metrics and the collectors, functions called on each scrape to return the current values of gauges that
+    are calculated elsewhere (f.e. queue depth), as (name, documentation, labels, value) tuples.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        with self._lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    def render(self):
+        """
+        :returns: all metrics in the prometheus text exposition format
+        :rtype: str
+        """
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        for metric in metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+        gauges = {}
+        for collector in collectors:
+            try:
+                for name, documentation, labels, value in collector():
+                    gauges.setdefault((name, documentation), []).append((labels, value))
+            except Exception:
+                logger.exception('Collecting metrics failed')
+        for (name, documentation), samples in sorted(gauges.items()):
+            lines.append('# HELP %s %s' % (name, documentation))
+            lines.append('# TYPE %s gauge' % name)
+            for labels, value in samples:
+                lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines).encode('utf-8') + '\n'
+
+
+REGISTRY = Registry()
+
+
+CHECK_DURATION = Histogram(
+    'hamster_bridge_check_duration_seconds',
+    'Duration of a check for changed facts, including the query of hamster.',
+)
+FETCH_DURATION = Histogram(
+    'hamster_bridge_fetch_duration_seconds',
+    'Duration of fetching the facts from hamster.',
+)
+FACTS_SCANNED = Gauge(
+    'hamster_bridge_facts_scanned',
+    'Number of facts fetched from hamster and compared by the last check.',
+)
+LISTENER_DURATION = Histogram(
+    'hamster_bridge_listener_call_duration_seconds',
+    'Duration of the calls of the listeners event methods.',
+)
+LISTENER_ERRORS = Counter(
+    'hamster_bridge_listener_errors_total',
+    'Number of calls of the listeners event methods that raised an exception.',
+)
+DELIVERY_DURATION = Histogram(
+    'hamster_bridge_delivery_duration_seconds',
+    'Duration of sending a change to the bugtracker.',
+)
+DELIVERY_ERRORS = Counter(
+    'hamster_bridge_delivery_errors_total',
+    'Number of changes that failed to be sent to the bugtracker and will be retried.',
+)
+
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('Metrics request from %s: ' + format, self.client_address[0], *args)
+
+
+def serve(port, address='127.0.0.1', registry=REGISTRY):
+    """
+    Serves the metrics on http://address:port/metrics from a background thread.
+
+    :param port: the port to listen on
+    :type  port: int
+    :param address: the address to listen on, only local connections by default
+    :type  address: str
+    :returns: the server
+    """
+    class MetricsHandler(_MetricsHandler):
+        pass
+
+    MetricsHandler.registry = registry
+    server = BaseHTTPServer.HTTPServer((address, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server')
+    thread.daemon = True
+    thread.start()
+    logger.info('Serving metrics on http://%s:%d/metrics', address, port)
+    return server
+
+
+def write_textfile(path, registry=REGISTRY):
+    """
+    Writes the metrics to the file, f.e. for the textfile collector of the node exporter. The file is replaced
+    atomically so the collector never reads a half written file.
+
+    :param path: path of the file, should end with .prom
+    :type  path: str
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.hamster-bridge-metrics')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(registry.render())
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def start_textfile_writer(path, interval=15, registry=REGISTRY):
+    """
+    Writes the metrics to the file every interval seconds from a background thread.
+    """
+    def run():
+        while True:
+            try:
+                write_textfile(path, registry)
+            except Exception:
+                logger.exception('Writing metrics to %s failed', path)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='metrics-writer')
+    thread.daemon = True
+    thread.start()
+    logger.info('Writing metrics to %s every %ds', path, interval)
+    return thread
@@ -0,0 +1,379 @@
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from collections import namedtuple, OrderedDict
+
+from hamster_bridge.listeners import payload_key
+from hamster_bridge.metrics import DELIVERY_DURATION, DELIVERY_ERRORS
+from hamster_bridge.profiling import PROFILER
+
+logger = logging.getLogger(__name__)
+
+
+OutboxEntry = namedtuple('OutboxEntry', ['listener', 'key', 'action', 'payload', 'attempts'])
+
+
+class Outbox(object):
+    """
+    A local write-ahead journal (sqlite) for all changes the listeners make on their bugtracker. Every change is
+    written to it before it is sent, failed changes are retried with exponential backoff by a background flusher.
+
+    Work logs of listeners with a batch window are only delivered after that window. Once one of them is due, the
+    pending work logs with the same batch_key() are merged into it by the listener and delivered as a single one, even
+    if their own window did not pass yet, see HamsterListener.
+
+    Each change has an idempotency key unique per listener. A key that was journaled once is never added again, and a
+    retry tells the listener so it can check whether an earlier attempt did reach the server after all.
+    """
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            listener TEXT NOT NULL,
+            key TEXT NOT NULL,
+            action TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt REAL NOT NULL,
+            last_error TEXT,
+            delivered REAL,
+            PRIMARY KEY (listener, key)
+        )
+    '''
+
+    def __init__(self, path, base_backoff=30, max_backoff=3600, keep_days=30):
+        """
+        :param path: path of the sqlite file
+        :type  path: str
+        :param base_backoff: seconds to wait after the first failed attempt, doubled with every further one
+        :type  base_backoff: float
+        :param max_backoff: maximum seconds to wait between two attempts
+        :type  max_backoff: float
+        :param keep_days: days to remember delivered changes to reject duplicates
+        :type  keep_days: int
+        """
+        self.path = path
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._listeners = {}
+        self._stop = threading.Event()
+        self._thread = None
+        with self._lock, self._db:
+            self._db.execute(self.schema)
+            self._db.execute(
+                'DELETE FROM outbox WHERE delivered IS NOT NULL AND delivered < ?',
+                (time.time() - keep_days * 86400,)
+            )
+
+    def register(self, listener):
+        """
+        Makes the listener known to the flusher, which calls its deliver() method for the journaled changes.
+
+        :param listener: the HamsterListener instance
+        :type  listener: HamsterListener
+        """
+        self._listeners[listener.short_name] = listener
+        listener.outbox = self
+
+    def add(self, listener, key, action, payload, delay=0):
+        """
+        Journals a change.
+
+        :param delay: seconds before the flusher delivers the change
+        :type  delay: float
+        :returns: the entry or None if a change with this key was already journaled
+        :rtype: OutboxEntry
+        """
+        now = time.time()
+        try:
+            with self._lock, self._db:
+                self._db.execute(
+                    'INSERT INTO outbox (listener, key, action, payload, created, next_attempt) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (listener.short_name, key, action, json.dumps(payload), now, now + delay)
+                )
+        except sqlite3.IntegrityError:
+            logger.debug('Change %s of %s was already journaled', key, listener.short_name)
+            return None
+        return OutboxEntry(listener.short_name, key, action, payload, 0)
+
+    def send(self, listener, key, action, payload):
+        """
+        Journals a change and tries to deliver it right away.
+
+        :returns: True if the change was delivered now
+        :rtype: bool
+        """
+        entry = self.add(listener, key, action, payload)
+        if entry is None:
+            return False
+        return self.deliver(entry)
+
+    def deliver(self, *entries):
+        """
+        Lets the listener send the journaled change. Several entries of the same listener and action are merged by the
+        listener's merge_payloads() and sent as a single change. A failure schedules the next attempt of all entries.
+
+        :returns: True if the change was delivered
+        :rtype: bool
+        """
+        keys = set((entry.listener, entry.key) for entry in entries)
+        with self._lock:
+            if keys & self._in_flight:
+                return False
+            # the payloads may have been replaced or the entries cancelled since they were read, see replace_pending()
+            entries = self._reload(entries)
+            if not entries:
+                return False
+            self._in_flight |= keys
+        first = entries[0]
+        try:
+            listener = self._listeners[first.listener]
+            with listener.config_lock.using():
+                if len(entries) == 1:
+                    payload = first.payload
+                else:
+                    payload = listener.merge_payloads([entry.payload for entry in entries])
+                with DELIVERY_DURATION.time(listener=first.listener, action=first.action):
+                    listener.deliver(first.action, payload, retry=any(entry.attempts > 0 for entry in entries))
+        except Exception as e:
+            DELIVERY_ERRORS.inc(listener=first.listener, action=first.action)
+            self.mark_failed(entries, e)
+            return False
+        else:
+            self.mark_delivered(entries)
+            return True
+        finally:
+            with self._lock:
+                self._in_flight -= keys
+
+    def _reload(self, entries):
+        """
+        :returns: those of the entries of a single listener that are still pending, with their current payload
+        :rtype: list
+        """
+        rows = self._db.execute(
+            'SELECT key, payload FROM outbox WHERE listener = ? AND delivered IS NULL AND key IN (%s)' % ', '.join(
+                '?' * len(entries)),
+            [entries[0].listener] + [entry.key for entry in entries]
+        ).fetchall()
+        payloads = dict(rows)
+        return [
+            entry._replace(payload=json.loads(payloads[entry.key])) for entry in entries if entry.key in payloads
+        ]
+
+    def replace_pending(self, listener, fact_id, payload):
+        """
+        Replaces the payload of the work log journaled for a fact that was not delivered yet, f.e. because it waits for
+        the batch window or for its next attempt, or cancels the work log.
+
+        :param fact_id: the id of the fact the work log was journaled for
+        :param payload: the new payload or None to cancel the work log
+        :type  payload: dict
+        :returns: whether there was such a work log
+        :rtype: bool
+        :raises RuntimeError: if the work log is being delivered right now, so the caller can retry after it was
+        """
+        prefix = payload_key('worklog', {'id': fact_id, 'start_time': ''})
+        with self._lock, self._db:
+            keys = [row[0] for row in self._db.execute(
+                "SELECT key FROM outbox WHERE listener = ? AND action = 'worklog' AND delivered IS NULL "
+                "AND substr(key, 1, ?) = ?",
+                (listener.short_name, len(prefix), prefix)
+            )]
+            if not keys:
+                return False
+            if any((listener.short_name, key) in self._in_flight for key in keys):
+                raise RuntimeError('The work log of fact %s is being delivered right now' % fact_id)
+            if payload is None:
+                # kept as delivered, so the key is still rejected if it is journaled again
+                self._db.executemany(
+                    "UPDATE outbox SET delivered = ?, last_error = 'cancelled' WHERE listener = ? AND key = ?",
+                    [(time.time(), listener.short_name, key) for key in keys]
+                )
+                logger.info('Cancelled the pending work log of fact %s', fact_id)
+            else:
+                self._db.executemany(
+                    'UPDATE outbox SET payload = ? WHERE listener = ? AND key = ?',
+                    [(json.dumps(payload), listener.short_name, key) for key in keys]
+                )
+                logger.info('Replaced the pending work log of fact %s', fact_id)
+        return True
+
+    def mark_delivered(self, entries):
+        """
+        Marks the entries as delivered.
+        """
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                'UPDATE outbox SET delivered = ?, attempts = attempts + 1, last_error = NULL '
+                'WHERE listener = ? AND key = ?',
+                [(now, entry.listener, entry.key) for entry in entries]
+            )
+            if any(entry.attempts > 0 for entry in entries):
+                # the server is back, let the remaining backlog drain right away
+                self._db.execute(
+                    'UPDATE outbox SET next_attempt = ? WHERE listener = ? AND delivered IS NULL AND attempts > 0',
+                    (now, entries[0].listener)
+                )
+
+    def mark_failed(self, entries, error):
+        """
+        Schedules the next attempt of the entries after the given error.
+        """
+        first = entries[0]
+        attempts = max(entry.attempts for entry in entries)
+        delay = min(self.max_backoff, self.base_backoff * 2 ** attempts)
+        delay += random.uniform(0, delay / 10.0)
+        if attempts == 0:
+            logger.exception('Sending %s of %s failed, will retry', first.key, first.listener)
+        logger.warning(
+            'Attempt %d of %s for %s failed (%s), retrying in %ds',
+            attempts + 1, first.action, ', '.join(entry.key for entry in entries), error, delay
+        )
+        # all entries get the same next attempt, so they are merged the same way again
+        next_attempt = time.time() + delay
+        with self._lock, self._db:
+            self._db.executemany(
+                'UPDATE outbox SET attempts = attempts + 1, next_attempt = ?, last_error = ? '
+                'WHERE listener = ? AND key = ?',
+                [(next_attempt, unicode(error), entry.listener, entry.key) for entry in entries]
+            )
+
+    def delivered(self, listener, key):
+        """
+        :returns: whether the change with the key was delivered, None if it was not journaled
+        :rtype: bool
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT delivered FROM outbox WHERE listener = ? AND key = ?', (listener.short_name, key)
+            ).fetchone()
+        return None if row is None else row[0] is not None
+
+    def pending(self):
+        """
+        :returns: number of journaled changes not delivered yet
+        :rtype: int
+        """
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM outbox WHERE delivered IS NULL').fetchone()[0]
+
+    def due(self, limit=100):
+        """
+        :returns: the oldest changes that are due for delivery
+        :rtype: list
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT listener, key, action, payload, attempts FROM outbox '
+                'WHERE delivered IS NULL AND next_attempt <= ? ORDER BY created LIMIT ?',
+                (time.time(), limit)
+            ).fetchall()
+        return [
+            OutboxEntry(listener, key, action, json.loads(payload), attempts)
+            for listener, key, action, payload, attempts in rows
+        ]
+
+    def flush(self):
+        """
+        Delivers all changes that are due, in the order they were journaled.
+
+        :returns: number of delivered changes
+        :rtype: int
+        """
+        delivered = 0
+        while not self._stop.is_set():
+            entries = [entry for entry in self.due() if entry.listener in self._listeners]
+            due_keys = set((entry.listener, entry.key) for entry in entries)
+            # groups of work logs that are not due yet wait for their own window
+            groups = [
+                group for group in self._coalesce(entries + self._batch_mates(entries))
+                if any((entry.listener, entry.key) in due_keys for entry in group)
+            ]
+            results = [(self.deliver(*group), len(group)) for group in groups]
+            delivered += sum(count for success, count in results if success)
+            if not any(success for success, count in results):
+                break
+        return delivered
+
+    def _batch_mates(self, entries):
+        """
+        :returns: the pending work logs that are not due yet of the listeners with a batch window that have a work log
+                  among the entries, to be merged with the due ones
+        :rtype: list
+        """
+        names = sorted(set(
+            entry.listener for entry in entries
+            if entry.action == 'worklog' and self._listeners[entry.listener].batch_window
+        ))
+        if not names:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT listener, key, action, payload, attempts FROM outbox WHERE delivered IS NULL "
+                "AND action = 'worklog' AND next_attempt > ? AND listener IN (%s) ORDER BY created" % ', '.join(
+                    '?' * len(names)),
+                [time.time()] + names
+            ).fetchall()
+        return [
+            OutboxEntry(listener, key, action, json.loads(payload), attempts)
+            for listener, key, action, payload, attempts in rows
+        ]
+
+    def _coalesce(self, entries):
+        """
+        Groups the work logs of listeners with a batch window by their batch_key(), all other entries stay alone.
+
+        :returns: the groups of entries in the order of their first entry
+        :rtype: list
+        """
+        groups = OrderedDict()
+        for entry in entries:
+            listener = self._listeners[entry.listener]
+            group_key = None
+            if entry.action == 'worklog' and listener.batch_window:
+                try:
+                    group_key = listener.batch_key(entry.payload)
+                except Exception:
+                    logger.exception('Can not batch %s of %s', entry.key, entry.listener)
+            if group_key is None:
+                # a group of its own
+                group_key = (entry.listener, entry.key, None)
+            else:
+                group_key = (entry.listener, entry.action, group_key)
+            groups.setdefault(group_key, []).append(entry)
+        return groups.values()
+
+    def start_flusher(self, interval=10):
+        """
+        Starts the background thread that retries the failed changes.
+
+        :param interval: seconds between two looks for due changes
+        :type  interval: float
+        """
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    with PROFILER.span('outbox_flush'):
+                        delivered = self.flush()
+                    if delivered:
+                        logger.info('Delivered %d journaled changes, %d pending', delivered, self.pending())
+                except Exception:
+                    logger.exception('Flushing the outbox failed')
+
+        self._thread = threading.Thread(target=run, name='outbox-flusher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,238 @@
+import cProfile
+import datetime
+import json
+import logging
+import os
+import pstats
+import signal
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _NoSpan(object):
+    """
+    Stands in for a span while profiling is disabled, so the wrapped code pays for a single method call only.
+    """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Span(object):
+    """
+    The timing of a piece of work, f.e. a check of the bridge or a listener call, with the HTTP calls made and the
+    spans started inside of it. Used as with-block, the spans of a thread nest.
+    """
+
+    def __init__(self, profiler, name, attributes):
+        self.profiler = profiler
+        self.name = name
+        self.attributes = attributes
+        self.parent = None
+        self.started = None
+        self.seconds = None
+        self.error = None
+        self.calls = []
+        self.children = []
+
+    def __enter__(self):
+        self.parent = self.profiler._current()
+        if self.parent is None:
+            self.profiler._enter_root()
+        else:
+            self.parent.children.append(self)
+        self.profiler._local.span = self
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.time() - self.started
+        if exc_type is not None:
+            self.error = '%s: %s' % (exc_type.__name__, exc_value)
+        self.profiler._local.span = self.parent
+        if self.parent is None:
+            self.profiler._exit_root(self)
+        return False
+
+    def call_count(self):
+        """
+        :returns: the number of HTTP calls made in this span and the spans inside of it
+        :rtype: int
+        """
+        return len(self.calls) + sum(child.call_count() for child in self.children)
+
+    def as_dict(self):
+        trace = {
+            'name': self.name,
+            'started': datetime.datetime.fromtimestamp(self.started).isoformat(),
+            'duration_ms': round(self.seconds * 1000, 3),
+            'calls': self.calls,
+            'spans': [child.as_dict() for child in self.children],
+        }
+        if self.attributes:
+            trace['attributes'] = self.attributes
+        if self.error is not None:
+            trace['error'] = self.error
+        return trace
+
+
+class Profiler(object):
+    """
+    Opt-in profiling of the bridge (see --profile). While enabled, the checks of the bridge and the listener calls are
+    timed as spans recording the HTTP calls to the bugtracker made inside them (see hamster_bridge.transport). Every
+    span taking at least threshold seconds that is not part of another span is written as a JSON trace, one per line,
+    to traces_path. The code running inside the spans is profiled with cProfile as well, snapshot() writes the numbers
+    collected so far as pstats file, f.e. on SIGUSR1 (see install_signal_handler()).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.threshold = 1.0
+        self.directory = None
+        self.traces_path = None
+        self._local = threading.local()
+        self._profiles = []
+        # reentrant, as the signal handler may write a snapshot while the main thread holds it
+        self._lock = threading.RLock()
+
+    def enable(self, threshold=1.0, directory=None):
+        """
+        :param threshold: seconds a span must at least take to write its trace
+        :type  threshold: float
+        :param directory: where to write the traces and the pstats snapshots, defaults to the temporary directory
+        :type  directory: str
+        """
+        self.threshold = threshold
+        self.directory = os.path.expanduser(directory or tempfile.gettempdir())
+        self.traces_path = os.path.join(self.directory, 'hamster-bridge-traces.jsonl')
+        self.enabled = True
+        logger.info('Profiling, writing the traces of calls taking %.2fs or more to %s', threshold, self.traces_path)
+
+    def span(self, name, **attributes):
+        """
+        :param name: what is timed, f.e. "check" or the name of the listener method
+        :type  name: str
+        :param attributes: details written with the trace, f.e. the name of the listener
+        :returns: the span to time a with-block with
+        """
+        if not self.enabled:
+            return _NO_SPAN
+        return Span(self, name, attributes)
+
+    def record_call(self, method, url, status, seconds, throttled=0):
+        """
+        Adds an HTTP call to the span the current thread is in, if any.
+
+        :param method: the HTTP method
+        :type  method: str
+        :param url: the url requested
+        :type  url: str
+        :param status: the status code of the response, None if unknown or the call failed
+        :type  status: int
+        :param seconds: duration of the call
+        :type  seconds: float
+        :param throttled: seconds waited for the rate limit before the call
+        :type  throttled: float
+        """
+        if not self.enabled:
+            return
+        span = self._current()
+        if span is not None:
+            span.calls.append({
+                'method': method,
+                'url': url,
+                'status': status,
+                'duration_ms': round(seconds * 1000, 3),
+                'throttled_ms': round(throttled * 1000, 3),
+            })
+
+    def _current(self):
+        return getattr(self._local, 'span', None)
+
+    def _enter_root(self):
+        # cProfile only sees the thread it is enabled in, so each thread gets its own profile
+        profile = getattr(self._local, 'profile', None)
+        if profile is None:
+            profile = self._local.profile = cProfile.Profile()
+            with self._lock:
+                self._profiles.append(profile)
+        profile.enable()
+
+    def _exit_root(self, span):
+        self._local.profile.disable()
+        if span.seconds >= self.threshold:
+            self._write_trace(span)
+
+    def _write_trace(self, span):
+        trace = span.as_dict()
+        trace['thread'] = threading.current_thread().name
+        try:
+            with self._lock:
+                with open(self.traces_path, 'ab') as traces:
+                    traces.write(json.dumps(trace, sort_keys=True) + '\n')
+        except (IOError, OSError) as e:
+            logger.error('Can not write the trace of %s to %s: %s', span.name, self.traces_path, e)
+            return
+        logger.warning('%s took %.2fs with %d HTTP calls, trace written to %s', span.name, span.seconds,
+                       span.call_count(), self.traces_path)
+
+    def snapshot(self):
+        """
+        Writes the cProfile numbers of all spans so far as a pstats file, to be read f.e. with
+        python -m pstats PATH.
+
+        :returns: the path of the file or None if nothing was profiled yet
+        :rtype: str
+        """
+        snapshots = []
+        with self._lock:
+            profiles = list(self._profiles)
+        for profile in profiles:
+            profile.snapshot_stats()
+            if profile.stats:
+                snapshots.append(_Snapshot(profile.stats))
+        if not snapshots:
+            logger.info('Nothing profiled yet')
+            return None
+        path = os.path.join(self.directory, 'hamster-bridge-%d-%s.pstats' % (
+            os.getpid(), datetime.datetime.now().strftime('%Y%m%d-%H%M%S')))
+        pstats.Stats(*snapshots).dump_stats(path)
+        logger.info('Wrote profile of %d threads to %s', len(snapshots), path)
+        return path
+
+    def install_signal_handler(self, signum=signal.SIGUSR1):
+        """
+        Writes a snapshot whenever the process receives the signal. Must be called from the main thread.
+        """
+        def on_signal(signum, frame):
+            try:
+                self.snapshot()
+            except Exception:
+                logger.exception('Writing the profile failed')
+
+        signal.signal(signum, on_signal)
+
+
+class _Snapshot(object):
+    """
+    The numbers of a profile the way pstats.Stats loads them, without disabling the profile like Profile.create_stats.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+# the profiler of this process, disabled unless --profile is given
+PROFILER = Profiler()
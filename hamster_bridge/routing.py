@@ -0,0 +1,135 @@
+import logging
+import re
+
+from hamster_bridge.listeners.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+# the config section of the routing rules
+SECTION = 'routing'
+
+
+class FactRouter(object):
+    """
+    Decides which listeners get a fact when the bridge feeds several bugtrackers, f.e. JIRA for the product work and
+    Redmine for operations. The rules come from the [routing] section of the config file, one per listener::
+
+        [routing]
+        jira = category:Product tag:jira
+        redmine = category:Ops activity:ops-.*
+
+    A rule is a list of conditions separated by whitespace, each a field of the fact (activity, category or tag) and a
+    regular expression the whole value must match, ignoring case. A listener gets the facts matching any of its
+    conditions, listeners without a rule get all facts. The conditions of each listener and field are compiled into a
+    single regex and the listeners a fact goes to are remembered per activity, category and tags, so the rules are
+    evaluated once per fact no matter how often it changes.
+    """
+
+    fields = ('activity', 'category', 'tag')
+
+    def __init__(self, rules=None, memo_size=1024, memo_ttl=3600):
+        """
+        :param rules: the conditions by listener short name, (field, regex) tuples
+        :type  rules: dict
+        :param memo_size: number of activity, category and tags combinations to remember the listeners of
+        :type  memo_size: int
+        :param memo_ttl: seconds to remember the listeners of a combination
+        :type  memo_ttl: float
+        :raises ValueError: if a field is unknown or a regex is invalid
+        """
+        self.rules = dict(rules or {})
+        self._compiled = {}
+        for name, conditions in self.rules.items():
+            patterns = {}
+            for field, pattern in conditions:
+                if field not in self.fields:
+                    raise ValueError('Unknown field "%s" in the routing rule of %s, choose from %s' % (
+                        field, name, ', '.join(self.fields)))
+                patterns.setdefault(field, []).append(pattern)
+            try:
+                self._compiled[name] = dict(
+                    (field, re.compile('(?:%s)\\Z' % '|'.join('(?:%s)' % pattern for pattern in field_patterns),
+                                       re.IGNORECASE | re.UNICODE))
+                    for field, field_patterns in patterns.items()
+                )
+            except re.error as e:
+                raise ValueError('Invalid regex in the routing rule of %s: %s' % (name, e))
+        self._memo = TTLCache(maxsize=memo_size, ttl=memo_ttl)
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """
+        Creates the router from the [routing] section of the config, without one every listener gets all facts.
+
+        :param config: the config
+        :type  config: ConfigParser.RawConfigParser
+        :rtype: FactRouter
+        :raises ValueError: if a rule is invalid
+        """
+        rules = {}
+        if config.has_section(SECTION):
+            for name, value in config.items(SECTION):
+                conditions = []
+                for condition in value.split():
+                    field, separator, pattern = condition.partition(':')
+                    if not separator or not pattern:
+                        raise ValueError('Invalid condition "%s" in the routing rule of %s, expected field:regex' % (
+                            condition, name))
+                    conditions.append((field.lower(), pattern))
+                rules[name] = conditions
+        return cls(rules, **kwargs)
+
+    def __eq__(self, other):
+        return isinstance(other, FactRouter) and self.rules == other.rules
+
+    def __ne__(self, other):
+        return not self == other
+
+    def _matches(self, compiled, fact):
+        regex = compiled.get('activity')
+        if regex is not None and fact.activity and regex.match(fact.activity):
+            return True
+        regex = compiled.get('category')
+        if regex is not None and fact.category and regex.match(fact.category):
+            return True
+        regex = compiled.get('tag')
+        return regex is not None and any(regex.match(tag) for tag in fact.tags)
+
+    def _matching(self, fact):
+        """
+        :returns: the names of the listeners with a rule matching the fact
+        :rtype: frozenset
+        """
+        return self._memo.get_or_load(
+            (fact.activity, fact.category, fact.tags),
+            lambda: frozenset(name for name, compiled in self._compiled.items() if self._matches(compiled, fact)),
+        )
+
+    def accepts(self, listener, fact):
+        """
+        :param listener: the listener
+        :type  listener: HamsterListener
+        :param fact: the fact
+        :type  fact: BridgeFact
+        :returns: whether the listener gets the fact
+        :rtype: bool
+        """
+        return listener.short_name not in self._compiled or listener.short_name in self._matching(fact)
+
+    def route(self, fact, listeners):
+        """
+        :param fact: the fact
+        :type  fact: BridgeFact
+        :param listeners: all listeners of the bridge
+        :type  listeners: list
+        :returns: the listeners that get the fact, in the given order
+        :rtype: list
+        """
+        if not self._compiled:
+            return listeners
+        matching = self._matching(fact)
+        return [
+            listener for listener in listeners
+            if listener.short_name not in self._compiled or listener.short_name in matching
+        ]
@@ -0,0 +1,132 @@
+import logging
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _monotonic_clock():
+    """
+    :returns: a function returning seconds of a clock that never jumps and stops during suspend, or None if there is
+              none on this platform
+    """
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+
+        class Timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        libc = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = libc.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(Timespec)]
+    except (OSError, AttributeError):
+        return None
+
+    clock_monotonic = 1
+
+    def monotonic():
+        timespec = Timespec()
+        if clock_gettime(clock_monotonic, ctypes.byref(timespec)) != 0:
+            raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+        return timespec.tv_sec + timespec.tv_nsec * 1e-9
+
+    try:
+        monotonic()
+    except OSError:
+        return None
+    return monotonic
+
+
+_monotonic = _monotonic_clock()
+
+# falls back to the wall clock, suspends can't be detected then
+monotonic = _monotonic or time.time
+
+
+class AdaptivePoller(object):
+    """
+    Decides how long to sleep between two checks. Right after a change (a fact started or stopped) it polls every
+    min_interval seconds, after settle seconds without changes the interval grows by the factor backoff up to
+    max_interval, f.e. while a long running fact is tracked or nothing at all. The wakeups are aligned to multiples of
+    the interval on the wall clock, so they coincide with the full minutes hamster's times are rounded to.
+
+    A suspend of the system is detected when the wall clock advanced much more than the monotonic clock during a sleep,
+    the next checks are done at the shortest interval then.
+    """
+
+    # seconds the wall clock must be ahead of the monotonic clock after a sleep to assume a suspend
+    suspend_threshold = 10
+
+    def __init__(self, min_interval=2, max_interval=60, backoff=2, settle=300, clock=time.time, monotonic=monotonic,
+                 sleep=time.sleep):
+        """
+        :param min_interval: seconds between the checks right after a change
+        :type  min_interval: float
+        :param max_interval: maximum seconds between the checks, the same as min_interval polls at a fixed interval
+        :type  max_interval: float
+        :param backoff: factor the interval grows by per check without changes
+        :type  backoff: float
+        :param settle: seconds after a change to keep polling every min_interval seconds
+        :type  settle: float
+        :param clock: returns the seconds of the wall clock
+        :param monotonic: returns the seconds of a clock that does not advance during a suspend
+        :param sleep: sleeps the given seconds
+        """
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        self.settle = settle
+        self.clock = clock
+        self.monotonic = monotonic
+        self._sleep = sleep
+        self.interval = min_interval
+        self._last_change = monotonic()
+
+    def next_delay(self, changed):
+        """
+        :param changed: whether the last check found a change
+        :type  changed: bool
+        :returns: seconds to sleep until the next check
+        :rtype: float
+        """
+        now = self.monotonic()
+        if changed:
+            self._last_change = now
+        if changed or now - self._last_change < self.settle:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        # wake up at the next multiple of the interval on the wall clock, but not right away
+        delay = self.interval - self.clock() % self.interval
+        if delay < self.min_interval / 2.0:
+            delay += self.interval
+        return delay
+
+    def sleep(self, delay):
+        """
+        Sleeps the given seconds.
+
+        :returns: whether the system was suspended meanwhile
+        :rtype: bool
+        """
+        wall_before, monotonic_before = self.clock(), self.monotonic()
+        self._sleep(delay)
+        suspended = self.suspended(self.clock() - wall_before, self.monotonic() - monotonic_before)
+        if suspended:
+            logger.info('Resumed after a suspend of about %ds', self.clock() - wall_before - delay)
+            self.interval = self.min_interval
+            self._last_change = self.monotonic()
+        return suspended
+
+    def suspended(self, wall_elapsed, monotonic_elapsed):
+        """
+        :returns: whether the difference of the clocks during a sleep means the system was suspended (never without a
+                  monotonic clock, both are the wall clock then)
+        :rtype: bool
+        """
+        return wall_elapsed - monotonic_elapsed > self.suspend_threshold
@@ -0,0 +1,194 @@
+import datetime
+import hashlib
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+
+FactDiff = namedtuple('FactDiff', ['created', 'stopped', 'edited', 'deleted'])
+
+
+_interned = {}
+
+
+def intern_text(value):
+    """
+    Converts a string, f.e. a dbus.String, into unicode and returns the same object for equal strings, so the names of
+    activities, categories and tags are kept only once in memory. (The builtin intern() does not take unicode.)
+
+    :rtype: unicode
+    """
+    text = unicode(value)
+    return _interned.setdefault(text, text)
+
+
+def _plain_datetime(value):
+    if value is None or type(value) is datetime.datetime:
+        return value
+    return datetime.datetime(
+        value.year, value.month, value.day, value.hour, value.minute, value.second, value.microsecond, value.tzinfo
+    )
+
+
+def fact_hash(fact):
+    """
+    Calculates a hash over everything of a fact that is relevant to a bugtracker. The duration of a running fact is
+    left out on purpose as it changes on every poll.
+
+    :param fact: the fact to hash
+    :type  fact: BridgeFact
+    :returns: the hex digest
+    :rtype: str
+    """
+    content = repr((
+        fact.start_time,
+        fact.end_time,
+        fact.activity,
+        fact.category or u'',
+        fact.description or u'',
+        fact.tags,
+    ))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class BridgeFact(object):
+    """
+    The immutable, compact copy of a hamster fact the bridge keeps and passes to the listeners. All strings are unicode
+    (activity, category and tags interned), the times are plain datetimes and the duration is calculated once.
+    """
+
+    __slots__ = ('id', 'activity', 'category', 'description', 'tags', 'start_time', 'end_time', 'delta', 'hash')
+
+    def __init__(self, id, activity, category, description, tags, start_time, end_time, delta):
+        """
+        :param delta: the duration, up to now for a running fact
+        :type  delta: datetime.timedelta
+        """
+        set_value = object.__setattr__
+        set_value(self, 'id', id)
+        set_value(self, 'activity', intern_text(activity))
+        set_value(self, 'category', intern_text(category) if category else None)
+        set_value(self, 'description', unicode(description) if description else None)
+        set_value(self, 'tags', tuple([intern_text(tag) for tag in tags]))
+        set_value(self, 'start_time', _plain_datetime(start_time))
+        set_value(self, 'end_time', _plain_datetime(end_time))
+        set_value(self, 'delta', delta if type(delta) is datetime.timedelta else datetime.timedelta(
+            seconds=delta.total_seconds()))
+        set_value(self, 'hash', fact_hash(self))
+
+    @classmethod
+    def from_hamster(cls, fact):
+        """
+        :param fact: the fact as returned by hamster
+        :type  fact: hamster.lib.stuff.Fact
+        :rtype: BridgeFact
+        """
+        return cls(
+            fact.id, fact.activity, fact.category, fact.description, fact.tags, fact.start_time, fact.end_time,
+            fact.delta,
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError('BridgeFact is immutable')
+
+    __delattr__ = __setattr__
+
+    def __repr__(self):
+        return '<BridgeFact %s %r %s-%s tags=%r>' % (
+            self.id,
+            self.activity,
+            self.start_time,
+            self.end_time or '',
+            list(self.tags),
+        )
+
+
+def hamster_day(moment, day_start=datetime.time()):
+    """
+    :param moment: f.e. the start of a fact
+    :type  moment: datetime.datetime
+    :param day_start: the time the days start at, hamster starts them at 05:30 by default
+    :type  day_start: datetime.time
+    :returns: the day the moment belongs to, f.e. a fact started at 01:00 belongs to the day before with hamster
+    :rtype: datetime.date
+    """
+    return (moment - datetime.timedelta(hours=day_start.hour, minutes=day_start.minute)).date()
+
+
+class FactIndex(object):
+    """
+    Remembers the facts seen on the last poll, keyed by fact id, and calculates what changed since then. This way no
+    change gets lost when a poll happens late (suspend, slow dbus, ...) and edits of already known facts are noticed.
+    """
+
+    def __init__(self, day_start=datetime.time()):
+        """
+        :param day_start: the time the days of the fact source start at, see hamster_day()
+        :type  day_start: datetime.time
+        """
+        self.day_start = day_start
+        self._facts = {}
+
+    def __len__(self):
+        return len(self._facts)
+
+    def __contains__(self, fact_id):
+        return fact_id in self._facts
+
+    def get(self, fact_id):
+        return self._facts.get(fact_id)
+
+    def update(self, facts, today=None):
+        """
+        Replaces the index with the given facts and returns what changed compared to the previous call.
+
+        Facts that vanished are reported as deleted, unless they belong to a day before the given one. Those simply
+        rolled out of hamster's "today" and are dropped silently. The day of a fact is the one it started on, counting
+        from the day start, so a fact started after midnight rolls out together with the rest of the day.
+
+        :param facts: all facts currently known by hamster for today
+        :type  facts: list of BridgeFact
+        :param today: the day the facts were fetched for (default: today, counting from the day start)
+        :type  today: datetime.date
+        :returns: the created, stopped and deleted facts and (previous, current) pairs of the edited facts
+        :rtype: FactDiff
+        """
+        if today is None:
+            today = hamster_day(datetime.datetime.now(), self.day_start)
+        diff = FactDiff(created=[], stopped=[], edited=[], deleted=[])
+        previous = self._facts
+        current = {}
+        for fact in facts:
+            current[fact.id] = fact
+            old = previous.get(fact.id)
+            if old is None:
+                diff.created.append(fact)
+            elif old.hash == fact.hash:
+                continue
+            elif old.end_time is None and fact.end_time is not None:
+                diff.stopped.append(fact)
+            else:
+                diff.edited.append((old, fact))
+        for fact_id, old in previous.iteritems():
+            if fact_id in current:
+                continue
+            if old.start_time is not None and hamster_day(old.start_time, self.day_start) < today:
+                logger.debug('Fact %s rolled out of today', fact_id)
+            else:
+                diff.deleted.append(old)
+        if diff.created and diff.deleted:
+            # hamster gives an edited fact a new id, so a fact deleted and one created with the same start are an edit
+            deleted_by_start = dict((old.start_time, old) for old in diff.deleted)
+            for fact in list(diff.created):
+                old = deleted_by_start.pop(fact.start_time, None)
+                if old is None:
+                    continue
+                diff.created.remove(fact)
+                diff.deleted.remove(old)
+                if old.end_time is None and fact.end_time is not None:
+                    diff.stopped.append(fact)
+                else:
+                    diff.edited.append((old, fact))
+        self._facts = current
+        return diff
@@ -0,0 +1,74 @@
+import datetime
+import importlib
+
+
+# the fact sources by name, imported only when they are used
+SOURCES = {
+    'dbus': 'hamster_bridge.sources.dbus.DBusSource',
+    'sqlite': 'hamster_bridge.sources.sqlite.SQLiteSource',
+    'json': 'hamster_bridge.sources.feed.JSONSource',
+    'csv': 'hamster_bridge.sources.feed.CSVSource',
+}
+
+
+class FactSource(object):
+    """
+    Where the bridge gets the hamster facts from. The facts are yielded one by one as BridgeFacts, so a source never
+    needs to hold a long date range in memory.
+    """
+
+    # the time the days of the source start at, a fact started before belongs to the day before
+    day_start = datetime.time()
+
+    def todays_facts(self):
+        """
+        :returns: generator of today's facts including the running one
+        """
+        today = datetime.date.today()
+        return self.facts(today, today)
+
+    def facts(self, start_date, end_date):
+        """
+        :param start_date: first day
+        :type  start_date: datetime.date
+        :param end_date: last day (inclusive)
+        :type  end_date: datetime.date
+        :returns: generator of the facts started in the date range, ordered by start time
+        """
+        raise NotImplementedError
+
+    def connect_changed(self, callback):
+        """
+        Lets the source call the function with the name of the signal whenever the facts changed, if it can.
+
+        :param callback: function taking the name of the signal
+        :returns: whether the source signals changes, the facts must be polled otherwise
+        :rtype: bool
+        """
+        return False
+
+    def close(self):
+        pass
+
+
+def create_source(spec, bus_address=None):
+    """
+    Creates a fact source from its description as given on the command line: the name of the source, optionally
+    followed by a colon and its path, f.e. "dbus", "sqlite:~/.local/share/hamster-applet/hamster.db" or
+    "csv:facts.csv".
+
+    :param spec: the description
+    :type  spec: str
+    :param bus_address: address of the dbus of the hamster instance for the dbus source, defaults to the session bus
+    :type  bus_address: str
+    :rtype: FactSource
+    :raises ValueError: if there is no such source
+    """
+    name, _, path = spec.partition(':')
+    if name not in SOURCES:
+        raise ValueError('unknown fact source %r (choose from %s)' % (name, ', '.join(sorted(SOURCES))))
+    module_name, class_name = SOURCES[name].rsplit('.', 1)
+    source_class = getattr(importlib.import_module(module_name), class_name)
+    if name == 'dbus':
+        return source_class(bus_address=bus_address)
+    return source_class(path or None)
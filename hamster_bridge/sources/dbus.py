@@ -0,0 +1,69 @@
+from __future__ import absolute_import
+import datetime
+
+from hamster_bridge.snapshot import BridgeFact
+from hamster_bridge.sources import FactSource
+
+
+def _storage_on_bus(storage_class, bus):
+    """
+    Creates hamster's client storage talking to hamster on the given bus. The storage's own constructor connects to
+    the session bus and its signals right away, which fails where there is none (f.e. in a headless daemon), so only
+    the classes it is based on are initialized. The storage connects to hamster via its bus on first use.
+
+    :param storage_class: hamster.client.Storage
+    :param bus: the connection to the bus of the hamster instance
+    :type  bus: dbus.bus.BusConnection
+    """
+    storage = storage_class.__new__(storage_class)
+    super(storage_class, storage).__init__()
+    storage.bus = bus
+    storage._connection = None
+    return storage
+
+
+class DBusSource(FactSource):
+    """
+    Gets the facts from the running hamster instance via its dbus client. As the notification does not work reliable
+    in every hamster version, the bridge keeps polling even when it listens for the signals.
+    """
+
+    # hamster's default, its "today" ends at 05:30 the next morning
+    day_start = datetime.time(5, 30)
+
+    def __init__(self, bus_address=None):
+        """
+        :param bus_address: address of the dbus the hamster instance is reachable on, defaults to the session bus
+        :type  bus_address: str
+        """
+        try:
+            import hamster.client
+        except ImportError:
+            raise ImportError('Can not find hamster')
+        if bus_address is None:
+            self.bus = None
+            self.storage = hamster.client.Storage()
+        else:
+            import dbus.bus
+            self.bus = dbus.bus.BusConnection(bus_address)
+            self.storage = _storage_on_bus(hamster.client.Storage, self.bus)
+
+    def todays_facts(self):
+        for fact in self.storage.get_todays_facts():
+            yield BridgeFact.from_hamster(fact)
+
+    def facts(self, start_date, end_date):
+        for fact in self.storage.get_facts(start_date, end_date):
+            yield BridgeFact.from_hamster(fact)
+
+    def connect_changed(self, callback):
+        def receiver(signal_name):
+            return lambda *args: callback(signal_name)
+
+        for signal, signal_name in (('facts-changed', 'FactsChanged'), ('activities-changed', 'ActivitiesChanged')):
+            if self.bus is None:
+                self.storage.connect(signal, lambda storage, signal_name: callback(signal_name), signal_name)
+            else:
+                # the storage is not subscribed to the signals on another bus, see _storage_on_bus()
+                self.bus.add_signal_receiver(receiver(signal_name), signal_name, 'org.gnome.Hamster')
+        return True
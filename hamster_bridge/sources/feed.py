@@ -0,0 +1,88 @@
+import csv
+import datetime
+import json
+import os
+
+from hamster_bridge.snapshot import BridgeFact
+from hamster_bridge.sources import FactSource
+from hamster_bridge.sources.sqlite import delta_of, parse_time
+
+
+class FileSource(FactSource):
+    """
+    Reads the facts from a file, f.e. an export of hamster or stored fixtures. Each fact has the fields id, activity,
+    category, description, tags, start_time and end_time (empty while it runs), the times in the format
+    "2015-03-01 09:30:00". The file is read again on every call, so changes to it are found by polling.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path of the file
+        :type  path: str
+        """
+        if path is None:
+            raise ValueError('%s needs the path of the file' % self.__class__.__name__)
+        self.path = os.path.expanduser(path)
+        if not os.path.exists(self.path):
+            raise IOError('Can not find the fact file %s' % self.path)
+
+    def records(self):
+        """
+        :returns: generator of the facts in the file as dicts
+        """
+        raise NotImplementedError
+
+    def tags_of(self, record):
+        return record.get('tags') or []
+
+    def _facts(self, start_date, end_date, running):
+        for record in self.records():
+            start_time = parse_time(record['start_time'])
+            end_time = parse_time(record.get('end_time'))
+            if start_date <= start_time.date() <= end_date or (running and end_time is None):
+                yield BridgeFact(
+                    int(record['id']), record['activity'], record.get('category'), record.get('description'),
+                    self.tags_of(record), start_time, end_time, delta_of(start_time, end_time),
+                )
+
+    def todays_facts(self):
+        today = datetime.date.today()
+        return self._facts(today, today, True)
+
+    def facts(self, start_date, end_date):
+        return self._facts(start_date, end_date, False)
+
+
+class JSONSource(FileSource):
+    """
+    Reads the facts from a JSON file, either one object per line (JSON lines, read line by line) or a single list of
+    objects. The tags are a list of strings.
+    """
+
+    def records(self):
+        with open(self.path, 'rb') as feed:
+            first = feed.read(1)
+            while first.isspace():
+                first = feed.read(1)
+            feed.seek(0)
+            if first == '[':
+                for record in json.load(feed):
+                    yield record
+                return
+            for line in feed:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class CSVSource(FileSource):
+    """
+    Reads the facts from a CSV file with a header line naming the fields. The tags are separated by commas.
+    """
+
+    def records(self):
+        with open(self.path, 'rb') as feed:
+            for record in csv.DictReader(feed):
+                yield dict((key, value.decode('utf-8') if value else None) for key, value in record.items())
+
+    def tags_of(self, record):
+        return [tag.strip() for tag in (record.get('tags') or u'').split(',') if tag.strip()]
@@ -0,0 +1,114 @@
+from __future__ import absolute_import
+
+import datetime
+import logging
+import os
+import sqlite3
+
+from hamster_bridge.snapshot import BridgeFact
+from hamster_bridge.sources import FactSource
+
+logger = logging.getLogger(__name__)
+
+
+# where the hamster versions keep their database, the first existing one is used by default
+DATABASE_PATHS = [
+    '~/.local/share/hamster-applet/hamster.db',
+    '~/.local/share/hamster/hamster.db',
+]
+
+TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M']
+
+
+def parse_time(value):
+    """
+    :param value: a time as hamster stores it, f.e. "2015-03-01 09:30:00", or None
+    :type  value: str
+    :rtype: datetime.datetime
+    :raises ValueError: if the value is no time
+    """
+    if not value:
+        return None
+    value = value.split('.', 1)[0]
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    raise ValueError('not a time: %r' % value)
+
+
+def delta_of(start_time, end_time):
+    """
+    :returns: the duration of a fact, up to now if it is running
+    :rtype: datetime.timedelta
+    """
+    return (end_time or datetime.datetime.now().replace(microsecond=0)) - start_time
+
+
+class SQLiteSource(FactSource):
+    """
+    Reads the facts directly from hamster's sqlite database, without a running hamster or dbus, f.e. to sync a long
+    date range or on a server with a copy of the database. The database is only read. Changes are not signaled, they
+    are found by polling.
+    """
+
+    # the tags of a fact are joined with this separator in the query
+    tag_separator = u'\x1f'
+
+    query = '''
+        SELECT f.id, a.name, c.name, f.description, f.start_time, f.end_time, group_concat(t.name, ?)
+        FROM facts f
+        JOIN activities a ON a.id = f.activity_id
+        LEFT JOIN categories c ON c.id = a.category_id
+        LEFT JOIN fact_tags ft ON ft.fact_id = f.id
+        LEFT JOIN tags t ON t.id = ft.tag_id
+        WHERE (f.start_time >= ? AND f.start_time < ?) OR (? AND f.end_time IS NULL)
+        GROUP BY f.id
+        ORDER BY f.start_time, f.id
+    '''
+
+    def __init__(self, path=None):
+        """
+        :param path: path of the database, defaults to the first existing one of DATABASE_PATHS
+        :type  path: str
+        """
+        if path is None:
+            candidates = [os.path.expanduser(candidate) for candidate in DATABASE_PATHS]
+            path = next((candidate for candidate in candidates if os.path.exists(candidate)), candidates[0])
+        path = os.path.expanduser(path)
+        if not os.path.exists(path):
+            raise IOError('Can not find the hamster database %s' % path)
+        logger.debug('Reading the facts from %s', path)
+        self.path = path
+
+    def _connect(self):
+        # a connection per query, so several threads can read and the rows are streamed without holding a lock
+        db = sqlite3.connect(self.path)
+        db.execute('PRAGMA query_only = 1')
+        return db
+
+    def _facts(self, start_date, end_date, running):
+        start = start_date.strftime('%Y-%m-%d')
+        end = (end_date + datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+        db = self._connect()
+        try:
+            for fact_id, activity, category, description, start_time, end_time, tags in db.execute(
+                    self.query, (self.tag_separator, start, end, running)):
+                start_time = parse_time(start_time)
+                end_time = parse_time(end_time)
+                yield BridgeFact(
+                    fact_id, activity, category, description,
+                    sorted(tags.split(self.tag_separator)) if tags else [],
+                    start_time, end_time, delta_of(start_time, end_time),
+                )
+        finally:
+            db.close()
+
+    def todays_facts(self):
+        today = datetime.date.today()
+        # a fact started before today is still today's as long as it runs
+        return self._facts(today, today, True)
+
+    def facts(self, start_date, end_date):
+        return self._facts(start_date, end_date, False)
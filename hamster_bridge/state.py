@@ -0,0 +1,224 @@
+import datetime
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from hamster_bridge.listeners import TIME_FORMAT
+
+
+FactState = namedtuple('FactState', ['fact_id', 'start_time', 'hash', 'started', 'stopped', 'issue', 'worklog_id'])
+
+
+class SyncState(object):
+    """
+    Remembers per listener what was sent to the bugtracker for each hamster fact (sqlite): whether the issue was
+    started, whether the work was logged and with which content hash, and the issue and id of the created work log.
+    The day of the last check is kept, too, so after a restart the bridge handles exactly the facts it missed since then
+    instead of silently skipping them or logging them twice.
+    """
+
+    schema = [
+        '''
+        CREATE TABLE IF NOT EXISTS facts (
+            listener TEXT NOT NULL,
+            fact_id INTEGER NOT NULL,
+            start_time TEXT,
+            hash TEXT,
+            started INTEGER NOT NULL DEFAULT 0,
+            stopped INTEGER NOT NULL DEFAULT 0,
+            issue TEXT,
+            worklog_id TEXT,
+            updated REAL NOT NULL,
+            PRIMARY KEY (listener, fact_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        ''',
+    ]
+
+    # sqlite limits the number of parameters of a statement
+    _chunk_size = 500
+
+    def __init__(self, path, keep_days=60):
+        """
+        :param path: path of the sqlite file
+        :type  path: str
+        :param keep_days: days to remember a fact after its last change
+        :type  keep_days: int
+        """
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._last_check = None
+        with self._lock, self._db:
+            for statement in self.schema:
+                self._db.execute(statement)
+            self._db.execute('DELETE FROM facts WHERE updated < ?', (time.time() - keep_days * 86400,))
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'last_check'").fetchone()
+        if row is not None:
+            self._last_check = datetime.datetime.strptime(row[0], '%Y-%m-%d').date()
+
+    def register(self, listener):
+        """
+        Lets the listener record its work logs, see HamsterListener.record_worklog().
+
+        :param listener: the HamsterListener instance
+        :type  listener: HamsterListener
+        """
+        listener.state = self
+
+    def last_check(self):
+        """
+        :returns: the day of the last check or None if the bridge never ran with this state
+        :rtype: datetime.date
+        """
+        return self._last_check
+
+    def set_last_check(self, day):
+        """
+        Remembers the day of a check, only written if the day changed.
+
+        :type day: datetime.date
+        """
+        if day == self._last_check:
+            return
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_check', ?)",
+                (day.strftime('%Y-%m-%d'),)
+            )
+        self._last_check = day
+
+    def get(self, listener, fact_id):
+        """
+        :returns: what was sent for the fact or None if nothing
+        :rtype: FactState
+        """
+        return self.get_many(listener, [fact_id]).get(fact_id)
+
+    def get_many(self, listener, fact_ids):
+        """
+        :returns: the FactStates of those of the facts something was sent for, by fact id
+        :rtype: dict
+        """
+        fact_ids = list(fact_ids)
+        states = {}
+        with self._lock:
+            for i in range(0, len(fact_ids), self._chunk_size):
+                chunk = fact_ids[i:i + self._chunk_size]
+                rows = self._db.execute(
+                    'SELECT fact_id, start_time, hash, started, stopped, issue, worklog_id FROM facts '
+                    'WHERE listener = ? AND fact_id IN (%s)' % ', '.join('?' * len(chunk)),
+                    [listener.short_name] + chunk
+                ).fetchall()
+                for row in rows:
+                    state = FactState(row[0], row[1], row[2], bool(row[3]), bool(row[4]), row[5], row[6])
+                    states[state.fact_id] = state
+        return states
+
+    def states_since(self, listener, since):
+        """
+        :param since: the earliest start of the facts
+        :type  since: datetime.datetime
+        :returns: the FactStates of the facts started since then something was sent for
+        :rtype: list
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT fact_id, start_time, hash, started, stopped, issue, worklog_id FROM facts '
+                'WHERE listener = ? AND start_time >= ?',
+                (listener.short_name, since.strftime(TIME_FORMAT))
+            ).fetchall()
+        return [FactState(row[0], row[1], row[2], bool(row[3]), bool(row[4]), row[5], row[6]) for row in rows]
+
+    def _ensure(self, listener, fact_ids, start_time=None):
+        self._db.executemany(
+            'INSERT OR IGNORE INTO facts (listener, fact_id, start_time, updated) VALUES (?, ?, ?, ?)',
+            [(listener.short_name, fact_id, start_time, time.time()) for fact_id in fact_ids]
+        )
+
+    def mark(self, listener, action, payload):
+        """
+        Records that the listener submitted the action for the fact of the payload, see HamsterListener.submit().
+
+        :param action: 'start', 'worklog' or 'update', others are not recorded
+        :type  action: str
+        :param payload: the payload of the fact
+        :type  payload: dict
+        """
+        if action == 'start':
+            column = 'started'
+        elif action in ('worklog', 'update'):
+            column = 'stopped'
+        else:
+            return
+        with self._lock, self._db:
+            self._ensure(listener, [payload['id']], payload['start_time'])
+            self._db.execute(
+                'UPDATE facts SET %s = 1, start_time = ?, hash = coalesce(?, hash), updated = ? '
+                'WHERE listener = ? AND fact_id = ?' % column,
+                (payload['start_time'], payload.get('hash'), time.time(), listener.short_name, payload['id'])
+            )
+
+    def record_worklog(self, listener, fact_ids, issue, worklog_id):
+        """
+        Records the work log created for the facts (several if they were merged).
+
+        :param issue: the issue the work was logged to
+        :param worklog_id: the id of the work log on the bugtracker
+        """
+        with self._lock, self._db:
+            self._ensure(listener, fact_ids)
+            self._db.executemany(
+                'UPDATE facts SET issue = ?, worklog_id = ?, updated = ? WHERE listener = ? AND fact_id = ?',
+                [(unicode(issue), unicode(worklog_id), time.time(), listener.short_name, fact_id)
+                 for fact_id in fact_ids]
+            )
+
+    def facts_of_worklog(self, listener, issue, worklog_id):
+        """
+        :returns: the ids of the facts logged with the work log, more than one if they were merged
+        :rtype: list
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT fact_id FROM facts WHERE listener = ? AND issue = ? AND worklog_id = ?',
+                (listener.short_name, unicode(issue), unicode(worklog_id))
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def forget(self, listener, fact_id):
+        """
+        Removes everything recorded for the fact, f.e. after its work log was deleted.
+        """
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM facts WHERE listener = ? AND fact_id = ?', (listener.short_name, fact_id))
+
+    def seed(self, listener, facts):
+        """
+        Records the facts as handled without sending anything, used on the first start of the bridge when only the
+        changes from then on are of interest.
+
+        :param facts: the facts
+        :type  facts: list of BridgeFact
+        """
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR IGNORE INTO facts (listener, fact_id, start_time, hash, started, stopped, updated) '
+                'VALUES (?, ?, ?, ?, 1, ?, ?)',
+                [
+                    (listener.short_name, fact.id, fact.start_time.strftime(TIME_FORMAT), fact.hash,
+                     int(fact.end_time is not None), now)
+                    for fact in facts
+                ]
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
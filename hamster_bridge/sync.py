@@ -0,0 +1,148 @@
+import datetime
+import logging
+import sys
+from multiprocessing.pool import ThreadPool
+
+from hamster_bridge.listeners import fact_payload, payload_key
+
+logger = logging.getLogger(__name__)
+
+
+def iter_fact_chunks(source, start_date, end_date, chunk_days=7):
+    """
+    Fetches the finished facts of the date range from the fact source, a few days at a time, so a long range is never
+    in memory at once.
+
+    :param source: the fact source, f.e. the one of the HamsterBridge
+    :type  source: hamster_bridge.sources.FactSource
+    :param start_date: first day of the range
+    :type  start_date: datetime.date
+    :param end_date: last day of the range (inclusive)
+    :type  end_date: datetime.date
+    :param chunk_days: number of days to fetch at once
+    :type  chunk_days: int
+    :returns: generator of (number of days, list of facts) tuples
+    """
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(end_date, chunk_start + datetime.timedelta(days=chunk_days - 1))
+        logger.debug('Fetching facts from %s to %s', chunk_start, chunk_end)
+        facts = [fact for fact in source.facts(chunk_start, chunk_end) if fact.end_time is not None]
+        yield (chunk_end - chunk_start).days + 1, facts
+        chunk_start = chunk_end + datetime.timedelta(days=1)
+
+
+class Progress(object):
+    """
+    A single line progress bar on stderr, only drawn if stderr is a terminal.
+    """
+
+    width = 30
+
+    def __init__(self, total_days, stream=sys.stderr):
+        self.total_days = total_days
+        self.stream = stream
+        self.enabled = stream.isatty()
+        self.days = 0
+        self.counts = {'uploaded': 0, 'skipped': 0, 'pending': 0, 'failed': 0}
+
+    def update(self, days=0, **counts):
+        self.days += days
+        for key, value in counts.items():
+            self.counts[key] += value
+        if self.enabled:
+            done = self.width * self.days // max(self.total_days, 1)
+            self.stream.write('\r[%s%s] %d/%d days, %d uploaded, %d skipped, %d pending, %d failed' % (
+                '#' * done, ' ' * (self.width - done), self.days, self.total_days,
+                self.counts['uploaded'], self.counts['skipped'], self.counts['pending'], self.counts['failed'],
+            ))
+            self.stream.flush()
+
+    def finish(self):
+        if self.enabled:
+            self.stream.write('\n')
+
+
+class Backfill(object):
+    """
+    Uploads the work of already finished hamster facts that is missing on the bugtracker, f.e. time tracked while the
+    bridge was not running. The facts are fetched chunk by chunk and each chunk is reconciled concurrently: a fact
+    recorded in the sync state or delivered through the outbox before is skipped right away, one still pending in the
+    outbox is left to its flusher and counted as pending, otherwise the listener checks the bugtracker for an existing
+    work log before adding one.
+    """
+
+    def __init__(self, source, listener, workers=4, chunk_days=7, router=None):
+        """
+        :param source: the fact source, f.e. the one of the HamsterBridge
+        :type  source: hamster_bridge.sources.FactSource
+        :param listener: the prepared listener to upload with
+        :type  listener: HamsterListener
+        :param workers: number of facts to reconcile concurrently
+        :type  workers: int
+        :param chunk_days: number of days to fetch from hamster at once
+        :type  chunk_days: int
+        :param router: the routing rules, facts routed to other listeners only are skipped
+        :type  router: hamster_bridge.routing.FactRouter
+        """
+        self.source = source
+        self.listener = listener
+        self.workers = workers
+        self.chunk_days = chunk_days
+        self.router = router
+
+    def _sync_fact(self, fact):
+        if self.router is not None and not self.router.accepts(self.listener, fact):
+            return 'skipped'
+        state = self.listener.state
+        if state is not None:
+            known = state.get(self.listener, fact.id)
+            if known is not None and known.worklog_id is not None and known.hash == fact.hash:
+                return 'skipped'
+        payload = fact_payload(fact)
+        outbox = self.listener.outbox
+        entry = None
+        if outbox is not None:
+            key = payload_key('worklog', payload)
+            entry = outbox.add(self.listener, key, 'worklog', payload)
+            if entry is None:
+                # journaled before, but maybe not delivered yet or failed so far
+                return 'skipped' if outbox.delivered(self.listener, key) else 'pending'
+        try:
+            # treat it as a retry, so the listener looks for an existing work log first
+            uploaded = self.listener.deliver('worklog', payload, retry=True)
+        except Exception as e:
+            logger.exception('Syncing fact %s (%s) failed', payload['id'], payload['activity'])
+            if entry is not None:
+                # the outbox retries it on the next start of the bridge
+                outbox.mark_failed([entry], e)
+            return 'failed'
+        if entry is not None:
+            outbox.mark_delivered([entry])
+        if state is not None:
+            state.mark(self.listener, 'worklog', payload)
+        return 'uploaded' if uploaded else 'skipped'
+
+    def run(self, start_date, end_date):
+        """
+        Syncs all facts of the date range.
+
+        :param start_date: first day of the range
+        :type  start_date: datetime.date
+        :param end_date: last day of the range (inclusive)
+        :type  end_date: datetime.date
+        :returns: number of uploaded, skipped (already there or without issue), pending (journaled in the outbox, but
+                  not delivered yet) and failed facts
+        :rtype: dict
+        """
+        progress = Progress((end_date - start_date).days + 1)
+        pool = ThreadPool(self.workers)
+        try:
+            for days, facts in iter_fact_chunks(self.source, start_date, end_date, self.chunk_days):
+                results = pool.map(self._sync_fact, facts)
+                progress.update(days=days, **dict((result, results.count(result)) for result in set(results)))
+        finally:
+            pool.close()
+            pool.join()
+            progress.finish()
+        return progress.counts
@@ -0,0 +1,441 @@
+import calendar
+import logging
+import re
+import threading
+import time
+import urlparse
+from collections import namedtuple
+from email.utils import parsedate_tz, mktime_tz
+
+from requests.adapters import HTTPAdapter
+
+from hamster_bridge import metrics
+from hamster_bridge.profiling import PROFILER
+from hamster_bridge.scheduler import monotonic
+
+try:
+    from requests.packages.urllib3.util.retry import Retry
+except ImportError:
+    from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+# the settings of the HTTP transport the listeners talk to their bugtracker with, set by optional values in the config
+# section of each listener
+TransportSettings = namedtuple('TransportSettings', [
+    'pool_connections',
+    'pool_maxsize',
+    'connect_timeout',
+    'read_timeout',
+    'max_retries',
+    'retry_backoff',
+    'http2',
+    'rate_limit',
+    'rate_burst',
+])
+
+# config key, type and default of each setting
+_SETTINGS = [
+    ('pool_connections', int, 4),
+    ('pool_maxsize', int, 8),
+    ('connect_timeout', float, 5),
+    ('read_timeout', float, 30),
+    ('max_retries', int, 3),
+    ('retry_backoff', float, 0.5),
+    ('http2', lambda value: str(value).lower() in ('y', 'true'), 'n'),
+    ('rate_limit', float, 0),
+    ('rate_burst', int, 10),
+]
+
+
+def settings_from_config(listener):
+    """
+    Reads the transport settings from the config section of the listener, unset values get their default.
+
+    :param listener: the configured listener
+    :type  listener: HamsterListener
+    :rtype: TransportSettings
+    """
+    return TransportSettings(**dict(
+        (key, convert(listener.get_from_config(key, default)))
+        for key, convert, default in _SETTINGS
+    ))
+
+
+THROTTLE_SECONDS = metrics.Counter(
+    'hamster_bridge_throttle_seconds_total',
+    'Seconds requests to the bugtracker waited for its rate limit.',
+)
+THROTTLED_RESPONSES = metrics.Counter(
+    'hamster_bridge_throttled_responses_total',
+    'Number of responses of the bugtracker asking to slow down (HTTP 429).',
+)
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# f.e. 2026-10-18T10:00Z or 2026-10-18T10:00:00.000+0200
+_ISO_8601 = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2})(?::(\d{2})(?:[.,](\d+))?)?(Z|[+-]\d{2}(?::?\d{2})?)?\Z',
+    re.IGNORECASE,
+)
+
+
+def _iso_timestamp(value):
+    """
+    :param value: an ISO 8601 date and time, in UTC if without offset
+    :type  value: str
+    :returns: the unix timestamp or None if the value can't be parsed
+    :rtype: float
+    """
+    match = _ISO_8601.match(value.strip())
+    if match is None:
+        return None
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    timestamp = calendar.timegm((int(year), int(month), int(day), int(hour), int(minute), int(second or 0)))
+    if fraction:
+        timestamp += float('0.' + fraction)
+    if offset and offset.upper() != 'Z':
+        digits = offset[1:].replace(':', '')
+        minutes = int(digits[:2]) * 60 + int(digits[2:] or 0)
+        timestamp -= minutes * 60 if offset[0] == '+' else -minutes * 60
+    return timestamp
+
+
+def _seconds_until(value, now=None):
+    """
+    :param value: the value of a Retry-After or X-RateLimit-Reset header: seconds, a unix timestamp, a HTTP date or an
+                  ISO 8601 date and time
+    :type  value: str
+    :returns: seconds from now until then or None if the value can't be parsed
+    :rtype: float
+    """
+    now = time.time() if now is None else now
+    seconds = _number(value)
+    if seconds is None:
+        parsed = parsedate_tz(value)
+        if parsed is not None:
+            return max(0.0, mktime_tz(parsed) - now)
+        timestamp = _iso_timestamp(value)
+        if timestamp is None:
+            return None
+        return max(0.0, timestamp - now)
+    if seconds > 1e9:
+        # a unix timestamp
+        return max(0.0, seconds - now)
+    return max(0.0, seconds)
+
+
+def is_write(method):
+    """
+    :returns: whether a request of the HTTP method changes something, those are sent before the waiting lookups
+    :rtype: bool
+    """
+    return method.upper() not in ('GET', 'HEAD', 'OPTIONS')
+
+
+class RateLimiter(object):
+    """
+    Token bucket limiting the requests to a server to rate per second with bursts of up to burst requests. A rate of 0
+    does not limit until the server announces a limit. The limits are learned from the responses: Retry-After pauses
+    all requests, X-RateLimit-FillRate and X-RateLimit-Interval-Seconds (JIRA Cloud) set the rate, X-RateLimit-Limit
+    the burst and an X-RateLimit-Remaining of 0 pauses until X-RateLimit-Reset. While writes wait for a token, lookups
+    wait for them to go first.
+    """
+
+    # seconds to pause after a 429 response without Retry-After
+    default_pause = 5
+
+    # seconds a lookup waits for a write to go first if there is no rate
+    yield_delay = 0.01
+
+    def __init__(self, rate=0, burst=10, clock=monotonic, sleep=time.sleep):
+        """
+        :param rate: requests per second, 0 for no limit until the server announces one
+        :type  rate: float
+        :param burst: requests that may be sent at once after a while without requests
+        :type  burst: int
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._paused_until = 0
+        self._writes_waiting = 0
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _delay(self, now, write):
+        # seconds until the request may be sent, takes a token if it may be sent now
+        if now < self._paused_until:
+            return self._paused_until - now
+        if not write and self._writes_waiting:
+            return 1.0 / self.rate if self.rate > 0 else self.yield_delay
+        if self.rate <= 0:
+            return 0
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def acquire(self, write=False):
+        """
+        Waits until a request may be sent.
+
+        :param write: whether the request changes something, see is_write()
+        :type  write: bool
+        :returns: seconds waited
+        :rtype: float
+        """
+        started = self.clock()
+        waiting = False
+        try:
+            while True:
+                with self._lock:
+                    delay = self._delay(self.clock(), write)
+                    if delay <= 0:
+                        return self.clock() - started
+                    if write and not waiting:
+                        self._writes_waiting += 1
+                        waiting = True
+                self.sleep(delay)
+        finally:
+            if waiting:
+                with self._lock:
+                    self._writes_waiting -= 1
+
+    def learn(self, status_code, headers):
+        """
+        Adapts the limit to a response.
+
+        :param status_code: the HTTP status of the response
+        :type  status_code: int
+        :param headers: the headers of the response
+        :type  headers: dict
+        :returns: seconds all requests are paused for because of the response, 0 if not
+        :rtype: float
+        """
+        pause = 0
+        if status_code in (429, 503) and headers.get('Retry-After') is not None:
+            pause = _seconds_until(headers['Retry-After']) or 0
+        elif status_code == 429:
+            pause = self.default_pause
+        remaining = _number(headers.get('X-RateLimit-Remaining'))
+        if remaining is not None and remaining < 1 and headers.get('X-RateLimit-Reset') is not None:
+            pause = max(pause, _seconds_until(headers['X-RateLimit-Reset']) or 0)
+        fill_rate = _number(headers.get('X-RateLimit-FillRate'))
+        interval = _number(headers.get('X-RateLimit-Interval-Seconds'))
+        limit = _number(headers.get('X-RateLimit-Limit'))
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            if fill_rate and interval:
+                self.rate = fill_rate / interval
+                if limit:
+                    self.burst = max(1, int(limit))
+            elif status_code == 429 and self.rate > 0:
+                # the limit is lower than assumed and not announced, halve the rate
+                self.rate /= 2.0
+            if remaining is not None:
+                self._tokens = min(self._tokens, remaining)
+            if pause:
+                self._paused_until = max(self._paused_until, now + pause)
+        return pause
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(url, settings):
+    """
+    Returns the rate limiter of the server of the url, shared by all listeners talking to it with the same rate limit
+    settings, so changed settings take effect after a reload of the config.
+
+    :param url: an url on the server
+    :type  url: str
+    :param settings: the transport settings
+    :type  settings: TransportSettings
+    :rtype: RateLimiter
+    """
+    parsed = urlparse.urlsplit(url)
+    key = (parsed.scheme, parsed.netloc, settings.rate_limit, settings.rate_burst)
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(settings.rate_limit, settings.rate_burst)
+        return _limiters[key]
+
+
+def _traced(send, method, url, throttled, *args, **kwargs):
+    """
+    Makes an HTTP call with send(*args, **kwargs) and records it in the span of the profiler the thread is in.
+
+    :param throttled: seconds the call waited for the rate limit
+    :type  throttled: float
+    """
+    started = time.time()
+    status = None
+    try:
+        response = send(*args, **kwargs)
+        status = getattr(response, 'status_code', None)
+        return response
+    finally:
+        PROFILER.record_call(method, url, status, time.time() - started, throttled)
+
+
+def _throttled(host, method, url, seconds):
+    if seconds <= 0:
+        return 0
+    THROTTLE_SECONDS.inc(seconds, host=host)
+    if seconds >= 1:
+        logger.info('Waited %.1fs for the rate limit of %s before %s %s', seconds, host, method, url)
+    else:
+        logger.debug('Waited %.3fs for the rate limit of %s before %s %s', seconds, host, method, url)
+    return seconds
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that applies a default (connect, read) timeout to every request that does not bring its own, so a hung
+    TLS handshake or server can't block a listener forever. The requests wait for the RateLimiter of their server and
+    a request answered with 429 (too many requests) is sent again after the pause the server asked for, up to
+    rate_limit_retries times. Each call is recorded in the span of the profiler, if profiling.
+    """
+
+    def __init__(self, timeout, *args, **kwargs):
+        self.settings = kwargs.pop('settings', None)
+        self.rate_limit_retries = kwargs.pop('rate_limit_retries', 0)
+        self.timeout = timeout
+        super(TimeoutHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        send = super(TimeoutHTTPAdapter, self).send
+        if self.settings is None:
+            return _traced(send, request.method, request.url, 0, request, **kwargs)
+        limiter = limiter_for(request.url, self.settings)
+        host = urlparse.urlsplit(request.url).netloc
+        write = is_write(request.method)
+        attempt = 0
+        while True:
+            throttled = _throttled(host, request.method, request.url, limiter.acquire(write))
+            response = _traced(send, request.method, request.url, throttled, request, **kwargs)
+            pause = limiter.learn(response.status_code, response.headers)
+            if response.status_code != 429:
+                return response
+            THROTTLED_RESPONSES.inc(host=host)
+            if attempt >= self.rate_limit_retries:
+                logger.warning('Still throttled by %s after %d retries of %s %s', host, attempt, request.method,
+                               request.url)
+                return response
+            attempt += 1
+            logger.warning('Throttled by %s, sending %s %s again in %.1fs', host, request.method, request.url, pause)
+            response.close()
+
+
+def limit_client(client, url, settings):
+    """
+    Lets a bugtracker client without a requests session (f.e. python-redmine before 2.0) wait for the RateLimiter of
+    the server, by wrapping its request(method, url, ...) method. Limits are not learned from its responses then, so
+    only the configured rate_limit applies.
+
+    :param client: the client
+    :param url: the url of the server
+    :type  url: str
+    :param settings: the transport settings
+    :type  settings: TransportSettings
+    :returns: the client
+    """
+    limiter = limiter_for(url, settings)
+    host = urlparse.urlsplit(url).netloc
+    request = client.request
+
+    def limited_request(method, request_url, *args, **kwargs):
+        throttled = _throttled(host, method.upper(), request_url, limiter.acquire(is_write(method)))
+        return _traced(request, method.upper(), request_url, throttled, method, request_url, *args, **kwargs)
+
+    client.request = limited_request
+    return client
+
+
+_adapters = {}
+_adapters_lock = threading.Lock()
+
+
+def _create_adapter(settings):
+    if settings.http2:
+        try:
+            from hyper.contrib import HTTP20Adapter
+        except ImportError:
+            logger.warning('HTTP/2 needs the "hyper" package, falling back to HTTP/1.1')
+        else:
+            logger.info('Using HTTP/2 capable transport, timeouts, retries and rate limits are up to hyper')
+            return HTTP20Adapter()
+    # only idempotent requests are retried (urllib3's default), a retried POST could book time twice
+    retry_options = dict(
+        total=settings.max_retries,
+        backoff_factor=settings.retry_backoff,
+        status_forcelist=(502, 503, 504),
+    )
+    try:
+        # 429 responses are sent again by the adapter once the rate limiter lets them
+        retries = Retry(respect_retry_after_header=False, **retry_options)
+    except TypeError:
+        # older urllib3 versions don't know about Retry-After at all
+        retries = Retry(**retry_options)
+    return TimeoutHTTPAdapter(
+        (settings.connect_timeout, settings.read_timeout),
+        pool_connections=settings.pool_connections,
+        pool_maxsize=settings.pool_maxsize,
+        max_retries=retries,
+        settings=settings,
+        rate_limit_retries=settings.max_retries,
+    )
+
+
+def shared_adapter(settings):
+    """
+    Returns the adapter for the given settings. Listeners with the same settings share it and with it its connection
+    pools, so a connection to a server is reused no matter which listener opened it.
+
+    :param settings: the transport settings
+    :type  settings: TransportSettings
+    :rtype: requests.adapters.HTTPAdapter
+    """
+    with _adapters_lock:
+        if settings not in _adapters:
+            _adapters[settings] = _create_adapter(settings)
+        return _adapters[settings]
+
+
+def mount(session, settings):
+    """
+    Lets the session use the shared adapter for the settings and keep its connections alive.
+
+    :param session: the session of a bugtracker client
+    :type  session: requests.Session
+    :param settings: the transport settings
+    :type  settings: TransportSettings
+    :returns: the session
+    """
+    adapter = shared_adapter(settings)
+    session.mount('https://', adapter)
+    if not settings.http2:
+        session.mount('http://', adapter)
+    session.headers['Connection'] = 'keep-alive'
+    logger.debug('Mounted transport %r', settings)
+    return session
@@ -0,0 +1,136 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def _signature(path):
+    """
+    :returns: what changes when the file is written or replaced, None if it does not exist
+    :rtype: tuple
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size, st.st_ino
+
+
+class ConfigWatcher(object):
+    """
+    Calls a function when a watched file changed, f.e. to reload the config without a restart. The directories of the
+    files are watched via inotify if the optional pyinotify package is installed, otherwise the modification times are
+    checked every interval seconds. A single thread serves all watched files, so the bridges of a daemon share it.
+    Events that leave the file as it was, like a touch of another file in the directory, are ignored.
+    """
+
+    def __init__(self, interval=5):
+        """
+        :param interval: seconds between two checks of the modification times if inotify is not available
+        :type  interval: float
+        """
+        self.interval = interval
+        self._lock = threading.Lock()
+        # [callback, signature] by absolute path
+        self._files = {}
+        self._directories = set()
+        self._manager = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def watch(self, path, callback):
+        """
+        Calls the function without arguments whenever the file changed from now on.
+
+        :param path: path of the file
+        :type  path: str
+        :param callback: function to call
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            self._files[path] = [callback, _signature(path)]
+            if self._thread is None:
+                self._start()
+            directory = os.path.dirname(path)
+            if self._manager is not None and directory not in self._directories:
+                import pyinotify
+                # editors often replace the file instead of writing it, so watch the directory
+                self._manager.add_watch(
+                    directory,
+                    pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_CREATE,
+                )
+                self._directories.add(directory)
+
+    def unwatch(self, path):
+        """
+        Stops calling the function of the file, the thread ends with the last watched file.
+        """
+        notifier = None
+        with self._lock:
+            self._files.pop(os.path.abspath(path), None)
+            if self._files or self._thread is None:
+                return
+            if self._manager is not None:
+                notifier = self._thread
+                self._manager = None
+                self._directories = set()
+            else:
+                self._stopped.set()
+                self._stopped = threading.Event()
+            self._thread = None
+        if notifier is not None:
+            # joins the thread, which may wait for the lock in check()
+            notifier.stop()
+
+    def _start(self):
+        try:
+            import pyinotify
+        except ImportError:
+            logger.debug('Checking watched files every %ss, install pyinotify to be notified instead', self.interval)
+            self._thread = threading.Thread(target=self._poll, args=(self._stopped,), name='config-watcher')
+            self._thread.daemon = True
+            self._thread.start()
+            return
+        self._manager = pyinotify.WatchManager()
+        self._thread = pyinotify.ThreadedNotifier(
+            self._manager,
+            default_proc_fun=lambda event: self.check(event.pathname),
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _poll(self, stopped):
+        while not stopped.wait(self.interval):
+            with self._lock:
+                paths = list(self._files)
+            for path in paths:
+                self.check(path)
+
+    def check(self, path):
+        """
+        Calls the function of the file if it changed since the last call.
+
+        :returns: whether it changed
+        :rtype: bool
+        """
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is None:
+                return False
+            signature = _signature(path)
+            if signature is None or signature == entry[1]:
+                # deleted files are kept watched, they may be recreated
+                return False
+            entry[1] = signature
+            callback = entry[0]
+        logger.debug('Watched file %s changed', path)
+        try:
+            callback()
+        except Exception:
+            logger.exception('Handling the change of %s failed', path)
+        return True
+
+
+# the watcher shared by all bridges of the process
+WATCHER = ConfigWatcher()
@@ -12,9 +12,11 @@ setup(
     url='https://github.com/kraiz/hamster-bridge',
     extras_require={
         'redmine': ['python-redmine'],
+        'inotify': ['pyinotify'],
     },
-    packages=['hamster_bridge', 'hamster_bridge.listeners'],
+    packages=['hamster_bridge', 'hamster_bridge.listeners', 'hamster_bridge.sources'],
     entry_points={'console_scripts': ['hamster-bridge = hamster_bridge:main']},
     long_description=open('README.rst').read(),
-    install_requires=['jira>=0.41']
+    install_requires=['jira>=0.41'],
+    test_suite='tests',
 )
@@ -0,0 +1,52 @@
+import datetime
+
+from hamster_bridge.listeners import HamsterListener
+from hamster_bridge.snapshot import BridgeFact
+
+# yesterday, so the facts are in the range the bridge resumes and never roll out of "today" during a test
+DAY = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=1), datetime.time())
+
+
+def make_fact(fact_id, start_hour, end_hour=None, activity=u'PROJ-1 work', category=None, description=None,
+              tags=()):
+    """
+    Creates a BridgeFact on DAY, running if there is no end_hour.
+    """
+    start_time = DAY + datetime.timedelta(hours=start_hour)
+    end_time = None if end_hour is None else DAY + datetime.timedelta(hours=end_hour)
+    delta = (end_time or start_time + datetime.timedelta(minutes=5)) - start_time
+    return BridgeFact(fact_id, activity, category, description, list(tags), start_time, end_time, delta)
+
+
+class RecordingListener(HamsterListener):
+    """
+    Records the events it gets and the changes delivered to it. Delivering fails as long as failures is positive.
+    """
+
+    short_name = 'recorder'
+
+    def __init__(self, short_name=None):
+        if short_name is not None:
+            self.short_name = short_name
+        self.events = []
+        self.delivered = []
+        self.failures = 0
+
+    def on_fact_started(self, fact):
+        self.events.append(('started', fact.id))
+
+    def on_fact_stopped(self, fact):
+        self.events.append(('stopped', fact.id))
+
+    def on_fact_updated(self, fact, previous):
+        self.events.append(('updated', fact.id, previous.id))
+
+    def on_fact_deleted(self, fact):
+        self.events.append(('deleted', fact.id))
+
+    def deliver(self, action, payload, retry=False):
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError('bugtracker is down')
+        self.delivered.append((action, payload.get('merged', payload['id']), retry))
+        return True
@@ -0,0 +1,233 @@
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from hamster_bridge import metrics
+from hamster_bridge.bridge import HamsterBridge
+from hamster_bridge.listeners import fact_payload
+from hamster_bridge.sources import FactSource
+from hamster_bridge.state import SyncState
+from tests import DAY, RecordingListener, make_fact
+
+
+class ListSource(FactSource):
+    """
+    Returns the facts of a list, the facts before today for the date ranges.
+    """
+
+    def __init__(self, facts=()):
+        self.facts_list = list(facts)
+
+    def todays_facts(self):
+        return [fact for fact in self.facts_list if fact.start_time.date() == datetime.date.today()]
+
+    def facts(self, start_date, end_date):
+        return [fact for fact in self.facts_list if start_date <= fact.start_time.date() <= end_date]
+
+
+class ResumeTest(unittest.TestCase):
+    """
+    The bridge catches up with the facts changed while it was not running.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.state = SyncState(os.path.join(self.directory, 'state.sqlite'))
+        self.listener = RecordingListener()
+        self.state.register(self.listener)
+        self.source = ListSource()
+        self.bridge = HamsterBridge(workers=0, use_outbox=False, source=self.source)
+        self.bridge.add_listener(self.listener)
+        self.bridge.state = self.state
+        self.since = DAY.date()
+
+    def tearDown(self):
+        self.state.close()
+        shutil.rmtree(self.directory)
+
+    def resume(self, *facts):
+        self.source.facts_list = list(facts)
+        self.listener.events = []
+        self.bridge._resume(self.since, [])
+        return self.listener.events
+
+    def logged(self, fact):
+        self.state.mark(self.listener, 'worklog', fact_payload(fact))
+
+    def test_missed_stopped_and_started_facts(self):
+        events = self.resume(make_fact(1, 8, 9), make_fact(2, 10))
+        self.assertEqual(events, [('stopped', 1), ('started', 2)])
+
+    def test_handled_facts_are_not_sent_twice(self):
+        fact = make_fact(1, 8, 9)
+        self.logged(fact)
+        self.assertEqual(self.resume(fact), [])
+
+    def test_started_fact_that_stopped_meanwhile(self):
+        self.state.mark(self.listener, 'start', fact_payload(make_fact(1, 8)))
+        self.assertEqual(self.resume(make_fact(1, 8, 9)), [('stopped', 1)])
+
+    def test_fact_edited_in_place(self):
+        self.logged(make_fact(1, 8, 9, description=u'a'))
+        self.assertEqual(self.resume(make_fact(1, 8, 9, description=u'b')), [('updated', 1, 1)])
+
+    def test_fact_edited_with_new_id(self):
+        self.logged(make_fact(2, 8, 9, description=u'a'))
+        self.assertEqual(self.resume(make_fact(5, 8, 10, description=u'b')), [('updated', 5, 2)])
+
+    def test_running_fact_stopped_with_new_id(self):
+        self.state.mark(self.listener, 'start', fact_payload(make_fact(2, 8)))
+        self.assertEqual(self.resume(make_fact(5, 8, 9)), [('stopped', 5)])
+
+    def test_deleted_fact(self):
+        self.logged(make_fact(1, 8, 9))
+        self.logged(make_fact(2, 10, 11))
+        self.assertEqual(self.resume(make_fact(2, 10, 11)), [('deleted', 1)])
+
+    def test_facts_before_the_resumed_range_are_not_deleted(self):
+        self.logged(make_fact(1, 8 - 24, 9 - 24))
+        self.assertEqual(self.resume(), [])
+
+    def test_facts_of_the_day_before_the_resumed_range_are_not_deleted(self):
+        # started after midnight, but the source's day starts later
+        self.source.day_start = datetime.time(5, 30)
+        self.logged(make_fact(1, 1, 2))
+        self.assertEqual(self.resume(), [])
+
+    def test_resumes_at_most_resume_days(self):
+        self.since = DAY.date() - datetime.timedelta(days=30)
+        events = self.resume(make_fact(1, 8, 9), make_fact(2, 8 - 24 * 10, 9 - 24 * 10))
+        self.assertEqual(events, [('stopped', 1)])
+
+
+class FailingListener(RecordingListener):
+
+    short_name = 'failing'
+
+    def on_fact_stopped(self, fact):
+        raise IOError('bugtracker is down')
+
+
+class DirectCallTest(unittest.TestCase):
+    """
+    Without workers the listeners are called in the loop of the bridge.
+    """
+
+    def test_failing_listener_does_not_stop_the_check(self):
+        # DAY is yesterday
+        bridge = HamsterBridge(workers=0, use_outbox=False, source=ListSource([make_fact(1, 24, 25)]))
+        failing = FailingListener()
+        listener = RecordingListener()
+        bridge.add_listener(failing)
+        bridge.add_listener(listener)
+        bridge.check()
+        self.assertEqual(listener.events, [('stopped', 1)])
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_facts_scanned_by_the_last_check(self):
+        bridge = HamsterBridge(workers=0, use_outbox=False, source=ListSource([make_fact(1, 24, 25), make_fact(2, 26)]))
+        bridge.check()
+        bridge.check()
+        samples = [value for name, labels, value in metrics.FACTS_SCANNED.samples() if labels['bridge'] == bridge.name]
+        self.assertEqual(samples, [2])
+
+
+class DeletionTest(unittest.TestCase):
+    """
+    A fact missing from today's facts is only deleted on the bugtracker if it is really gone.
+    """
+
+    def setUp(self):
+        # DAY is yesterday, so the fact started today at 00:00
+        self.fact = make_fact(1, 24, 25)
+        self.source = ListSource([self.fact])
+        self.bridge = HamsterBridge(workers=0, use_outbox=False, source=self.source)
+        self.listener = RecordingListener()
+        self.bridge.add_listener(self.listener)
+        self.bridge.check()
+        self.listener.events = []
+
+    def test_fact_that_rolled_out_of_today_is_not_deleted(self):
+        # hamster's day ended, but the fact is still there
+        self.source.todays_facts = lambda: []
+        self.bridge.check()
+        self.assertEqual(self.listener.events, [])
+
+    def test_deleted_fact(self):
+        self.source.facts_list = []
+        self.bridge.check()
+        self.assertEqual(self.listener.events, [('deleted', 1)])
+
+
+class FakeGObject(object):
+    """
+    Stands in for the gobject module: the main loop calls the timeout and idle callbacks once, like glib keeping
+    those returning True.
+    """
+
+    def __init__(self):
+        self.timeouts = []
+        self.idle = []
+        self.kept = []
+
+    def timeout_add_seconds(self, seconds, callback):
+        self.timeouts.append(callback)
+
+    def idle_add(self, callback):
+        self.idle.append(callback)
+
+    def MainLoop(self):
+        return self
+
+    def run(self):
+        for callback in self.timeouts + self.idle:
+            if callback():
+                self.kept.append(callback)
+        raise KeyboardInterrupt
+
+
+class BrokenSource(ListSource):
+    """
+    Breaks once the bridge started and listens for changes.
+    """
+
+    broken = False
+
+    def connect_changed(self, callback):
+        self.broken = True
+        callback('FactsChanged')
+        return True
+
+    def todays_facts(self):
+        if self.broken:
+            raise IOError('hamster is gone')
+        return ListSource.todays_facts(self)
+
+
+class EventDrivenTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gobject = FakeGObject()
+        self.module = sys.modules.get('gobject')
+        sys.modules['gobject'] = self.gobject
+
+    def tearDown(self):
+        if self.module is None:
+            del sys.modules['gobject']
+        else:
+            sys.modules['gobject'] = self.module
+
+    def test_failing_check_keeps_the_safety_net(self):
+        bridge = HamsterBridge(workers=0, use_outbox=False, source=BrokenSource())
+        bridge.run_event_driven()
+        self.assertEqual(len(self.gobject.idle), 1)
+        self.assertEqual(self.gobject.kept, self.gobject.timeouts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import threading
+import time
+import unittest
+
+from hamster_bridge.dispatch import ListenerDispatcher
+from tests import RecordingListener, make_fact
+
+
+class ListenerDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = RecordingListener()
+        self.dispatcher = ListenerDispatcher(self.listener, queue_size=1, put_timeout=0.05)
+
+    def test_events_are_passed_on_in_order(self):
+        self.dispatcher.start()
+        self.dispatcher.submit('on_fact_started', make_fact(1, 8))
+        self.dispatcher.submit('on_fact_stopped', make_fact(1, 8, 9))
+        self.dispatcher.stop()
+        self.assertEqual(self.listener.events, [('started', 1), ('stopped', 1)])
+
+    def test_full_queue_blocks_instead_of_dropping(self):
+        # no workers yet, so the second event does not fit into the queue
+        self.dispatcher.submit('on_fact_started', make_fact(1, 8))
+        blocked = threading.Thread(target=self.dispatcher.submit, args=('on_fact_stopped', make_fact(1, 8, 9)))
+        blocked.start()
+        time.sleep(0.2)
+        self.assertTrue(blocked.is_alive())
+        self.assertGreater(self.dispatcher.stats()['full_waits'], 0)
+        self.dispatcher.start()
+        blocked.join(1)
+        self.dispatcher.stop()
+        self.assertEqual(self.listener.events, [('started', 1), ('stopped', 1)])
+        self.assertEqual(self.dispatcher.stats()['submitted'], 2)
+
+    def test_stop_with_a_full_queue_and_a_hanging_listener(self):
+        release = threading.Event()
+        self.listener.on_fact_started = lambda fact: release.wait(5)
+        self.dispatcher.start()
+        self.dispatcher.submit('on_fact_started', make_fact(1, 8))
+        # wait for the worker to hang in the first event, then fill the queue
+        while self.dispatcher.stats()['depth']:
+            time.sleep(0.01)
+        self.dispatcher.submit('on_fact_stopped', make_fact(1, 8, 9))
+        threads = list(self.dispatcher._threads)
+        started = time.time()
+        self.dispatcher.stop(timeout=0.1)
+        self.assertLess(time.time() - started, 1)
+        release.set()
+        for thread in threads:
+            thread.join(1)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(self.listener.events, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
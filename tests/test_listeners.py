@@ -0,0 +1,56 @@
+import ConfigParser
+import threading
+import unittest
+
+from tests import RecordingListener
+
+
+def make_config(**values):
+    config = ConfigParser.RawConfigParser()
+    config.add_section('recorder')
+    for key, value in values.items():
+        config.set('recorder', key, value)
+    return config
+
+
+class ReloadingListener(RecordingListener):
+
+    def parse_settings(self):
+        return self.get_from_config('value')
+
+    def prepare(self):
+        self.prepared = self.settings
+
+
+class ReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = ReloadingListener()
+        self.listener.configure(make_config(value='a'), ConfigParser.RawConfigParser())
+
+    def reload(self, config):
+        return self.listener.reload(config, ConfigParser.RawConfigParser())
+
+    def test_changed_config(self):
+        self.assertTrue(self.reload(make_config(value='b')))
+        self.assertEqual((self.listener.settings, self.listener.prepared), ('b', 'b'))
+
+    def test_unchanged_config(self):
+        self.assertFalse(self.reload(make_config(value='a')))
+
+    def test_reload_waits_for_running_deliveries(self):
+        reloading = threading.Thread(target=self.reload, args=(make_config(value='b'),))
+        with self.listener.config_lock.using():
+            # a delivery may run within an event handler
+            with self.listener.config_lock.using():
+                reloading.start()
+                reloading.join(0.1)
+            self.assertTrue(reloading.is_alive())
+            self.assertEqual(self.listener.settings, 'a')
+        reloading.join(1)
+        self.assertFalse(reloading.is_alive())
+        self.assertEqual((self.listener.settings, self.listener.prepared), ('b', 'b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
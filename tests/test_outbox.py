@@ -0,0 +1,262 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from hamster_bridge.listeners import NEW_WORKLOG, fact_payload, payload_key
+from hamster_bridge.outbox import Outbox
+from hamster_bridge.state import SyncState
+from tests import RecordingListener, make_fact
+
+
+class OutboxTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'outbox.sqlite')
+        self.outbox = Outbox(self.path, base_backoff=30, max_backoff=3600)
+        self.listener = RecordingListener()
+        self.outbox.register(self.listener)
+
+    def tearDown(self):
+        self.outbox.stop()
+        shutil.rmtree(self.directory)
+
+    def send(self, fact):
+        payload = fact_payload(fact)
+        return self.outbox.send(self.listener, payload_key('worklog', payload), 'worklog', payload)
+
+    def next_attempts(self):
+        return [row[0] for row in self.outbox._db.execute('SELECT next_attempt FROM outbox WHERE delivered IS NULL')]
+
+    def make_due(self):
+        self.outbox._db.execute('UPDATE outbox SET next_attempt = 0 WHERE delivered IS NULL')
+
+
+class OutboxTest(OutboxTestCase):
+
+    def test_send_delivers_right_away(self):
+        self.assertTrue(self.send(make_fact(1, 8, 9)))
+        self.assertEqual(self.listener.delivered, [('worklog', 1, False)])
+        self.assertEqual(self.outbox.pending(), 0)
+
+    def test_a_key_is_journaled_only_once(self):
+        self.send(make_fact(1, 8, 9))
+        self.assertFalse(self.send(make_fact(1, 8, 9)))
+        self.assertEqual(len(self.listener.delivered), 1)
+
+    def test_a_journaled_key_survives_a_restart(self):
+        self.send(make_fact(1, 8, 9))
+        self.outbox = Outbox(self.path)
+        self.outbox.register(self.listener)
+        self.assertFalse(self.send(make_fact(1, 8, 9)))
+
+    def test_failure_is_retried_with_backoff(self):
+        self.listener.failures = 2
+        started = time.time()
+        self.assertFalse(self.send(make_fact(1, 8, 9)))
+        self.assertEqual(self.outbox.pending(), 1)
+        first_delay = self.next_attempts()[0] - started
+        self.assertTrue(30 <= first_delay <= 34, first_delay)
+        # not due yet
+        self.assertEqual(self.outbox.flush(), 0)
+        self.make_due()
+        self.assertEqual(self.outbox.flush(), 0)
+        second_delay = self.next_attempts()[0] - started
+        self.assertTrue(60 <= second_delay <= 67, second_delay)
+        self.make_due()
+        self.assertEqual(self.outbox.flush(), 1)
+        self.assertEqual(self.listener.delivered, [('worklog', 1, True)])
+        self.assertEqual(self.outbox.pending(), 0)
+
+    def test_backoff_is_capped(self):
+        self.outbox.max_backoff = 100
+        self.listener.failures = 10
+        self.send(make_fact(1, 8, 9))
+        for _ in range(5):
+            self.make_due()
+            self.outbox.flush()
+        self.assertTrue(self.next_attempts()[0] - time.time() <= 110)
+
+    def test_delivery_of_a_retry_lets_the_backlog_drain(self):
+        self.listener.failures = 2
+        self.send(make_fact(1, 8, 9))
+        self.send(make_fact(2, 9, 10))
+        self.outbox._db.execute("UPDATE outbox SET next_attempt = 0 WHERE key LIKE 'worklog:1:%'")
+        self.assertEqual(self.outbox.flush(), 2)
+        self.assertEqual([fact_id for action, fact_id, retry in self.listener.delivered], [1, 2])
+
+    def test_delayed_change_is_delivered_by_flush_once_due(self):
+        payload = fact_payload(make_fact(1, 8, 9))
+        self.outbox.add(self.listener, payload_key('worklog', payload), 'worklog', payload, delay=60)
+        self.assertEqual(self.outbox.flush(), 0)
+        self.make_due()
+        self.assertEqual(self.outbox.flush(), 1)
+        self.assertEqual(self.listener.delivered, [('worklog', 1, False)])
+
+
+class BatchingListener(RecordingListener):
+
+    batch_window = 60
+
+    def batch_key(self, payload):
+        return payload['activity']
+
+
+class BatchTest(OutboxTestCase):
+
+    def setUp(self):
+        super(BatchTest, self).setUp()
+        self.listener = BatchingListener()
+        self.outbox.register(self.listener)
+
+    def hold_back(self, fact, delay=60):
+        payload = fact_payload(fact)
+        self.outbox.add(self.listener, payload_key('worklog', payload), 'worklog', payload, delay=delay)
+
+    def test_work_logs_stopped_within_the_window_are_merged(self):
+        # the second one was stopped 30s after the first, its own window is not over when the first one is due
+        self.hold_back(make_fact(1, 8, 9))
+        self.hold_back(make_fact(2, 9, 10), delay=90)
+        self.outbox._db.execute("UPDATE outbox SET next_attempt = 0 WHERE key LIKE 'worklog:1:%'")
+        self.assertEqual(self.outbox.flush(), 2)
+        self.assertEqual(self.listener.delivered, [('worklog', [1, 2], False)])
+        self.assertEqual(self.outbox.pending(), 0)
+
+    def test_work_logs_with_other_batch_keys_wait_for_their_window(self):
+        self.hold_back(make_fact(1, 8, 9))
+        self.hold_back(make_fact(2, 9, 10, activity=u'PROJ-2 work'))
+        self.outbox._db.execute("UPDATE outbox SET next_attempt = 0 WHERE key LIKE 'worklog:1:%'")
+        self.assertEqual(self.outbox.flush(), 1)
+        self.assertEqual(self.listener.delivered, [('worklog', 1, False)])
+        self.assertEqual(self.outbox.pending(), 1)
+
+    def test_nothing_is_sent_before_the_first_window_is_over(self):
+        self.hold_back(make_fact(1, 8, 9))
+        self.hold_back(make_fact(2, 9, 10))
+        self.assertEqual(self.outbox.flush(), 0)
+
+    def test_merged_work_logs_are_retried_together(self):
+        self.listener.failures = 1
+        self.hold_back(make_fact(1, 8, 9))
+        self.hold_back(make_fact(2, 9, 10), delay=90)
+        self.outbox._db.execute("UPDATE outbox SET next_attempt = 0 WHERE key LIKE 'worklog:1:%'")
+        self.assertEqual(self.outbox.flush(), 0)
+        self.assertEqual(len(set(self.next_attempts())), 1)
+        self.make_due()
+        self.assertEqual(self.outbox.flush(), 2)
+        self.assertEqual(self.listener.delivered, [('worklog', [1, 2], True)])
+
+
+class UpdatingListener(BatchingListener):
+    """
+    Records the work logs it creates and updates them on edits, like the bugtracker listeners do.
+    """
+
+    def deliver(self, action, payload, retry=False):
+        if action == 'update':
+            known = self.worklog_to_update(payload)
+            if known is None:
+                return False
+            if known is not NEW_WORKLOG:
+                self.delivered.append(('update', payload['id'], known.worklog_id))
+                return True
+            action = 'worklog'
+        BatchingListener.deliver(self, action, payload, retry)
+        if action == 'worklog':
+            self.record_worklog(payload, u'PROJ-1', unicode(len(self.delivered)))
+        return True
+
+
+class PendingWorklogTest(OutboxTestCase):
+    """
+    An edit or deletion of a fact whose work log is not delivered yet changes that work log instead of logging twice.
+    """
+
+    def setUp(self):
+        super(PendingWorklogTest, self).setUp()
+        self.state = SyncState(os.path.join(self.directory, 'state.sqlite'))
+        self.listener = UpdatingListener()
+        self.outbox.register(self.listener)
+        self.state.register(self.listener)
+
+    def tearDown(self):
+        self.state.close()
+        super(PendingWorklogTest, self).tearDown()
+
+    def stop(self, fact):
+        payload = fact_payload(fact)
+        self.listener.submit('worklog', payload_key('worklog', payload), payload)
+
+    def edit(self, fact, previous):
+        payload = fact_payload(fact)
+        payload['previous_id'] = previous.id
+        self.listener.submit('update', '%s:%s' % (payload_key('update', payload), payload['hash']), payload)
+
+    def test_edit_replaces_a_batched_work_log(self):
+        previous = make_fact(1, 8, 9)
+        self.stop(previous)
+        self.edit(make_fact(5, 8, 10), previous)
+        self.assertEqual(self.listener.delivered, [])
+        self.make_due()
+        self.outbox.flush()
+        self.assertEqual(self.listener.delivered, [('worklog', 5, False)])
+        self.assertIsNone(self.state.get(self.listener, 1))
+        self.assertEqual(self.state.get(self.listener, 5).worklog_id, u'1')
+
+    def test_edit_replaces_a_work_log_waiting_for_its_retry(self):
+        self.listener.batch_window = 0
+        self.listener.failures = 1
+        previous = make_fact(1, 8, 9)
+        self.stop(previous)
+        self.edit(make_fact(1, 8, 10), previous)
+        self.make_due()
+        self.outbox.flush()
+        self.assertEqual(self.listener.delivered, [('worklog', 1, True)])
+
+    def test_edit_of_a_work_log_being_delivered_is_retried(self):
+        previous = make_fact(1, 8, 9)
+        self.stop(previous)
+        key = self.outbox._db.execute('SELECT key FROM outbox').fetchone()[0]
+        self.outbox._in_flight.add((self.listener.short_name, key))
+        self.edit(make_fact(1, 8, 10), previous)
+        self.assertEqual(self.listener.delivered, [])
+        self.assertEqual(self.outbox.pending(), 2)
+
+    def test_edit_updates_a_delivered_work_log(self):
+        previous = make_fact(1, 8, 9)
+        self.stop(previous)
+        self.make_due()
+        self.outbox.flush()
+        self.edit(make_fact(5, 8, 10), previous)
+        self.assertEqual(self.listener.delivered, [('worklog', 1, False), ('update', 5, u'1')])
+
+    def test_edit_leaves_a_merged_work_log_alone(self):
+        previous = make_fact(1, 8, 9)
+        self.stop(previous)
+        self.stop(make_fact(2, 9, 10))
+        self.make_due()
+        self.outbox.flush()
+        self.edit(make_fact(1, 8, 10), previous)
+        self.assertEqual(self.listener.delivered, [('worklog', [1, 2], False)])
+
+    def test_edit_logs_a_fact_that_was_not_logged_yet(self):
+        self.edit(make_fact(5, 8, 10), make_fact(1, 8, 9))
+        self.assertEqual(self.listener.delivered, [('worklog', 5, False)])
+
+    def test_deletion_cancels_a_pending_work_log(self):
+        fact = make_fact(1, 8, 9)
+        self.stop(fact)
+        self.assertTrue(self.listener.replace_pending_worklog(fact.id, None))
+        self.make_due()
+        self.assertEqual(self.outbox.flush(), 0)
+        self.assertEqual(self.listener.delivered, [])
+        self.assertEqual(self.outbox.pending(), 0)
+        # still rejected if journaled again
+        self.stop(fact)
+        self.assertEqual(self.outbox.pending(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
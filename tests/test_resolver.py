@@ -0,0 +1,79 @@
+import unittest
+
+from hamster_bridge.listeners.resolver import IssueResolver, KnownProjects
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class KnownProjectsTest(unittest.TestCase):
+    """
+    The known projects are reloaded after their time to live and, rate limited, when an unknown project shows up.
+    """
+
+    def setUp(self):
+        self.clock = Clock()
+        self.projects = ['PROJ']
+        self.loads = 0
+        self.known = KnownProjects(self.load, ttl=3600, min_reload=60, timer=self.clock)
+
+    def load(self):
+        self.loads += 1
+        return self.projects
+
+    def test_loaded_on_first_use(self):
+        self.assertIn('PROJ', self.known)
+        self.assertIn('PROJ', self.known)
+        self.assertEqual(self.loads, 1)
+
+    def test_new_project_is_known_after_reload(self):
+        self.assertNotIn('NEW', self.known)
+        self.projects = ['PROJ', 'NEW']
+        self.clock.now += 10
+        self.assertNotIn('NEW', self.known)
+        self.clock.now += 60
+        self.assertIn('NEW', self.known)
+        self.assertEqual(self.loads, 2)
+
+    def test_reloaded_after_ttl(self):
+        self.assertIn('PROJ', self.known)
+        self.projects = []
+        self.clock.now += 3600
+        self.assertNotIn('PROJ', self.known)
+
+    def test_any_project_while_they_can_not_be_loaded(self):
+        self.projects = None
+        self.assertIn('PROJ', self.known)
+        self.assertIn('OTHER', self.known)
+
+
+class IssueResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.projects = ['PROJ']
+        self.clock = Clock()
+        self.resolver = IssueResolver(['[A-Z]+-[0-9]+'], project_of=lambda key: key.rsplit('-', 1)[0])
+        self.resolver.set_known_projects(KnownProjects(lambda: self.projects, min_reload=60, timer=self.clock))
+
+    def resolve(self, activity):
+        payload = {'id': 1, 'activity': activity, 'tags': [], 'description': None}
+        return self.resolver.resolve(payload, lambda key: True)
+
+    def test_keys_of_unknown_projects_are_skipped(self):
+        self.assertEqual(self.resolve(u'NEW-1 PROJ-2'), u'PROJ-2')
+
+    def test_lack_of_issue_is_not_remembered_if_a_project_was_unknown(self):
+        self.assertIsNone(self.resolve(u'NEW-1'))
+        self.projects = ['PROJ', 'NEW']
+        self.clock.now += 60
+        self.assertEqual(self.resolve(u'NEW-1'), u'NEW-1')
+
+
+if __name__ == '__main__':
+    unittest.main()
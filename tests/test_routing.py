@@ -0,0 +1,73 @@
+import ConfigParser
+import unittest
+
+from hamster_bridge.routing import FactRouter
+from tests import RecordingListener, make_fact
+
+
+class FactRouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.jira = RecordingListener('jira')
+        self.redmine = RecordingListener('redmine')
+        self.recorder = RecordingListener()
+        self.listeners = [self.jira, self.redmine, self.recorder]
+        self.router = FactRouter({
+            'jira': [('category', 'Product'), ('tag', 'jira')],
+            'redmine': [('category', 'Ops'), ('activity', 'ops-.*')],
+        })
+
+    def routed(self, **kwargs):
+        return [listener.short_name for listener in self.router.route(make_fact(1, 8, **kwargs), self.listeners)]
+
+    def test_matching_category(self):
+        self.assertEqual(self.routed(category=u'product'), ['jira', 'recorder'])
+        self.assertEqual(self.routed(category=u'Ops'), ['redmine', 'recorder'])
+
+    def test_matching_activity_and_tag(self):
+        self.assertEqual(self.routed(activity=u'ops-backup'), ['redmine', 'recorder'])
+        self.assertEqual(self.routed(tags=[u'meeting', u'JIRA']), ['jira', 'recorder'])
+        self.assertEqual(self.routed(category=u'Product', activity=u'ops-deploy'), ['jira', 'redmine', 'recorder'])
+
+    def test_whole_value_must_match(self):
+        self.assertEqual(self.routed(category=u'Products'), ['recorder'])
+        self.assertEqual(self.routed(activity=u'devops-backup'), ['recorder'])
+
+    def test_not_matching(self):
+        self.assertEqual(self.routed(), ['recorder'])
+        fact = make_fact(1, 8, category=u'Ops')
+        self.assertFalse(self.router.accepts(self.jira, fact))
+        self.assertTrue(self.router.accepts(self.redmine, fact))
+
+    def test_listeners_without_a_rule_get_all_facts(self):
+        self.assertTrue(self.router.accepts(self.recorder, make_fact(1, 8)))
+        router = FactRouter()
+        self.assertEqual(router.route(make_fact(1, 8), self.listeners), self.listeners)
+        self.assertTrue(router.accepts(self.jira, make_fact(1, 8)))
+
+    def test_memo(self):
+        self.routed(category=u'Ops', tags=[u'jira'])
+        # the rules are not evaluated again for a fact with the same activity, category and tags
+        self.router._compiled = {'jira': {}, 'redmine': {}}
+        self.assertEqual(self.routed(category=u'Ops', tags=[u'jira']), ['jira', 'redmine', 'recorder'])
+        self.assertEqual(self.routed(category=u'Ops'), ['recorder'])
+
+    def test_from_config(self):
+        config = ConfigParser.RawConfigParser()
+        config.add_section('routing')
+        config.set('routing', 'jira', 'Category:Product tag:jira')
+        router = FactRouter.from_config(config)
+        self.assertEqual(router.rules, {'jira': [('category', 'Product'), ('tag', 'jira')]})
+        self.assertEqual(FactRouter.from_config(ConfigParser.RawConfigParser()), FactRouter())
+
+    def test_invalid_rules(self):
+        self.assertRaises(ValueError, FactRouter, {'jira': [('project', 'PROJ')]})
+        self.assertRaises(ValueError, FactRouter, {'jira': [('tag', '(jira')]})
+        config = ConfigParser.RawConfigParser()
+        config.add_section('routing')
+        config.set('routing', 'jira', 'Product')
+        self.assertRaises(ValueError, FactRouter.from_config, config)
+
+
+if __name__ == '__main__':
+    unittest.main()
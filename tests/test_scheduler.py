@@ -0,0 +1,89 @@
+import unittest
+
+from hamster_bridge.scheduler import AdaptivePoller
+
+
+class FakeClocks(object):
+    """
+    A wall clock and a monotonic clock, both only moving when sleeping. A suspend moves the wall clock only.
+    """
+
+    def __init__(self, wall=1000.0):
+        self.wall = wall
+        self.monotonic = 0.0
+
+    def sleep(self, seconds, suspend=0):
+        self.wall += seconds + suspend
+        self.monotonic += seconds
+
+
+class AdaptivePollerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clocks = FakeClocks()
+        self.suspend = 0
+        self.poller = AdaptivePoller(
+            min_interval=2,
+            max_interval=60,
+            settle=10,
+            clock=lambda: self.clocks.wall,
+            monotonic=lambda: self.clocks.monotonic,
+            sleep=lambda seconds: self.clocks.sleep(seconds, self.suspend),
+        )
+
+    def poll(self, changed=False):
+        delay = self.poller.next_delay(changed)
+        self.poller.sleep(delay)
+        return delay
+
+    def intervals(self, checks):
+        intervals = []
+        for _ in range(checks):
+            self.poll()
+            intervals.append(self.poller.interval)
+        return intervals
+
+    def test_settle_then_back_off_up_to_the_maximum(self):
+        self.poll(changed=True)
+        # 10 seconds at the minimum interval, then doubling it up to the maximum
+        self.assertEqual(self.intervals(10), [2, 2, 2, 2, 4, 8, 16, 32, 60, 60])
+
+    def test_change_resets_the_interval(self):
+        self.intervals(10)
+        self.assertEqual(self.poller.interval, 60)
+        self.poll(changed=True)
+        self.assertEqual(self.poller.interval, 2)
+
+    def test_fixed_interval(self):
+        poller = AdaptivePoller(5, 5, settle=0, clock=lambda: 1000.0, monotonic=lambda: 0.0)
+        self.assertEqual([poller.next_delay(False) for _ in range(3)], [5, 5, 5])
+        self.assertEqual(AdaptivePoller(5, 1).max_interval, 5)
+
+    def test_wakeups_are_aligned_to_the_wall_clock(self):
+        self.intervals(10)
+        for _ in range(3):
+            self.poll()
+            self.assertEqual(self.clocks.wall % 60, 0)
+
+    def test_no_wakeup_right_away(self):
+        self.poller.interval = 30
+        self.clocks.wall = 1019.5
+        # the next multiple of 2 is only half a second ahead
+        self.assertEqual(self.poller.next_delay(True), 2.5)
+
+    def test_resume_after_suspend(self):
+        self.intervals(10)
+        self.suspend = 3600
+        self.assertTrue(self.poller.sleep(self.poller.next_delay(False)))
+        self.assertEqual(self.poller.interval, 2)
+        self.suspend = 0
+        # settles again before backing off
+        self.assertEqual(self.intervals(6), [2, 2, 2, 2, 2, 4])
+
+    def test_short_clock_jump_is_no_suspend(self):
+        self.suspend = 5
+        self.assertFalse(self.poller.sleep(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
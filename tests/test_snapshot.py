@@ -0,0 +1,75 @@
+import datetime
+import unittest
+
+from hamster_bridge.snapshot import FactIndex
+from tests import DAY, make_fact
+
+
+class FactIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = FactIndex()
+        self.today = DAY.date()
+
+    def update(self, *facts):
+        return self.index.update(list(facts), today=self.today)
+
+    def test_first_update_reports_all_facts_as_created(self):
+        diff = self.update(make_fact(1, 8, 9), make_fact(2, 9))
+        self.assertEqual([fact.id for fact in diff.created], [1, 2])
+        self.assertEqual((diff.stopped, diff.edited, diff.deleted), ([], [], []))
+
+    def test_unchanged_facts_are_not_reported(self):
+        self.update(make_fact(1, 8, 9))
+        diff = self.update(make_fact(1, 8, 9))
+        self.assertEqual(diff, ([], [], [], []))
+
+    def test_stopped_fact(self):
+        self.update(make_fact(1, 8))
+        diff = self.update(make_fact(1, 8, 9))
+        self.assertEqual([fact.id for fact in diff.stopped], [1])
+        self.assertEqual((diff.created, diff.edited, diff.deleted), ([], [], []))
+
+    def test_edited_fact(self):
+        self.update(make_fact(1, 8, 9, description=u'a'))
+        diff = self.update(make_fact(1, 8, 9, description=u'b'))
+        self.assertEqual([(old.description, new.description) for old, new in diff.edited], [(u'a', u'b')])
+
+    def test_deleted_fact(self):
+        self.update(make_fact(1, 8, 9), make_fact(2, 9, 10))
+        diff = self.update(make_fact(2, 9, 10))
+        self.assertEqual([fact.id for fact in diff.deleted], [1])
+
+    def test_fact_of_an_earlier_day_rolls_out_silently(self):
+        self.update(make_fact(1, 8, 9))
+        diff = self.index.update([], today=self.today + datetime.timedelta(days=1))
+        self.assertEqual(diff, ([], [], [], []))
+
+    def test_fact_after_midnight_rolls_out_with_its_day(self):
+        self.index = FactIndex(day_start=datetime.time(5, 30))
+        # started at 01:00 of the next day, still on the same day for hamster
+        self.update(make_fact(1, 8, 9), make_fact(2, 25, 26))
+        diff = self.index.update([], today=self.today + datetime.timedelta(days=1))
+        self.assertEqual(diff, ([], [], [], []))
+
+    def test_new_id_with_same_start_is_an_edit(self):
+        self.update(make_fact(1, 8, 9))
+        diff = self.update(make_fact(5, 8, 10))
+        self.assertEqual([(old.id, new.id) for old, new in diff.edited], [(1, 5)])
+        self.assertEqual((diff.created, diff.deleted), ([], []))
+
+    def test_new_id_with_same_start_stopping_a_running_fact_is_a_stop(self):
+        self.update(make_fact(1, 8))
+        diff = self.update(make_fact(5, 8, 9))
+        self.assertEqual([fact.id for fact in diff.stopped], [5])
+        self.assertEqual((diff.created, diff.edited, diff.deleted), ([], [], []))
+
+    def test_new_id_with_other_start_is_delete_and_create(self):
+        self.update(make_fact(1, 8, 9))
+        diff = self.update(make_fact(5, 10, 11))
+        self.assertEqual([fact.id for fact in diff.created], [5])
+        self.assertEqual([fact.id for fact in diff.deleted], [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import sys
+import types
+import unittest
+
+
+class GObject(object):
+
+    def __init__(self):
+        self.gobject_initialized = True
+
+
+class Storage(GObject):
+    """
+    Like hamster.client.Storage, which connects to the session bus in its constructor.
+    """
+
+    def __init__(self):
+        raise AssertionError('connected to the session bus')
+
+
+class BusConnection(object):
+
+    def __init__(self, address):
+        self.address = address
+        self.receivers = []
+
+    def add_signal_receiver(self, handler, signal_name, dbus_interface):
+        self.receivers.append((signal_name, dbus_interface, handler))
+
+
+class DBusSourceTest(unittest.TestCase):
+    """
+    The dbus source talks to hamster on the given bus without needing a session bus.
+    """
+
+    def setUp(self):
+        self.modules = {}
+        for name in ('hamster', 'hamster.client', 'dbus', 'dbus.bus'):
+            self.modules[name] = sys.modules.get(name)
+            sys.modules[name] = types.ModuleType(name)
+        sys.modules['hamster'].client = sys.modules['hamster.client']
+        sys.modules['hamster.client'].Storage = Storage
+        sys.modules['dbus'].bus = sys.modules['dbus.bus']
+        sys.modules['dbus.bus'].BusConnection = BusConnection
+
+    def tearDown(self):
+        for name, module in self.modules.items():
+            if module is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = module
+
+    def test_storage_uses_the_given_bus(self):
+        from hamster_bridge.sources.dbus import DBusSource
+
+        source = DBusSource(bus_address='unix:path=/run/user/1000/bus')
+        self.assertIsInstance(source.storage, Storage)
+        self.assertTrue(source.storage.gobject_initialized)
+        self.assertEqual(source.storage.bus.address, 'unix:path=/run/user/1000/bus')
+        self.assertIsNone(source.storage._connection)
+
+    def test_signals_of_the_given_bus(self):
+        from hamster_bridge.sources.dbus import DBusSource
+
+        source = DBusSource(bus_address='unix:path=/run/user/1000/bus')
+        signals = []
+        self.assertTrue(source.connect_changed(signals.append))
+        for signal_name, interface, handler in source.bus.receivers:
+            self.assertEqual(interface, 'org.gnome.Hamster')
+            handler()
+        self.assertEqual(signals, ['FactsChanged', 'ActivitiesChanged'])
+
+
+if __name__ == '__main__':
+    unittest.main()
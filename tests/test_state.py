@@ -0,0 +1,75 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from hamster_bridge.listeners import fact_payload
+from hamster_bridge.state import SyncState
+from tests import RecordingListener, make_fact
+
+
+class SyncStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'state.sqlite')
+        self.state = SyncState(self.path)
+        self.listener = RecordingListener()
+        self.state.register(self.listener)
+
+    def tearDown(self):
+        self.state.close()
+        shutil.rmtree(self.directory)
+
+    def test_unknown_fact(self):
+        self.assertIsNone(self.state.get(self.listener, 1))
+
+    def test_mark_start_and_worklog(self):
+        payload = fact_payload(make_fact(1, 8, 9))
+        self.state.mark(self.listener, 'start', payload)
+        known = self.state.get(self.listener, 1)
+        self.assertTrue(known.started)
+        self.assertFalse(known.stopped)
+        self.state.mark(self.listener, 'worklog', payload)
+        known = self.state.get(self.listener, 1)
+        self.assertTrue(known.stopped)
+        self.assertEqual(known.hash, payload['hash'])
+        self.assertEqual(known.start_time, payload['start_time'])
+
+    def test_states_are_per_listener(self):
+        self.state.mark(self.listener, 'worklog', fact_payload(make_fact(1, 8, 9)))
+        self.assertIsNone(self.state.get(RecordingListener('other'), 1))
+
+    def test_record_worklog_of_merged_facts(self):
+        self.state.record_worklog(self.listener, [1, 2], 'PROJ-1', 10)
+        self.assertEqual(sorted(self.state.facts_of_worklog(self.listener, 'PROJ-1', 10)), [1, 2])
+        self.assertEqual(self.state.get(self.listener, 2).worklog_id, u'10')
+
+    def test_forget(self):
+        self.state.record_worklog(self.listener, [1], 'PROJ-1', 10)
+        self.state.forget(self.listener, 1)
+        self.assertIsNone(self.state.get(self.listener, 1))
+
+    def test_get_many_in_chunks(self):
+        self.state._chunk_size = 2
+        for fact_id in range(5):
+            self.state.mark(self.listener, 'start', fact_payload(make_fact(fact_id, 8)))
+        self.assertEqual(sorted(self.state.get_many(self.listener, range(10))), range(5))
+
+    def test_seed_marks_facts_as_handled(self):
+        self.state.seed(self.listener, [make_fact(1, 8, 9), make_fact(2, 9)])
+        self.assertTrue(self.state.get(self.listener, 1).stopped)
+        self.assertTrue(self.state.get(self.listener, 2).started)
+        self.assertFalse(self.state.get(self.listener, 2).stopped)
+
+    def test_last_check_survives_a_restart(self):
+        self.assertIsNone(self.state.last_check())
+        self.state.set_last_check(datetime.date(2015, 3, 2))
+        self.state.close()
+        self.state = SyncState(self.path)
+        self.assertEqual(self.state.last_check(), datetime.date(2015, 3, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from hamster_bridge.listeners import fact_payload, payload_key
+from hamster_bridge.outbox import Outbox
+from hamster_bridge.sources import FactSource
+from hamster_bridge.sync import Backfill
+from tests import DAY, RecordingListener, make_fact
+
+
+class ListSource(FactSource):
+
+    def __init__(self, facts):
+        self.facts_list = list(facts)
+
+    def facts(self, start_date, end_date):
+        return [fact for fact in self.facts_list if start_date <= fact.start_time.date() <= end_date]
+
+
+class BackfillTest(unittest.TestCase):
+    """
+    Only facts whose work log was delivered are skipped, the ones still waiting in the outbox are counted apart.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.outbox = Outbox(os.path.join(self.directory, 'outbox.sqlite'))
+        self.listener = RecordingListener()
+        self.outbox.register(self.listener)
+
+    def tearDown(self):
+        self.outbox.stop()
+        shutil.rmtree(self.directory)
+
+    def journal(self, fact):
+        payload = fact_payload(fact)
+        return self.outbox.add(self.listener, payload_key('worklog', payload), 'worklog', payload)
+
+    def sync(self, *facts):
+        return Backfill(ListSource(facts), self.listener, workers=2).run(DAY.date(), DAY.date())
+
+    def test_counts(self):
+        delivered, pending, new = make_fact(1, 8, 9), make_fact(2, 9, 10), make_fact(3, 10, 11)
+        self.outbox.mark_delivered([self.journal(delivered)])
+        self.journal(pending)
+        counts = self.sync(delivered, pending, new, make_fact(4, 11))
+        self.assertEqual(counts, {'uploaded': 1, 'skipped': 1, 'pending': 1, 'failed': 0})
+        self.assertEqual(self.listener.delivered, [('worklog', 3, True)])
+
+    def test_failed_entry_is_pending(self):
+        fact = make_fact(1, 8, 9)
+        self.outbox.mark_failed([self.journal(fact)], IOError('bugtracker is down'))
+        self.assertEqual(self.sync(fact)['pending'], 1)
+        self.assertEqual(self.listener.delivered, [])
+
+    def test_failed_upload(self):
+        self.listener.failures = 1
+        self.assertEqual(self.sync(make_fact(1, 8, 9))['failed'], 1)
+        self.assertEqual(self.outbox.pending(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import calendar
+import unittest
+
+from hamster_bridge.transport import RateLimiter, _seconds_until
+
+# 2026-10-18T12:00:00Z
+NOON = calendar.timegm((2026, 10, 18, 12, 0, 0))
+
+
+class SecondsUntilTest(unittest.TestCase):
+    """
+    The values of the Retry-After and X-RateLimit-Reset headers.
+    """
+
+    def assertSeconds(self, value, seconds):
+        self.assertAlmostEqual(_seconds_until(value, now=NOON), seconds)
+
+    def test_seconds(self):
+        self.assertSeconds('30', 30)
+
+    def test_unix_timestamp(self):
+        self.assertSeconds(str(NOON + 90), 90)
+
+    def test_http_date(self):
+        self.assertSeconds('Sun, 18 Oct 2026 12:01:00 GMT', 60)
+
+    def test_iso_8601(self):
+        self.assertSeconds('2026-10-18T12:05Z', 300)
+        self.assertSeconds('2026-10-18T12:05:30.5Z', 330.5)
+        self.assertSeconds('2026-10-18T14:05:00+02:00', 300)
+        self.assertSeconds('2026-10-18T07:05:00-0500', 300)
+        self.assertSeconds('2026-10-18T12:05:00', 300)
+
+    def test_past_is_now(self):
+        self.assertSeconds('2026-10-18T11:00Z', 0)
+
+    def test_invalid(self):
+        self.assertIsNone(_seconds_until('soon', now=NOON))
+
+
+class FakeClock(object):
+    """
+    A clock that only moves when sleeping.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def limiter(self, rate=0, burst=10):
+        return RateLimiter(rate=rate, burst=burst, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_no_limit(self):
+        limiter = self.limiter()
+        for _ in range(100):
+            self.assertEqual(limiter.acquire(write=True), 0)
+        self.assertEqual(self.clock.slept, [])
+
+    def test_burst_then_rate(self):
+        limiter = self.limiter(rate=2, burst=2)
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertAlmostEqual(limiter.acquire(), 0.5)
+        self.assertAlmostEqual(limiter.acquire(), 0.5)
+
+    def test_tokens_refill_up_to_the_burst(self):
+        limiter = self.limiter(rate=1, burst=2)
+        limiter.acquire()
+        limiter.acquire()
+        self.clock.now += 60
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertAlmostEqual(limiter.acquire(), 1)
+
+    def test_pause_after_429_with_retry_after(self):
+        limiter = self.limiter()
+        self.assertAlmostEqual(limiter.learn(429, {'Retry-After': '30'}), 30)
+        self.assertAlmostEqual(limiter.acquire(), 30)
+        self.assertEqual(limiter.acquire(), 0)
+
+    def test_pause_after_429_without_retry_after(self):
+        limiter = self.limiter(rate=4)
+        self.assertEqual(limiter.learn(429, {}), RateLimiter.default_pause)
+        self.assertEqual(limiter.rate, 2)
+        self.assertAlmostEqual(limiter.acquire(), RateLimiter.default_pause)
+
+    def test_no_pause_after_success(self):
+        limiter = self.limiter(rate=4)
+        self.assertEqual(limiter.learn(200, {}), 0)
+        self.assertEqual(limiter.rate, 4)
+        self.assertEqual(limiter.acquire(), 0)
+
+    def test_announced_limit(self):
+        limiter = self.limiter()
+        limiter.learn(200, {
+            'X-RateLimit-FillRate': '10',
+            'X-RateLimit-Interval-Seconds': '5',
+            'X-RateLimit-Limit': '3',
+            'X-RateLimit-Remaining': '1',
+        })
+        self.assertEqual(limiter.rate, 2)
+        self.assertEqual(limiter.burst, 3)
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertAlmostEqual(limiter.acquire(), 0.5)
+
+    def test_no_requests_remaining_pauses_until_the_reset(self):
+        limiter = self.limiter()
+        self.assertAlmostEqual(limiter.learn(200, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '20'}), 20)
+        self.assertAlmostEqual(limiter.acquire(), 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+
+from hamster_bridge.listeners.workflow import TransitionGraph
+
+
+def transition(id, name, target, category='indeterminate'):
+    return {'id': id, 'name': name, 'to': {'id': target, 'statusCategory': {'key': category}}}
+
+
+# open -> in progress -> review -> done, reopen leads from done back to open
+OPEN = [transition(11, 'Start Progress', 3), transition(21, 'Close', 6, 'done')]
+IN_PROGRESS = [transition(31, 'Review', 4), transition(21, 'Close', 6, 'done')]
+REVIEW = [transition(41, 'Back to work', 3), transition(21, 'Close', 6, 'done')]
+DONE = [transition(51, 'Reopen', 1, 'new')]
+
+
+class TransitionGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = TransitionGraph('Start Progress')
+
+    def names(self, path):
+        return [transition.name for transition in path]
+
+    def test_direct(self):
+        self.graph.learn('1', OPEN)
+        self.assertEqual(self.graph.start_status(), '3')
+        self.assertEqual(self.names(self.graph.path('1')), ['Start Progress'])
+        self.assertEqual(self.graph.path('3'), [])
+
+    def test_multiple_hops(self):
+        self.graph.learn('1', OPEN)
+        self.graph.learn('6', DONE)
+        self.assertEqual(self.names(self.graph.path('6')), ['Reopen', 'Start Progress'])
+        self.assertEqual([transition.target for transition in self.graph.path('6')], ['1', '3'])
+
+    def test_unknown_status(self):
+        self.graph.learn('1', OPEN)
+        self.assertIsNone(self.graph.path('6'))
+        self.assertFalse(self.graph.knows('6'))
+
+    def test_unknown_start_status(self):
+        self.graph.learn('6', DONE)
+        self.assertIsNone(self.graph.start_status())
+        self.assertIsNone(self.graph.path('6'))
+
+    def test_in_progress_category_without_transition_name(self):
+        graph = TransitionGraph()
+        graph.learn('4', REVIEW)
+        self.assertEqual(graph.start_status(), '3')
+        self.assertEqual(self.names(graph.path('4')), ['Back to work'])
+
+    def test_transition_name_goes_before_the_category(self):
+        graph = TransitionGraph('Review')
+        graph.learn('1', OPEN)
+        self.assertEqual(graph.start_status(), '3')
+        graph.learn('3', IN_PROGRESS)
+        self.assertEqual(graph.start_status(), '4')
+
+    def test_forget(self):
+        self.graph.learn('1', OPEN)
+        self.graph.forget('1')
+        self.assertFalse(self.graph.knows('1'))
+        self.assertIsNone(self.graph.path('1'))
+
+    def test_explore_the_nearest_status_not_seen(self):
+        graph = TransitionGraph('Review')
+        graph.learn('1', [transition(61, 'Triage', 2, 'new'), transition(21, 'Close', 6, 'done')])
+        self.assertIsNone(graph.path('1'))
+        self.assertEqual(self.names(graph.explore('1')), ['Triage'])
+        # reached the status, its transitions are learned
+        graph.learn('2', [transition(31, 'Review', 4)])
+        self.assertEqual(self.names(graph.path('2')), ['Review'])
+
+    def test_explore_leaves_out_finished_statuses(self):
+        graph = TransitionGraph('Review')
+        graph.learn('1', OPEN)
+        graph.learn('3', [transition(21, 'Close', 6, 'done')])
+        self.assertIsNone(graph.explore('1'))
+
+
+if __name__ == '__main__':
+    unittest.main()